@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Benchmark the Python side of the scripts on a synthetic corpus.
+
+A corpus of RINEX files is generated by rnxgen.py, or an existing one is
+used. Then every benchmark times a hot path of a script: parsing names
+and TEQC reports, reading headers, comparing meta-infomation, planning
+placement, walking directories and the native engines. External tools
+are not run. Throughput in files/s and MB/s, and peak memory traced by
+tracemalloc, are saved into a JSON file with the commit, so regressions
+are found by comparing the results of two commits.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+from collections import namedtuple
+import argparse
+import datetime
+import fnmatch
+import gc
+import glob
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import yaml
+
+import hatanaka
+import makesubnet
+import metacheck
+import orderfile
+import qualitycheck
+import rinexqc
+import rnxgen
+import rnxname
+import sitecheck
+import subnet
+import toolrun
+import unificate
+
+# rounds of benchmarks on names, which are too fast to time once
+NAME_ROUNDS = 200
+# a benchmark is a regression if it is slower by the ratio
+THRESHOLD = 0.1
+Corpus = namedtuple('Corpus', 'root scratch files obs2 obs3 crx navs sums '
+                              'sites sitesinfo start days')
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark function by name. A benchmark function takes
+    a Corpus and returns count of files and bytes processed.
+    """
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+
+    return register
+
+
+def file_size(files):
+    """Return total size of files in bytes."""
+    return sum(os.path.getsize(name) for name in files)
+
+
+def load_corpus(root, scratch):
+    """Collect files of a corpus made by rnxgen.py, Compact RINEX files
+    of the observation files are made in scratch directory.
+    """
+    files = sorted(name for name in glob.glob(os.path.join(root, '**'),
+                                              recursive=True)
+                   if os.path.isfile(name))
+    records = rnxname.classify(files)
+    obs = [name for name, rec in records.items() if rec.kind == 'o']
+    obs2 = [name for name in obs if records[name].source == '']
+    obs3 = [name for name in obs if records[name].source != '']
+    crx = []
+    for src_file in obs:
+        dst_file = os.path.join(scratch, os.path.basename(src_file))
+        dst_file = dst_file[0:-1] + 'd' if src_file in obs2 else \
+            dst_file[0:-3] + 'crx'
+        hatanaka.compress_file(src_file, dst_file)
+        crx.append(dst_file)
+    with open(os.path.join(root, '_sitesinfo.yml')) as cfg_reader:
+        sitesinfo = yaml.safe_load(cfg_reader)
+    sites = sorted(set(rec.site for rec in records.values()))
+    dates = sorted(set((rec.year, rec.doy) for rec in records.values()))
+    start = datetime.date(dates[0][0], 1, 1) + datetime.timedelta(
+        days=dates[0][1] - 1)
+
+    return Corpus(root, scratch, files, obs2, obs3, crx,
+                  [name for name, rec in records.items() if rec.kind == 'n'],
+                  [name for name, rec in records.items() if rec.kind == 's'],
+                  sites, sitesinfo, start, len(dates))
+
+
+@benchmark('rnxname.parse')
+def bench_parse_names(corpus):
+    names = [os.path.basename(name) for name in corpus.files]
+    # time the parser itself, cache hits of later rounds would hide it
+    parse = rnxname.parse.__wrapped__
+    for _ in range(NAME_ROUNDS):
+        for name in names:
+            parse(name)
+
+    return len(names) * NAME_ROUNDS, 0
+
+
+@benchmark('qualitycheck.parse_report')
+def bench_parse_report(corpus):
+    reports = []
+    for sum_file in corpus.sums:
+        with open(sum_file) as sum_reader:
+            reports.append(sum_reader.read().splitlines())
+    for report in reports:
+        qualitycheck.parse_report(report)
+
+    return len(reports), file_size(corpus.sums)
+
+
+@benchmark('qualitycheck.summary_marks')
+def bench_summary(corpus):
+    for sum_file in corpus.sums:
+        qualitycheck.summary_marks(sum_file, None)
+
+    return len(corpus.sums), file_size(corpus.sums)
+
+
+@benchmark('rinexqc.quality_check')
+def bench_native_qc(corpus):
+    for obs_file in corpus.obs2:
+        rinexqc.quality_check(obs_file)
+
+    return len(corpus.obs2), file_size(corpus.obs2)
+
+
+@benchmark('metacheck.load_meta')
+def bench_load_meta(corpus):
+    obs = corpus.obs2 + corpus.obs3
+    for obs_file in obs:
+        metacheck.load_meta(obs_file, None, None)
+
+    # only headers are read
+    return len(obs), 0
+
+
+@benchmark('metacheck.compare_info')
+def bench_compare_info(corpus):
+    obs = corpus.obs2 + corpus.obs3
+    metas = [(rnxname.site_of(name), metacheck.load_meta(name, None, None))
+             for name in obs]
+    for _ in range(NAME_ROUNDS):
+        for site, meta in metas:
+            metacheck.compare_info(meta, corpus.sitesinfo[site], 10)
+
+    return len(metas) * NAME_ROUNDS, 0
+
+
+@benchmark('sitecheck.is_correct_rinex')
+def bench_correct_rinex(corpus):
+    names = [os.path.basename(name) for name in corpus.files]
+    year, doy = corpus.start.year, int(corpus.start.strftime('%j'))
+    for _ in range(NAME_ROUNDS):
+        for name in names:
+            sitecheck.is_correct_rinex(name, year, doy)
+
+    return len(names) * NAME_ROUNDS, 0
+
+
+@benchmark('sitecheck.check_range')
+def bench_check_range(corpus):
+    end = corpus.start + datetime.timedelta(days=corpus.days - 1)
+    sitecheck.check_range([corpus.root], corpus.sites, corpus.start, end,
+                          True)
+
+    return len(corpus.files), 0
+
+
+@benchmark('glob.recursive')
+def bench_glob(corpus):
+    count = len(glob.glob(os.path.join(corpus.root, '**', '*'),
+                          recursive=True))
+
+    return count, 0
+
+
+@benchmark('orderfile.which_dir')
+def bench_which_dir(corpus):
+    for _ in range(NAME_ROUNDS):
+        for name in corpus.files:
+            orderfile.which_dir(name)
+
+    return len(corpus.files) * NAME_ROUNDS, 0
+
+
+@benchmark('orderfile.make_plan')
+def bench_make_plan(corpus):
+    orderfile.make_plan(corpus.files, os.path.join(corpus.scratch, 'daily'))
+
+    return len(corpus.files), 0
+
+
+@benchmark('subnet.which_nets')
+def bench_which_nets(corpus):
+    positions = makesubnet.config_positions(corpus.sitesinfo)
+    sites = sorted(positions)
+    nets = max(1, len(sites) // 5)
+    clusters = makesubnet.partition([positions[site] for site in sites],
+                                    nets, min(3, len(sites)))
+    subnets = {'net{}'.format(idx): {sites[num] for num in cluster}
+               for idx, cluster in enumerate(clusters)}
+    for _ in range(NAME_ROUNDS):
+        for name in corpus.files:
+            subnet.which_nets(name, subnets)
+
+    return len(corpus.files) * NAME_ROUNDS, 0
+
+
+@benchmark('makesubnet.partition')
+def bench_partition(corpus):
+    rng = random.Random(0)
+    sites = rnxgen.site_names(1000, rng)
+    points = np.array([[float(num) for num in rnxgen.site_info(
+        site, 0)['position'].split()] for site in sites])
+    makesubnet.partition(points, 20, 3)
+
+    return len(sites), 0
+
+
+@benchmark('unificate.teqc_args')
+def bench_teqc_args(corpus):
+    obs = corpus.obs2 + corpus.obs3
+    for _ in range(NAME_ROUNDS):
+        for obs_file in obs:
+            siteinfo = unificate.get_info(rnxname.site_of(obs_file),
+                                          corpus.sitesinfo)
+            unificate.teqc_args(siteinfo)
+
+    return len(obs) * NAME_ROUNDS, 0
+
+
+@benchmark('unificate.filter_file')
+def bench_filter(corpus):
+    out_dir = os.path.join(corpus.scratch, 'unificated')
+    os.makedirs(out_dir, exist_ok=True)
+    siteinfo = {'interval': 60, 'rm_sys': ['R'], 'observer': 'pinot'}
+    for obs_file in corpus.obs2:
+        unificate.filter_file(obs_file, siteinfo, out_dir, True)
+
+    return len(corpus.obs2), file_size(corpus.obs2)
+
+
+@benchmark('hatanaka.compress')
+def bench_compress(corpus):
+    obs = corpus.obs2 + corpus.obs3
+    for obs_file in obs:
+        with open(obs_file) as rnx_reader:
+            for _ in hatanaka.compress(rnx_reader):
+                pass
+
+    return len(obs), file_size(obs)
+
+
+@benchmark('hatanaka.decompress')
+def bench_decompress(corpus):
+    for crx_file in corpus.crx:
+        with open(crx_file) as crx_reader:
+            for _ in hatanaka.decompress(crx_reader):
+                pass
+
+    return len(corpus.crx), file_size(corpus.crx)
+
+
+def run_benchmark(function, corpus, repeat):
+    """Run a benchmark, the best time of repeat runs is used, and peak
+    memory is traced in another run. Return a dict of result.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        files, size = function(corpus)
+        best = min(best, time.perf_counter() - start)
+    # tracing slows the run, so it is not timed
+    gc.collect()
+    tracemalloc.start()
+    function(corpus)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'files': files, 'bytes': size, 'seconds': best,
+            'files_per_s': files / best if best else float('inf'),
+            'mb_per_s': size / 2**20 / best if best else float('inf'),
+            'peak_kb': peak / 1024}
+
+
+def git_commit():
+    """Return the commit of the source code, None if unknown."""
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    args = 'git', '-C', src_dir, 'rev-parse', 'HEAD'
+    try:
+        result = toolrun.call(args, select=lambda line: True, timeout=30,
+                              retries=0)
+    except OSError:
+        return None
+
+    return result.output[0] if result.status == 0 and result.output else None
+
+
+def compare(old, new, threshold=THRESHOLD):
+    """Compare throughput of benchmarks in two results, return a list of
+    names of the regressions.
+
+    Example:
+
+    >>> old = {'results': {'a': {'files_per_s': 100}}}
+    >>> new = {'results': {'a': {'files_per_s': 50}}}
+    >>> compare(old, new)
+    a                                   100.0       50.0    -50.0%  REGRESSION
+    ['a']
+    """
+    regressions = []
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            continue
+        before, after = old['results'][name]['files_per_s'], \
+            result['files_per_s']
+        change = after / before - 1 if before else 0
+        flag = ''
+        if change < -threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        print('{: <30s} {:10.1f} {:10.1f} {:+9.1%}  {}'.format(
+            name, before, after, change, flag).rstrip())
+
+    return regressions
+
+
+def init_args():
+    """Initilize function, parse user input"""
+    # initilize a argument parser
+    parser = argparse.ArgumentParser(
+        description='Benchmark scripts on a synthetic RINEX corpus.'
+    )
+    # add arguments
+    parser.add_argument('-v', '--version', action='version',
+                        version='%(prog)s 0.1.0')
+    parser.add_argument('-corpus', metavar='<directory>',
+                        help='existing corpus made by rnxgen.py '
+                             '[default: generate a new one]')
+    parser.add_argument('-sites', metavar='<number>', default=10, type=int,
+                        help='sites of a new corpus [default: 10]')
+    parser.add_argument('-days', metavar='<number>', default=2, type=int,
+                        help='days of a new corpus [default: 2]')
+    parser.add_argument('-hours', metavar='<hours>', default=6, type=float,
+                        help='hours of a day of a new corpus [default: 6]')
+    parser.add_argument('-sys', metavar='<systems>', default='GR',
+                        help='constellations of a new corpus [default: GR]')
+    parser.add_argument('-tree', metavar='<tree>', default='igs',
+                        choices=rnxgen.TREES,
+                        help='layout of a new corpus [default: igs]')
+    parser.add_argument('-only', metavar='<pattern>', default='*',
+                        help='run benchmarks whose name matches pattern')
+    parser.add_argument('-repeat', metavar='<number>', default=3, type=int,
+                        help='runs of every benchmark [default: 3]')
+    parser.add_argument('-out', metavar='<file>', default='_benchmark.json',
+                        help='result JSON file [default: _benchmark.json]')
+    parser.add_argument('-compare', metavar='<file>',
+                        help='result JSON file of an earlier run to compare')
+    parser.add_argument('-thd', metavar='<ratio>', default=THRESHOLD,
+                        type=float, help='slow down ratio of a regression '
+                        '[default: {}]'.format(THRESHOLD))
+
+    return parser.parse_args()
+
+
+def main():
+    """Main function."""
+    args = init_args()
+    tmp_dir = tempfile.mkdtemp(prefix='pinot-')
+    try:
+        root = args.corpus
+        if root is None:
+            root = os.path.join(tmp_dir, 'corpus')
+            sites = rnxgen.site_names(args.sites, random.Random(0))
+            print('Generate corpus: {} sites, {} days'.format(args.sites,
+                                                            args.days))
+            rnxgen.make_corpus(root, sites, datetime.date(2017, 8, 10),
+                               args.days, hours=args.hours,
+                               systems=args.sys.upper(), versions=(2, 3),
+                               tree=args.tree)
+            rnxgen.write_sitesinfo(os.path.join(root, '_sitesinfo.yml'),
+                                   sites, 0)
+        scratch = os.path.join(tmp_dir, 'scratch')
+        os.makedirs(scratch)
+        corpus = load_corpus(root, scratch)
+        corpus_size = file_size(corpus.files)
+        print('Corpus: {} files, {:.1f} MB\n'.format(len(corpus.files),
+                                                     corpus_size / 2**20))
+        header = 'benchmark', 'files/s', 'MB/s', 'seconds', 'peak KB'
+        print('{: <30s} {: >12s} {: >8s} {: >8s} {: >10s}'.format(*header))
+        results = {}
+        for name, function in BENCHMARKS.items():
+            if not fnmatch.fnmatch(name, args.only):
+                continue
+            result = run_benchmark(function, corpus, args.repeat)
+            results[name] = result
+            print('{: <30s} {:12.1f} {:8.2f} {:8.3f} {:10.1f}'.format(
+                name, result['files_per_s'], result['mb_per_s'],
+                result['seconds'], result['peak_kb']))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    report = {
+        'commit': git_commit(),
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': {'files': len(corpus.files), 'bytes': corpus_size,
+                   'sites': len(corpus.sites), 'days': corpus.days},
+        'results': results,
+    }
+    with open(args.out, 'w') as json_writer:
+        json.dump(report, json_writer, indent=2)
+    print('\nResults saved: {}'.format(args.out))
+    if args.compare:
+        with open(args.compare) as json_reader:
+            old = json.load(json_reader)
+        print('\nCompare with {}:'.format(old.get('commit')))
+        if compare(old, report, args.thd):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Open compressed files transparently.
+
+Files compressed by gzip (.gz), bzip2 (.bz2) and xz (.xz) are read by
+the standard library, Unix compress (.Z) by lzw.py, all decompressed in
+a stream without temporary files, plain files are opened as they are.
+A file can also be read from a pipe fed by a thread decompressing it,
+which is the stdin of an external tool, or the input of a native parser
+while the next block is being decompressed.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+import builtins
+import bz2
+import contextlib
+import gzip
+import io
+import lzma
+import os
+import shutil
+import threading
+
+import lzw
+
+OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open,
+           '.z': lzw.open}
+# bytes copied into a pipe at a time
+PIPE_CHUNK = 65536
+# errors raised by reading a corrupt or truncated compressed file
+ERRORS = OSError, EOFError, ValueError, lzma.LZMAError
+
+
+def suffix(path):
+    """Return compression suffix of path in lower case, empty string if
+    the file is not compressed.
+
+    Example:
+
+    >>> suffix('bjfs0420.17d.Z'), suffix('bjfs0420.17o')
+    ('.z', '')
+    """
+    ext = os.path.splitext(path)[1].lower()
+
+    return ext if ext in OPENERS else ''
+
+
+def strip(path):
+    """Remove compression suffix of path.
+
+    Example:
+
+    >>> strip('bjfs0420.17d.Z')
+    'bjfs0420.17d'
+    >>> strip('BJFS00CHN_R_20170420000_01D_30S_MO.crx.gz')
+    'BJFS00CHN_R_20170420000_01D_30S_MO.crx'
+    >>> strip('bjfs0420.17o')
+    'bjfs0420.17o'
+    """
+    return path[:-len(suffix(path))] if suffix(path) else path
+
+
+def open(path, mode='rb', encoding=None, errors=None, newline=None):
+    """Open a file for reading in binary or text mode, decompress it in
+    a stream if it is compressed.
+
+    Example:
+
+    >>> import tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> src_file = os.path.join(tmp_dir, 'bjfs0420.17o.bz2')
+    >>> with bz2.open(src_file, 'wt') as bz2_writer:
+    ...     _ = bz2_writer.write('line 1\\nline 2\\n')
+    >>> with open(src_file, 'rt') as src_reader:
+    ...     src_reader.readlines()
+    ['line 1\\n', 'line 2\\n']
+    >>> os.remove(src_file)
+    >>> os.rmdir(tmp_dir)
+    """
+    if mode not in ('r', 'rb', 'rt'):
+        raise ValueError('invalid mode: {}'.format(mode))
+    opener = OPENERS.get(suffix(path))
+    if opener is None:
+        return builtins.open(path, mode, encoding=encoding, errors=errors,
+                             newline=newline)
+    if 'b' in mode:
+        return opener(path, 'rb')
+
+    return opener(path, 'rt', encoding=encoding, errors=errors,
+                  newline=newline)
+
+
+def _feed(src_reader, pipe_writer, failures):
+    """Copy decompressed data into the pipe, failures are appended."""
+    try:
+        with src_reader, pipe_writer:
+            shutil.copyfileobj(src_reader, pipe_writer, PIPE_CHUNK)
+    except BrokenPipeError:
+        # the reader does not need the rest
+        pass
+    except ERRORS as error:
+        failures.append(error)
+
+
+@contextlib.contextmanager
+def open_pipe(path, mode='rb', encoding=None, errors=None, newline=None):
+    """Open a file for reading by a pipe, the file is decompressed by a
+    thread writing into the pipe, so decompression is overlapped with
+    reading. A plain file is opened directly. Raise ValueError when the
+    reader is closed if the file could not be decompressed.
+
+    Example:
+
+    >>> import tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> src_file = os.path.join(tmp_dir, 'bjfs0420.17o.gz')
+    >>> with gzip.open(src_file, 'wt') as gz_writer:
+    ...     _ = gz_writer.write('line\\n' * 100000)
+    >>> with open_pipe(src_file, 'rt') as src_reader:
+    ...     sum(1 for line in src_reader)
+    100000
+    >>> os.remove(src_file)
+    >>> os.rmdir(tmp_dir)
+    """
+    if not suffix(path):
+        with open(path, mode, encoding, errors, newline) as src_reader:
+            yield src_reader
+        return
+    src_reader = open(path, 'rb')
+    read_fd, write_fd = os.pipe()
+    failures = []
+    feeder = threading.Thread(target=_feed, daemon=True, args=(
+        src_reader, builtins.open(write_fd, 'wb'), failures))
+    feeder.start()
+    try:
+        with builtins.open(read_fd, 'rb') as pipe_reader:
+            if 'b' in mode:
+                yield pipe_reader
+            else:
+                yield io.TextIOWrapper(pipe_reader, encoding, errors,
+                                       newline)
+    finally:
+        feeder.join()
+    if failures:
+        raise ValueError('{}: {}'.format(os.path.basename(path),
+                                         failures[0]))
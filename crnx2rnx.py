@@ -4,7 +4,10 @@
 using concurent.futures.
 
 The convert function rely on RNXCMP software. Check if you have
-installed RNXCMP by typing `crx2rnx -h` in cmd.
+installed RNXCMP by typing `crx2rnx -h` in cmd. The native engine
+decompresses files in a process pool without RNXCMP. Files compressed
+by compress, gzip, bzip2 or xz are decompressed in a stream into the
+converter, without temporary files.
 
 :author: Jon Jiang
 :email: jiangyingming@live.com
@@ -12,37 +15,110 @@ installed RNXCMP by typing `crx2rnx -h` in cmd.
 from concurrent import futures
 from textwrap import shorten
 import argparse
+import contextlib
+import functools
 import glob
 import itertools
 import os
-import subprocess
 import sys
 
 import tqdm
 
-MAX_THREADING = min(4, os.cpu_count())
+import compressed
+import hatanaka
+import profiler
+import taskpool
+import telemetry
+import toolrun
+
+MAX_SUBPROCESS = min(4, os.cpu_count())
+MAX_PROCESS = os.cpu_count()
+
+
+def dst_path(src_file, out_dir):
+    """Return destination path of standard RINEX for a compact RINEX
+    file, return None if source file is already standard RINEX.
+
+    Example:
+
+    >>> dst_path('aggo0420.17d', 'rinex').replace('\\\\', '/')
+    'rinex/aggo0420.17o'
+    >>> dst_path('WARN00DEU_R_20170420000_01D_30S_MO.crx', '.')
+    ... # doctest: +ELLIPSIS
+    '...WARN00DEU_R_20170420000_01D_30S_MO.rnx'
+    >>> dst_path('bjfs0420.17d.Z', 'rinex').replace('\\\\', '/')
+    'rinex/bjfs0420.17o'
+    >>> dst_path('bjfs0420.17o', 'rinex') is None
+    True
+    """
+    filename = compressed.strip(os.path.basename(src_file))
+    # check if source file is already rinex file
+    if filename.lower().endswith('rnx') or filename.lower().endswith('o'):
+        return None
+    if filename.lower().endswith('crx'):
+        return os.path.join(out_dir, filename[0:-3]+'rnx')
 
+    return os.path.join(out_dir, filename[0:-1]+'o')
 
-def crx2rnx(src_file, out_dir, keep):
-    """Convert compact RINEX file to standard RINEX."""
+
+@profiler.staged('execute')
+async def crx2rnx(src_file, out_dir, keep, timeout=toolrun.TIMEOUT):
+    """Convert compact RINEX file to standard RINEX, return filename with
+    exit status if failed.
+    """
     filename = os.path.basename(src_file)
-    # check if source file is already rinex file
-    if filename.lower().endswith('rnx') or filename.lower().endswith('o'):
+    dst_file = dst_path(src_file, out_dir)
+    if dst_file is None:
         return
-    if filename.lower().endswith('crx'):
-        dst_file = os.path.join(out_dir, filename[0:-3]+'rnx')
-    else:
-        dst_file = os.path.join(out_dir, filename[0:-1]+'o')
     # run crx2rnx, redirect standard RINEX stdout into destination file
-    # and ignore the stderr.
-    args = 'crx2rnx', '-', src_file
-    with open(dst_file, 'w') as dst_writer:
-        status = subprocess.call(
-            args, stdout=dst_writer, stderr=subprocess.DEVNULL)
+    # and ignore the stderr, a compressed file is piped into stdin.
+    if compressed.suffix(src_file):
+        args, stdin = ('crx2rnx', '-'), functools.partial(
+            compressed.open_pipe, src_file)
+    else:
+        args, stdin = ('crx2rnx', '-', src_file), None
+    try:
+        dst_writer = open(dst_file, 'w')
+    except OSError as error:
+        return '{} ({})'.format(filename, error.strerror)
+    # the destination file is created, so remove it if failed
+    try:
+        with dst_writer:
+            result = await toolrun.run(args, stdout=dst_writer,
+                                       timeout=timeout, stdin=stdin)
+    except OSError as error:
+        os.remove(dst_file)
+        return '{} ({})'.format(filename, error.strerror)
+    except ValueError as error:
+        os.remove(dst_file)
+        return '{} ({})'.format(filename, error)
     # check exit status of crx2rnx: {0: success, 1: error, 2: warning}
-    if status == 1:
+    if result.status not in (0, 2):
         # if run crx2rnx failed, remove dest file and return filename
         os.remove(dst_file)
+        return '{} ({})'.format(filename, toolrun.describe(result))
+    # remove source file if keep is False when successful
+    if not keep:
+        os.remove(src_file)
+
+    return
+
+
+@profiler.staged('execute')
+def native_crx2rnx(src_file, out_dir, keep):
+    """Convert compact RINEX file to standard RINEX using the native
+    Hatanaka decompressor.
+    """
+    filename = os.path.basename(src_file)
+    dst_file = dst_path(src_file, out_dir)
+    if dst_file is None:
+        return
+    try:
+        hatanaka.decompress_file(src_file, dst_file)
+    except (OSError, ValueError, KeyError, IndexError):
+        # if decompress failed, remove dest file and return filename
+        if os.path.exists(dst_file):
+            os.remove(dst_file)
         return filename
     # remove source file if keep is False when successful
     if not keep:
@@ -51,18 +127,35 @@ def crx2rnx(src_file, out_dir, keep):
     return
 
 
-def parallel_run(function, argvs):
-    """Parallel run function using argvs, display a process bar."""
+def written_size(argv, res):
+    """Return bytes of the destination file written by a task."""
+    return telemetry.file_size(dst_path(*argv[0:2]))
+
+
+def parallel_run(function, argvs, executor=None,
+                 workers=MAX_SUBPROCESS, recorder=None):
+    """Parallel run function using argvs in executor, or run coroutine
+    function in an event loop if executor is None, display a process bar.
+    Every file is measured if recorder of telemetry is given."""
     # check platform, use ASCII process bar in Windows
-    use_ascii = True if sys.getwindowsversion().major < 10 else False
-    with futures.ThreadPoolExecutor(max_workers=MAX_THREADING) as executor:
-        todo_list = [executor.submit(function, *argv) for argv in argvs]
-        task_iter = futures.as_completed(todo_list)
+    use_ascii = True if sys.platform == 'win32' else False
+    window = workers * taskpool.WINDOW_PER_WORKER
+    with contextlib.ExitStack() as stack:
+        progress = stack.enter_context(
+            tqdm.tqdm(total=0, ascii=use_ascii, unit='file'))
+        argvs = taskpool.counted(argvs, progress)
+        function, argvs = telemetry.measure(recorder, function, argvs,
+                                            written_size)
+        if executor is None:
+            task_iter = toolrun.imap_unordered(function, argvs, workers)
+        else:
+            executor = stack.enter_context(executor(max_workers=workers))
+            task_iter = taskpool.imap_unordered(executor, function, argvs,
+                                                window)
         failed_files = []
-        for future in tqdm.tqdm(
-                task_iter, total=len(todo_list), ascii=use_ascii, unit='file'):
+        for _, res in telemetry.collect(recorder, task_iter):
+            progress.update()
             # return None means task is success
-            res = future.result()
             if res:
                 failed_files.append(res)
 
@@ -77,13 +170,26 @@ def init_args():
     )
     # add arguments
     parser.add_argument('-v', '--version', action='version',
-                        version='%(prog)s 0.2.3')
+                        version='%(prog)s 0.6.0')
     parser.add_argument('-k', '--keep', action='store_true',
                         help='keep original file')
     parser.add_argument('-r', '--recursive', action='store_true',
                         help='search file recursively')
     parser.add_argument('-out', metavar='<directory>', default='rinex',
                         help='output directory [default: rinex in current]')
+    parser.add_argument('-engine', metavar='<engine>', default='native',
+                        choices=['native', 'rnxcmp'],
+                        help='convert engine, native or rnxcmp '
+                             '[default: native]')
+    parser.add_argument('-timeout', metavar='<seconds>', type=float,
+                        default=toolrun.TIMEOUT,
+                        help='kill rnxcmp if it runs longer '
+                             '[default: {}]'.format(toolrun.TIMEOUT))
+    parser.add_argument('-telemetry', metavar='<file>',
+                        help='append telemetry of files into JSON lines')
+    parser.add_argument('-prom', metavar='<file>',
+                        help='write metrics for Prometheus textfile '
+                             'collector')
     parser.add_argument('files', metavar='<file>', nargs='+',
                         help='file will be processed')
 
@@ -100,12 +206,26 @@ def main():
     # collect input globstrs into a glob list
     globs = [glob.iglob(globstr, recursive=recursive) for globstr in globstrs]
     # make input args for crx2rnx function
-    conv_args = ((src, out_dir, keep_src) for src in itertools.chain(*globs))
+    srcs = itertools.chain(*globs)
     print('Start processing: {}'.format(shorten(', '.join(globstrs), 62)))
     if not keep_src:
         print('Delete source files when complete')
+    recorder = telemetry.open_recorder('crnx2rnx', args.telemetry,
+                                       args.prom)
     # start parallel task, get a file name list of convert failed.
-    failed = parallel_run(crx2rnx, conv_args)
+    try:
+        if args.engine == 'native':
+            conv_args = ((src, out_dir, keep_src) for src in srcs)
+            failed = parallel_run(native_crx2rnx, conv_args,
+                                  futures.ProcessPoolExecutor, MAX_PROCESS,
+                                  recorder)
+        else:
+            conv_args = ((src, out_dir, keep_src, args.timeout)
+                         for src in srcs)
+            failed = parallel_run(crx2rnx, conv_args, recorder=recorder)
+    finally:
+        if recorder is not None:
+            recorder.close()
     if failed:
         print('\nConvert failed filename: {}'.format(', '.join(failed)))
     else:
@@ -113,4 +233,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    profiler.run(main)
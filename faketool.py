@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Stand-in of the external tools TEQC, RNXCMP and runpkr00 for tests.
+
+The script behaves as teqc, crx2rnx, rnx2crx or runpkr00 by the name of
+the tool, it takes as long as the tool would, burns CPU, writes output
+of the given size, and fails or hangs at the given rates. So the
+parallel paths of the scripts can be tested on any system. Settings are
+read from environment variables:
+
+- PINOT_FAKE_LATENCY: median seconds of a run [default: 0.1];
+- PINOT_FAKE_JITTER: sigma of the lognormal latency [default: 0.5];
+- PINOT_FAKE_CPU: ratio of the time spent burning CPU [default: 0.5];
+- PINOT_FAKE_OUTPUT: KB of output [default: 64];
+- PINOT_FAKE_FAIL: rate of failing with exit status 1 [default: 0];
+- PINOT_FAKE_HANG: rate of hanging until killed [default: 0];
+- PINOT_FAKE_SEED: seed, a file always has the same fate [default: 0].
+
+The tool name is given by make_tools, which writes launchers of this
+script named as the tools into a directory to put on PATH. A file piped
+into stdin is read to the end, as the tools read a decompressed file.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+import datetime
+import math
+import os
+import random
+import sys
+import time
+
+TOOLS = 'teqc', 'crx2rnx', 'rnx2crx', 'runpkr00'
+SETTINGS = {
+    'latency': ('PINOT_FAKE_LATENCY', 0.1),
+    'jitter': ('PINOT_FAKE_JITTER', 0.5),
+    'cpu': ('PINOT_FAKE_CPU', 0.5),
+    'output': ('PINOT_FAKE_OUTPUT', 64),
+    'fail': ('PINOT_FAKE_FAIL', 0),
+    'hang': ('PINOT_FAKE_HANG', 0),
+    'seed': ('PINOT_FAKE_SEED', 0)
+}
+# a line of filler output
+FILLER = ' ' * 79 + '\n'
+
+
+def read_settings(environ):
+    """Read settings from environment variables, return a dict.
+
+    Example:
+
+    >>> settings = read_settings({'PINOT_FAKE_FAIL': '0.1'})
+    >>> settings['fail'], settings['latency']
+    (0.1, 0.1)
+    """
+    return {name: float(environ.get(key, default))
+            for name, (key, default) in SETTINGS.items()}
+
+
+def setting_env(**settings):
+    """Make environment variables of settings.
+
+    Example:
+
+    >>> setting_env(latency=0.5, hang=0.01)
+    {'PINOT_FAKE_LATENCY': '0.5', 'PINOT_FAKE_HANG': '0.01'}
+    """
+    return {SETTINGS[name][0]: str(value) for name, value in settings.items()}
+
+
+def work(seconds, cpu):
+    """Take seconds, the ratio cpu of it burning CPU, sleep the rest."""
+    deadline = time.perf_counter() + seconds * cpu
+    while time.perf_counter() < deadline:
+        math.sqrt(random.random())
+    time.sleep(seconds * (1 - cpu))
+
+
+def read_stdin():
+    """Read stdin to the end, return bytes read."""
+    if sys.stdin is None or sys.stdin.isatty():
+        return 0
+    size = 0
+    for block in iter(lambda: sys.stdin.buffer.read(65536), b''):
+        size += len(block)
+
+    return size
+
+
+def write_filler(writer, size):
+    """Write size KB of blank lines into writer."""
+    block = FILLER * 128
+    for _ in range(int(size * 1024) // len(block)):
+        writer.write(block)
+
+
+def run(tool, args, settings):
+    """Run as tool with arguments, return exit status."""
+    # the last argument is the file to process, but for runpkr00
+    src_file = args[-2] if tool == 'runpkr00' else args[-1]
+    rng = random.Random('{:g}-{}'.format(settings['seed'],
+                                         os.path.basename(src_file)))
+    fate = rng.random()
+    read_stdin()
+    if fate < settings['hang']:
+        while True:
+            time.sleep(60)
+    work(rng.lognormvariate(math.log(settings['latency']),
+                            settings['jitter']), settings['cpu'])
+    if fate < settings['hang'] + settings['fail']:
+        print('{}: fake failure of {}'.format(tool, src_file),
+              file=sys.stderr)
+        return 1
+    if tool == 'teqc' and '+qc' in args:
+        # imported here, numpy would slow down the start of other tools
+        import rnxgen
+        date = datetime.date(2017, 8, 10)
+        for line in rnxgen.summary_lines(date, 24, rng):
+            print(line)
+    elif tool == 'teqc':
+        # translate raw data into RINEX, navigation files are made too
+        if '+nav' in args:
+            nav_files = args[args.index('+nav') + 1].split(',')
+            for nav_file in nav_files:
+                with open(nav_file, 'w') as nav_writer:
+                    nav_writer.write(FILLER)
+        write_filler(sys.stdout, settings['output'])
+    elif tool == 'runpkr00':
+        dst_file = os.path.join(args[-1], os.path.splitext(
+            os.path.basename(src_file))[0] + '.DAT')
+        with open(dst_file, 'w') as dat_writer:
+            write_filler(dat_writer, settings['output'])
+    else:
+        write_filler(sys.stdout, settings['output'])
+
+    return 0
+
+
+def make_tools(bin_dir, tools=TOOLS):
+    """Write launchers of this script named as tools into bin_dir, return
+    bin_dir, which should be put at the front of PATH.
+    """
+    os.makedirs(bin_dir, exist_ok=True)
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    for tool in tools:
+        if os.name == 'posix':
+            launcher = os.path.join(bin_dir, tool)
+            content = ('#!{}\nimport sys\nsys.path.insert(0, {!r})\n'
+                       'import faketool\n'
+                       'sys.exit(faketool.main({!r}))\n').format(
+                           sys.executable, src_dir, tool)
+        else:
+            launcher = os.path.join(bin_dir, tool + '.bat')
+            content = '@"{}" "{}" {} %*\n'.format(
+                sys.executable, os.path.abspath(__file__), tool)
+        with open(launcher, 'w') as launcher_writer:
+            launcher_writer.write(content)
+        os.chmod(launcher, 0o755)
+
+    return bin_dir
+
+
+def main(tool=None):
+    """Main function."""
+    args = sys.argv[1:]
+    if tool is None:
+        if not args or args[0] not in TOOLS:
+            print('Usage: faketool.py <{}> [args]'.format('|'.join(TOOLS)),
+                  file=sys.stderr)
+            return 1
+        tool, args = args[0], args[1:]
+    if not args:
+        return 1
+
+    return run(tool, args, read_settings(os.environ))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
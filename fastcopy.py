@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Copy files in the fastest way the system supports.
+
+A file is cloned by reflink (FICLONE, e.g. on Btrfs and XFS) if possible,
+else copied in the kernel by copy_file_range, else copied in user space.
+Files can also be placed by hard link or symbolic link.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request of Linux to clone a file
+FICLONE = 0x40049409
+LINK_MODES = 'copy', 'hardlink', 'symlink', 'reflink'
+
+
+def reflink(src_reader, dst_writer):
+    """Clone the data of src_reader into dst_writer sharing extents, raise
+    OSError if it is not supported.
+    """
+    if fcntl is None:
+        raise OSError('reflink is not supported')
+    fcntl.ioctl(dst_writer.fileno(), FICLONE, src_reader.fileno())
+
+
+def copy_range(src_reader, dst_writer):
+    """Copy the data of src_reader into dst_writer using copy_file_range
+    if the system supports, else using shutil.copyfileobj.
+    """
+    if hasattr(os, 'copy_file_range'):
+        src_fd, dst_fd = src_reader.fileno(), dst_writer.fileno()
+        count = os.fstat(src_fd).st_size
+        try:
+            while count > 0:
+                sent = os.copy_file_range(src_fd, dst_fd, count)
+                if sent == 0:
+                    break
+                count -= sent
+            return
+        except OSError:
+            # not supported by the file system, copy from the beginning
+            src_reader.seek(0)
+            dst_writer.seek(0)
+            dst_writer.truncate()
+    shutil.copyfileobj(src_reader, dst_writer)
+
+
+def copy_file(src_file, dst_file, clone=True):
+    """Copy src_file to dst_file with metadata like shutil.copy2, the data
+    is cloned if clone is True and the file system supports. Return True
+    if the data is cloned, else False.
+
+    Example:
+
+    >>> import tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> src_file = os.path.join(tmp_dir, 'bjfs0420.17o')
+    >>> dst_file = os.path.join(tmp_dir, 'bjfs0420.17o.bak')
+    >>> with open(src_file, 'w') as src_writer:
+    ...     _ = src_writer.write('RINEX' * 1000)
+    >>> copy_file(src_file, dst_file, clone=False)
+    False
+    >>> with open(dst_file) as dst_reader:
+    ...     dst_reader.read() == 'RINEX' * 1000
+    True
+    >>> shutil.rmtree(tmp_dir)
+    """
+    cloned = False
+    with open(src_file, 'rb') as src_reader, \
+            open(dst_file, 'wb') as dst_writer:
+        try:
+            if clone:
+                reflink(src_reader, dst_writer)
+                cloned = True
+        except OSError:
+            pass
+        if not cloned:
+            copy_range(src_reader, dst_writer)
+    shutil.copystat(src_file, dst_file)
+
+    return cloned
+
+
+def link_file(src_file, dst_file, mode):
+    """Place src_file at dst_file by mode: copy, hardlink, symlink or
+    reflink, existing dst_file is replaced. Copy is used if the link can
+    not be made, e.g. across file systems. Return True if the data is
+    shared with src_file, else False.
+
+    Example:
+
+    >>> import tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> src_file = os.path.join(tmp_dir, 'bjfs0420.17o')
+    >>> with open(src_file, 'w') as src_writer:
+    ...     _ = src_writer.write('RINEX')
+    >>> os.mkdir(os.path.join(tmp_dir, 'net1'))
+    >>> dst_file = os.path.join(tmp_dir, 'net1', 'bjfs0420.17o')
+    >>> link_file(src_file, dst_file, 'symlink')
+    True
+    >>> os.readlink(dst_file).replace('\\\\', '/')
+    '../bjfs0420.17o'
+    >>> link_file(src_file, dst_file, 'hardlink')
+    True
+    >>> os.path.samefile(src_file, dst_file)
+    True
+    >>> shutil.rmtree(tmp_dir)
+    """
+    if os.path.lexists(dst_file):
+        os.remove(dst_file)
+    try:
+        if mode == 'hardlink':
+            os.link(src_file, dst_file)
+            return True
+        if mode == 'symlink':
+            dst_dir = os.path.dirname(os.path.abspath(dst_file))
+            os.symlink(os.path.relpath(src_file, dst_dir), dst_file)
+            return True
+    except OSError:
+        pass
+
+    return copy_file(src_file, dst_file, clone=mode != 'copy')
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Compress and decompress GSI Compact RINEX (Hatanaka) natively.
+
+Support Compact RINEX 1.0 (RINEX 2) and 3.0 (RINEX 3). Lines are read
+and yielded one by one, so a file is processed in constant memory, and
+other scripts can consume standard RINEX lines without a temporary file.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+import time
+
+import compressed
+import rinex
+
+__version__ = '0.1.0'
+CRX_LABEL, PROG_LABEL = 'CRINEX VERS   / TYPE', 'CRINEX PROG / DATE'
+# order of differences for observation data and receiver clock offset
+ARC_ORDER, CLOCK_ORDER = 3, 2
+# decimals and width of observation values and receiver clock offsets
+OBS_DECIMALS, OBS_FORMAT_WIDTH = 3, 14
+CLOCK_FORMAT = {1: (9, 12), 3: (12, 15)}
+
+
+def repair(old, diff):
+    """Restore a string from the old string and the text difference: a
+    space means unchanged, a '&' means changed to space.
+
+    Example:
+
+    >>> repair(' 17  8 10  0  0  0.0000000  0  2G01G02',
+    ...        '                30')
+    ' 17  8 10  0  0 30.0000000  0  2G01G02'
+    >>> repair('G01G02G03', '   G05&&&')
+    'G01G05   '
+    """
+    chars = list(old.ljust(len(diff)))
+    for idx, char in enumerate(diff):
+        if char == '&':
+            chars[idx] = ' '
+        elif char != ' ':
+            chars[idx] = char
+
+    return ''.join(chars)
+
+
+def format_value(value, decimals, width):
+    """Format an integer value scaled by 10^decimals to a fixed point
+    string of the width.
+
+    Example:
+
+    >>> format_value(21527025445, 3, 14)
+    '  21527025.445'
+    >>> format_value(-31, 3, 14)
+    '        -0.031'
+    """
+    sign = '-' if value < 0 else ''
+    whole, frac = divmod(abs(value), 10 ** decimals)
+
+    return '{}{}.{:0{}d}'.format(sign, whole, frac, decimals).rjust(width)
+
+
+def count_types(types, system):
+    """Return count of observation types of a satellite system, types of
+    RINEX 2 are keyed by None. Raise ValueError if the system has no
+    observation types in the header.
+
+    Example:
+
+    >>> count_types({'G': ['C1C', 'L1C'], 'R': ['C1C']}, 'G')
+    2
+    >>> count_types({'G': ['C1C', 'L1C'], 'R': ['C1C']}, 'J')
+    Traceback (most recent call last):
+    ...
+    ValueError: unknown system: J
+    """
+    if system not in types:
+        raise ValueError('unknown system: {}'.format(system))
+
+    return len(types[system])
+
+
+class Arc:
+    """Differences of a data arc, up to the order of the arc."""
+
+    __slots__ = 'order', 'diffs'
+
+    def __init__(self, order, value):
+        self.order, self.diffs = order, [value]
+
+    def restore(self, diff):
+        """Restore the next value from its difference.
+
+        Example:
+
+        >>> arc = Arc(3, 100)
+        >>> [arc.restore(diff) for diff in (10, 2, 0, 1)]
+        [110, 122, 136, 153]
+        """
+        level = min(len(self.diffs), self.order)
+        diffs = [diff]
+        for idx in range(level - 1, -1, -1):
+            diffs.append(self.diffs[idx] + diffs[-1])
+        self.diffs = diffs[::-1]
+
+        return self.diffs[0]
+
+
+def read_field(field, arc):
+    """Read a field of Compact RINEX, return the value and the arc: an
+    empty field means missing, 'n&value' initializes an arc of order n.
+    """
+    if not field:
+        return None, None
+    if '&' in field:
+        order, value = field.split('&')
+        arc = Arc(int(order), int(value))
+        return arc.diffs[0], arc
+    if arc is None:
+        raise ValueError('difference without initialized arc')
+
+    return arc.restore(int(field)), arc
+
+
+def decompress(reader):
+    """Decompress Compact RINEX lines from reader, yield standard RINEX
+    lines without line breaks.
+    """
+    reader = iter(reader)
+    first = rinex.next_line(reader)
+    if rinex.label(first) != CRX_LABEL:
+        raise ValueError('not a Compact RINEX file')
+    crx_version = int(float(first[0:9]))
+    rinex.next_line(reader)
+    header = rinex.read_header(reader)
+    yield from header
+    if crx_version == 1:
+        types = {None: rinex.obs_types(header)}
+        init, pos_flag, pos_count, pos_sats = '&', 28, slice(29, 32), 32
+    else:
+        types = rinex.sys_obs_types(header)
+        init, pos_flag, pos_count, pos_sats = '>', 31, slice(32, 35), 41
+    decimals, width = CLOCK_FORMAT[crx_version]
+    epoch_line, clock_arc, arcs, flags = '', None, {}, {}
+    for line in reader:
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        # an initialized epoch resets all the arcs
+        if line[0] == init:
+            epoch_line = ' ' + line[1:] if crx_version == 1 else line
+            clock_arc, arcs, flags = None, {}, {}
+        else:
+            epoch_line = repair(epoch_line, line)
+        flag = int(epoch_line[pos_flag:pos_flag+1].strip() or 0)
+        count = int(epoch_line[pos_count].strip() or 0)
+        # special event, copy the header records
+        if 2 <= flag <= 5:
+            records = [rinex.next_line(reader) for _ in range(count)]
+            yield epoch_line.rstrip()
+            yield from records
+            if crx_version == 1:
+                types[None] = rinex.obs_types(records) or types[None]
+            else:
+                types.update(rinex.sys_obs_types(records))
+            continue
+        clock, clock_arc = read_field(rinex.next_line(reader), clock_arc)
+        clock = '' if clock is None else format_value(clock, decimals, width)
+        sats = epoch_line[pos_sats:pos_sats+count*3].ljust(count * 3)
+        sats = [sats[idx:idx+3] for idx in range(0, count * 3, 3)]
+        if crx_version == 1:
+            yield from rinex.epoch_lines(epoch_line[0:32], sats, clock)
+        elif clock:
+            yield epoch_line[0:41].ljust(41) + clock
+        else:
+            yield epoch_line[0:41].rstrip()
+        new_arcs, new_flags = {}, {}
+        for sat in sats:
+            ntypes = count_types(types, None if crx_version == 1 else sat[0])
+            pieces = rinex.next_line(reader).split(' ', ntypes)
+            pieces.extend([''] * (ntypes + 1 - len(pieces)))
+            old_arcs = arcs.get(sat, [None] * ntypes)
+            sat_arcs, fields = [], []
+            for field, arc in zip(pieces, old_arcs):
+                value, arc = read_field(field, arc)
+                sat_arcs.append(arc)
+                fields.append(' ' * OBS_FORMAT_WIDTH if value is None else
+                              format_value(value, OBS_DECIMALS,
+                                           OBS_FORMAT_WIDTH))
+            sat_flags = repair(flags.get(sat, ''), pieces[ntypes])
+            sat_flags = sat_flags.ljust(ntypes * 2)
+            new_arcs[sat], new_flags[sat] = sat_arcs, sat_flags
+            fields = [field + sat_flags[idx*2:idx*2+2]
+                      for idx, field in enumerate(fields)]
+            if crx_version == 1:
+                yield from rinex.obs_lines(fields)
+            else:
+                yield (sat + ''.join(fields)).rstrip()
+        arcs, flags = new_arcs, new_flags
+
+
+def decompress_file(src_file, dst_file):
+    """Decompress a Compact RINEX file into a standard RINEX file, the
+    file may be compressed by compress, gzip, bzip2 or xz.
+    """
+    with compressed.open_pipe(src_file, 'rt') as src_reader, \
+            open(dst_file, 'w') as dst_writer:
+        dst_writer.writelines(line + '\n' for line in decompress(src_reader))
+
+
+def strdiff(old, new):
+    """Make the text difference of the new string from the old string,
+    the reverse of repair, trailing spaces are removed.
+
+    Example:
+
+    >>> strdiff(' 17  8 10  0  0  0.0000000  0  2G01G02',
+    ...         ' 17  8 10  0  0 30.0000000  0  2G01G02')
+    '                3'
+    >>> strdiff('G01G02G03', 'G01G05')
+    '     5&&&'
+    """
+    old, new = old.ljust(len(new)), new.ljust(len(old))
+    diff = (' ' if char == old_char else '&' if char == ' ' else char
+            for old_char, char in zip(old, new))
+
+    return ''.join(diff).rstrip()
+
+
+def parse_value(text, decimals):
+    """Parse a fixed point string into an integer scaled by 10^decimals,
+    return None for blank string. The sign is parsed apart from the
+    digits, a missing leading zero like .500 or -.031 is accepted, and
+    restored with the zero by format_value as RNXCMP does.
+
+    Example:
+
+    >>> parse_value('  21527025.445', 3), parse_value('   -0.031', 3)
+    (21527025445, -31)
+    >>> parse_value('      .500', 3), parse_value('   -.031', 3)
+    (500, -31)
+    >>> parse_value('      ', 3) is None
+    True
+    >>> parse_value('   1.5', 3)
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid value: 1.5
+    """
+    text = text.strip()
+    if not text:
+        return None
+    if len(text) <= decimals or text[-decimals-1] != '.':
+        raise ValueError('invalid value: {}'.format(text))
+    sign, digits = (-1, text[1:]) if text[0] == '-' else (1, text)
+    whole, frac = digits[:-decimals-1], digits[-decimals:]
+    if not (whole or '0').isdigit() or not frac.isdigit():
+        raise ValueError('invalid value: {}'.format(text))
+
+    return sign * (int(whole or 0) * 10 ** decimals + int(frac))
+
+
+class DiffArc(Arc):
+    """Arc for compression, which takes differences of new values."""
+
+    __slots__ = ()
+
+    def difference(self, value):
+        """Take the difference of the next value.
+
+        Example:
+
+        >>> arc = DiffArc(3, 100)
+        >>> [arc.difference(value) for value in (110, 122, 136, 153)]
+        [10, 2, 0, 1]
+        """
+        level = min(len(self.diffs), self.order)
+        diffs = [value]
+        for idx in range(level):
+            diffs.append(diffs[-1] - self.diffs[idx])
+        self.diffs = diffs
+
+        return diffs[-1]
+
+
+def write_field(value, arc, order):
+    """Write a field of Compact RINEX for value, return the field and the
+    arc, the arc is initialized when the last value is missing.
+    """
+    if value is None:
+        return '', None
+    if arc is None:
+        return '{}&{}'.format(order, value), DiffArc(order, value)
+
+    return str(arc.difference(value)), arc
+
+
+def compress(reader):
+    """Compress standard RINEX lines from reader, yield Compact RINEX
+    lines without line breaks. The compression is lossless.
+
+    Example:
+
+    >>> rnx = ['     2.11           OBSERVATION DATA    G (GPS)'.ljust(60)
+    ...        + 'RINEX VERSION / TYPE',
+    ...        '     2    L1    C1'.ljust(60) + '# / TYPES OF OBSERV',
+    ...        ' ' * 60 + 'END OF HEADER',
+    ...        ' 17  8 10  0  0  0.0000000  0  2G01G02',
+    ...        ' 113127356.81117  21527025.445',
+    ...        ' 118127356.811 6  22527025.445',
+    ...        ' 17  8 10  0  0 30.0000000  0  2G01G03'.ljust(68)
+    ...        + '-0.000123456',
+    ...        ' 113227356.811 7  21537025.445',
+    ...        '                  25527025.445',
+    ...        ' 17  8 10  0  1  0.0000000  0  1G01'.ljust(68)
+    ...        + '-0.000123457',
+    ...        ' 113327356.913 7  21547025.451']
+    >>> crx = list(compress(rnx))
+    >>> print(*crx[5:9], sep='\\n')
+    &17  8 10  0  0  0.0000000  0  2G01G02
+    <BLANKLINE>
+    3&113127356811 3&21527025445 17
+    3&118127356811 3&22527025445  6
+    >>> list(decompress(crx)) == rnx
+    True
+
+    Round trip of RINEX 2 with 14 satellites, 7 observation types, blank
+    and flagged observations, a power failure and a special event:
+
+    >>> def field(num, sat, idx):
+    ...     if (num + sat + idx) % 5 == 0:
+    ...         return ' ' * 16
+    ...     value = (sat * 1000003 + idx * 7919 + num ** 2 * 31) * (-1) ** idx
+    ...     lli = '1' if (sat + num) % 4 == 0 else ' '
+    ...     return format_value(value, 3, 14) + lli + str((sat + idx) % 10)
+    >>> sats = ['G{:02d}'.format(num) for num in range(1, 13)] + ['R01', 'R02']
+    >>> event = 'ANTENNA CHANGED'.ljust(60) + 'COMMENT'
+    >>> rnx = ['     2.11           OBSERVATION DATA    M'.ljust(60)
+    ...        + 'RINEX VERSION / TYPE',
+    ...        '     7    L1    L2    C1    P1    P2    S1    S2'.ljust(60)
+    ...        + '# / TYPES OF OBSERV',
+    ...        ' ' * 60 + 'END OF HEADER']
+    >>> for num in range(6):
+    ...     if num == 3:
+    ...         rnx += [' 17  8 10  0  1 30.0000000  4  1', event]
+    ...     now = sats[num % 2:]
+    ...     head = ' 17  8 10  0 {:2d}{:11.7f}  {}{:3d}'.format(
+    ...         num // 2, num % 2 * 30, int(num == 4), len(now))
+    ...     clock = format_value(-123456 - num, 9, 12) if num % 2 else ''
+    ...     rnx += rinex.epoch_lines(head, now, clock)
+    ...     for sat in now:
+    ...         rnx += rinex.obs_lines([field(num, sats.index(sat), idx)
+    ...                                 for idx in range(7)])
+    >>> rnx[4]
+    '                                R01R02'
+    >>> list(decompress(compress(rnx))) == rnx
+    True
+
+    Round trip of RINEX 3 with the same epochs:
+
+    >>> rnx = ['     3.04           OBSERVATION DATA    M'.ljust(60)
+    ...        + 'RINEX VERSION / TYPE',
+    ...        'G    7 C1C L1C D1C S1C C2W L2W S2W'.ljust(60)
+    ...        + 'SYS / # / OBS TYPES',
+    ...        'R    2 C1C L1C'.ljust(60) + 'SYS / # / OBS TYPES',
+    ...        ' ' * 60 + 'END OF HEADER']
+    >>> for num in range(6):
+    ...     if num == 3:
+    ...         rnx += ['> 2017 08 10 00 01 30.0000000  4  1', event]
+    ...     now = sats[num % 2:]
+    ...     head = '> 2017 08 10 00 {:02d}{:11.7f}  {}{:3d}'.format(
+    ...         num // 2, num % 2 * 30, int(num == 4), len(now))
+    ...     if num % 2:
+    ...         head = head.ljust(41) + format_value(-123456789, 12, 15)
+    ...     rnx.append(head)
+    ...     for sat in now:
+    ...         fields = [field(num, sats.index(sat), idx)
+    ...                   for idx in range(7 if sat[0] == 'G' else 2)]
+    ...         rnx.append((sat + ''.join(fields)).rstrip())
+    >>> list(decompress(compress(rnx))) == rnx
+    True
+    """
+    reader = iter(reader)
+    header = rinex.read_header(reader)
+    rnx_version = rinex.version(header)
+    crx_version = 1 if rnx_version < 3 else 3
+    program = 'PINOT HATANAKA {}'.format(__version__)
+    created = time.strftime('%d-%b-%y %H:%M', time.gmtime())
+    yield '{:<20s}{:<40s}{}'.format('{}.0'.format(crx_version),
+                                    'COMPACT RINEX FORMAT', CRX_LABEL)
+    yield '{:<40s}{:<20s}{}'.format(program, created, PROG_LABEL)
+    yield from header
+    if crx_version == 1:
+        types = {None: rinex.obs_types(header)}
+        epochs = rinex.iter_epochs(reader, len(types[None]))
+        init, head_width = '&', 32
+    else:
+        types = rinex.sys_obs_types(header)
+        epochs = rinex.iter_epochs3(reader)
+        init, head_width = '>', 41
+    decimals = CLOCK_FORMAT[crx_version][0]
+    epoch_line, clock_arc, arcs, flags = '', None, {}, {}
+    for epoch in epochs:
+        # special event, copy the header records and reset all the arcs
+        if not epoch.sats and 2 <= epoch.flag <= 5:
+            yield init + epoch.head[1:].rstrip()
+            yield from epoch.records
+            if crx_version == 1:
+                types[None] = rinex.obs_types(epoch.records) or types[None]
+            else:
+                types.update(rinex.sys_obs_types(epoch.records))
+            epoch_line, clock_arc, arcs, flags = '', None, {}, {}
+            continue
+        new_line = epoch.head.ljust(head_width) + ''.join(epoch.sats)
+        diff = strdiff(epoch_line, new_line) if epoch_line else ''
+        # initialize the epoch, when it is the first or same as the last
+        if not diff:
+            diff = init + new_line[1:]
+            clock_arc, arcs, flags = None, {}, {}
+        yield diff
+        epoch_line = new_line
+        clock = parse_value(epoch.clock, decimals)
+        field, clock_arc = write_field(clock, clock_arc, CLOCK_ORDER)
+        yield field
+        new_arcs, new_flags = {}, {}
+        for sat, record in zip(epoch.sats, epoch.records):
+            ntypes = count_types(types, None if crx_version == 1 else sat[0])
+            old_arcs = arcs.get(sat, [None] * ntypes)
+            pieces, sat_arcs, sat_flags = [], [], []
+            for text, arc in zip(rinex.obs_fields(record, ntypes), old_arcs):
+                value = parse_value(text[0:OBS_FORMAT_WIDTH], OBS_DECIMALS)
+                field, arc = write_field(value, arc, ARC_ORDER)
+                pieces.append(field)
+                sat_arcs.append(arc)
+                sat_flags.append(text[OBS_FORMAT_WIDTH:])
+            sat_flags = ''.join(sat_flags)
+            pieces.append(strdiff(flags.get(sat, ''), sat_flags))
+            new_arcs[sat], new_flags[sat] = sat_arcs, sat_flags
+            yield ' '.join(pieces).rstrip()
+        arcs, flags = new_arcs, new_flags
+
+
+def compress_file(src_file, dst_file):
+    """Compress a standard RINEX file into a Compact RINEX file."""
+    with open(src_file) as src_reader, open(dst_file, 'w') as dst_writer:
+        dst_writer.writelines(line + '\n' for line in compress(src_reader))
@@ -3,13 +3,24 @@
 #creater: Zhou Maosheng
 #Python version: 3.4
 
-"""Convert leica m00 file to RINEX"""
+"""Convert leica m00 file to RINEX
+
+Files are grouped by site and doy in one pass of scandir, then groups
+are converted by TEQC in parallel, at most MAX_SUBPROCESS at a time.
+Time and exit status of every group are reported.
+"""
 
 import os
 import sys
 import glob
+import fnmatch
 import argparse
 
+import profiler
+import toolrun
+
+MAX_SUBPROCESS = os.cpu_count()
+
 
 # dir_path: directory path
 def createdir(dir_path):
@@ -20,42 +31,60 @@ def createdir(dir_path):
         os.makedirs(dir_path)
 
 
-# src_dir: source directory, out_dir: output directory,
-# glob_str: glob string, year: year of data observation,
+# src_dirs: source directories, glob_str: glob string,
 # recursive: search file recursively
-def leica2rnx(src_dir, out_dir, year, glob_str, recursive):
-    """Convert leica m00 file to RINEX using TEQC"""
-
-    file_list = []
-    for file in glob.glob(os.path.join(src_dir, glob_str)):
-        # get site and doy in filename
-        filename = os.path.basename(file)[0:7]
-        # get global mode of source files
-        sourcefile = os.path.join(src_dir, filename + '?.' +  'm00')
-        if sourcefile not in file_list:
-            file_list.append(sourcefile)
-
-    for sourcefile in file_list:
-        # name of output file
-        rinexfile = os.path.basename(sourcefile)[0:7] + '0.' + year + 'o'
-        gfile = os.path.basename(sourcefile)[0:7] + '0.' + year + 'g'
-        nfile = os.path.basename(sourcefile)[0:7] + '0.' + year + 'n'
-        # path of output file
-        rnxfilepath = os.path.join(out_dir, rinexfile.lower())
-        gfilepath = os.path.join(out_dir, gfile.lower())
-        nfilepath = os.path.join(out_dir, nfile.lower())
-        # run teqc
-        print('generate file: %s %s %s ......' %(rinexfile, nfile, gfile))
-        command = ('teqc +nav ' + nfilepath + ',' + gfilepath + 
-                    ' ' + sourcefile + ' > ' + rnxfilepath)
-        os.system(command)
-
-    # process subfolders if --recursive is setted
-    if recursive:
-        for child in os.listdir(src_dir):
-            child_path = os.path.join(src_dir, child)
-            if os.path.isdir(child_path):
-                leica2rnx(child_path, out_dir, year, glob_str, recursive)
+@profiler.staged('scan')
+def group_files(src_dirs, glob_str, recursive):
+    """Walk source directories by scandir in one pass, group leica files
+    by site and doy"""
+
+    groups, dirs = {}, list(src_dirs)
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                # process subfolders if --recursive is setted
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        dirs.append(entry.path)
+                elif fnmatch.fnmatch(entry.name, glob_str):
+                    # the first 7 chars of filename are site and doy
+                    name = entry.name[0:7].lower()
+                    groups.setdefault(name, []).append(entry.path)
+
+    return groups
+
+
+# name: site and doy, files: leica files of the group,
+# out_dir: output directory, year: year of data observation
+@profiler.staged('execute')
+async def leica2rnx(name, files, out_dir, year):
+    """Convert leica m00 files of a site and doy to RINEX using TEQC,
+    return a description of TEQC and a list of failed files with the
+    reason"""
+
+    # path of output file
+    rnxfilepath = os.path.join(out_dir, name + '0.' + year + 'o')
+    gfilepath = os.path.join(out_dir, name + '0.' + year + 'g')
+    nfilepath = os.path.join(out_dir, name + '0.' + year + 'n')
+    # run teqc, sessions of the day are in order
+    args = ['teqc', '+nav', nfilepath + ',' + gfilepath,
+            *sorted(files, key=os.path.basename)]
+    try:
+        with open(rnxfilepath, 'w') as rnx_writer:
+            result = await toolrun.run(args, stdout=rnx_writer)
+        status, message = result.status, toolrun.describe(result)
+    except OSError as error:
+        # teqc is missing or the output could not be written
+        status, message = None, error.strerror or str(error)
+    if status == 0:
+        return message, []
+    # remove the broken output, every file of the group is failed
+    for filepath in (rnxfilepath, gfilepath, nfilepath):
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+    return message, ['%s (teqc %s)' %(os.path.basename(file), message)
+                     for file in files]
 
 
 # args: user input arguments
@@ -77,8 +106,19 @@ def main(args):
     print('year of data: %s' %year)
     print('--------------------------------------------------------\n')
 
-    for directory in glob.glob(src_dir):
-        leica2rnx(directory, out_dir, year, glob_str, args.recursive)
+    # group files of every site and doy, and convert groups in parallel
+    groups = group_files(glob.glob(src_dir), glob_str, args.recursive)
+    conv_args = ((name, files, out_dir, year)
+                 for name, files in groups.items())
+    failed = []
+    task_iter = toolrun.imap_unordered(leica2rnx, conv_args, MAX_SUBPROCESS)
+    for (name, files, _, _), (message, res) in task_iter:
+        if not res:
+            print('generate file: %s0.%so (%d files, %s)' %(
+                name, year, len(files), message))
+        failed += res
+    if failed:
+        print('\nConvert failed files: %s' %', '.join(failed))
 
     return 0
 
@@ -92,7 +132,7 @@ def init_args():
     
     # add arguments
     parser.add_argument('-v', '--version', action='version',
-                        version='leica2rnx.py 0.1.6')
+                        version='leica2rnx.py 0.2.0')
     parser.add_argument('-r', '--recursive', action='store_true',
                         help='search file in subfolders')
     parser.add_argument('-yr', metavar='<year>', required=True,
@@ -108,4 +148,4 @@ def init_args():
 
 
 if __name__ == '__main__':
-    init_args()
+    profiler.run(init_args)
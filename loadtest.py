@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Load test the parallel paths of the scripts with simulated tools.
+
+The tools teqc, crx2rnx, rnx2crx and runpkr00 are replaced by faketool.py
+which is put at the front of PATH, their latency, CPU burn, output size,
+failure and hang rates are set by the options. The tool of a script is
+run on a batch of files with every number of workers, then throughput,
+percentiles of latency per file, failures and timeouts are reported, so
+the number of workers, like MAX_SUBPROCESS, is chosen from data.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+from collections import namedtuple
+from concurrent import futures
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import crnx2rnx
+import faketool
+import qualitycheck
+import rnx2crnx
+import taskpool
+import toolrun
+import unificate
+
+# throughput within the ratio of the best is good enough
+THRESHOLD = 0.05
+WORKERS = '1,2,4,8,16'
+
+Scenario = namedtuple('Scenario', ['function', 'ext', 'pool'])
+SCENARIOS = {}
+
+
+def scenario(name, ext, pool):
+    """Register a function running a tool for a file of ext, the pool is
+    async or thread as the script does. The function return True if the
+    file is failed.
+    """
+    def register(function):
+        SCENARIOS[name] = Scenario(function, ext, pool)
+        return function
+
+    return register
+
+
+@scenario('qualitycheck', '17o', 'async')
+async def check_file(src_file, out_dir, timeout):
+    return await qualitycheck.teqc_marks(src_file, '', timeout) is None
+
+
+@scenario('crnx2rnx', '17d', 'async')
+async def decompress_file(src_file, out_dir, timeout):
+    return bool(await crnx2rnx.crx2rnx(src_file, out_dir, True, timeout))
+
+
+@scenario('rnx2crnx', '17o', 'async')
+async def compress_file(src_file, out_dir, timeout):
+    return bool(await rnx2crnx.rnx2crx(src_file, out_dir, True, timeout))
+
+
+@scenario('unificate', '17o', 'thread')
+def unificate_file(src_file, out_dir, timeout):
+    args = '-O.mo', 'TEST'
+    return bool(unificate.teqc(src_file, args, out_dir, True, timeout))
+
+
+async def timed_async(function, *argv):
+    """Run coroutine function, return the result and seconds."""
+    start = time.perf_counter()
+    res = await function(*argv)
+    return res, time.perf_counter() - start
+
+
+def timed(function, *argv):
+    """Run function, return the result and seconds."""
+    start = time.perf_counter()
+    res = function(*argv)
+    return res, time.perf_counter() - start
+
+
+def make_files(src_dir, count, ext):
+    """Make count small files of ext in src_dir, return the file list."""
+    os.makedirs(src_dir, exist_ok=True)
+    src_files = []
+    for num in range(count):
+        src_file = os.path.join(src_dir, 's{:03d}2220.{}'.format(num, ext))
+        with open(src_file, 'w') as src_writer:
+            src_writer.write(faketool.FILLER)
+        src_files.append(src_file)
+
+    return src_files
+
+
+def run_sweep(name, src_files, workers, out_dir, timeout):
+    """Run scenario of name on src_files with workers, return a dict of
+    result.
+    """
+    function, _, pool = SCENARIOS[name]
+    os.makedirs(out_dir)
+    argvs = ((function, src_file, out_dir, timeout) for src_file in src_files)
+    cpu_start = os.times()
+    start = time.perf_counter()
+    if pool == 'async':
+        task_iter = toolrun.imap_unordered(timed_async, argvs, workers)
+        results = [res for _, res in task_iter]
+    else:
+        window = workers * taskpool.WINDOW_PER_WORKER
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            task_iter = taskpool.imap_unordered(executor, timed, argvs,
+                                                window)
+            results = [res for _, res in task_iter]
+    seconds = time.perf_counter() - start
+    cpu_end = os.times()
+    shutil.rmtree(out_dir, ignore_errors=True)
+    latency = np.array([elapsed for _, elapsed in results])
+    # a hung tool is killed after timeout, retries take longer
+    timeouts = sum(1 for failed, elapsed in results
+                   if failed and elapsed >= timeout)
+    cpu = sum(cpu_end[idx] - cpu_start[idx] for idx in range(4))
+
+    return {'workers': workers, 'files': len(results), 'seconds': seconds,
+            'files_per_s': len(results) / seconds if seconds else 0,
+            'p50': float(np.percentile(latency, 50)),
+            'p99': float(np.percentile(latency, 99)),
+            'failed': sum(1 for failed, _ in results if failed),
+            'timeouts': timeouts, 'cpu_s': cpu}
+
+
+def best_workers(results, threshold=THRESHOLD):
+    """Return the least workers whose throughput is within threshold of
+    the best.
+
+    Example:
+
+    >>> results = [{'workers': 1, 'files_per_s': 10},
+    ...            {'workers': 4, 'files_per_s': 39},
+    ...            {'workers': 8, 'files_per_s': 40}]
+    >>> best_workers(results)
+    4
+    """
+    best = max(result['files_per_s'] for result in results)
+    good = [result['workers'] for result in results
+            if result['files_per_s'] >= best * (1 - threshold)]
+
+    return min(good)
+
+
+def init_args():
+    """Initilize function, parse user input"""
+    # initilize a argument parser
+    parser = argparse.ArgumentParser(
+        description='Load test the parallel paths with simulated tools.'
+    )
+    # add arguments
+    parser.add_argument('-v', '--version', action='version',
+                        version='%(prog)s 0.1.0')
+    parser.add_argument('-tool', metavar='<script>', default='qualitycheck',
+                        choices=sorted(SCENARIOS),
+                        help='script to test, {} [default: qualitycheck]'
+                        .format(', '.join(sorted(SCENARIOS))))
+    parser.add_argument('-files', metavar='<number>', default=200, type=int,
+                        help='number of files [default: 200]')
+    parser.add_argument('-workers', metavar='<list>', default=WORKERS,
+                        help='numbers of workers to sweep [default: {}]'
+                        .format(WORKERS))
+    parser.add_argument('-latency', metavar='<seconds>', default=0.1,
+                        type=float, help='median latency of the tool '
+                        '[default: 0.1]')
+    parser.add_argument('-jitter', metavar='<sigma>', default=0.5,
+                        type=float, help='sigma of lognormal latency '
+                        '[default: 0.5]')
+    parser.add_argument('-cpu', metavar='<ratio>', default=0.5, type=float,
+                        help='ratio of latency burning CPU [default: 0.5]')
+    parser.add_argument('-size', metavar='<KB>', default=64, type=float,
+                        help='output size of the tool [default: 64]')
+    parser.add_argument('-fail', metavar='<rate>', default=0, type=float,
+                        help='rate of failed runs [default: 0]')
+    parser.add_argument('-hang', metavar='<rate>', default=0, type=float,
+                        help='rate of hung runs [default: 0]')
+    parser.add_argument('-seed', metavar='<number>', default=0, type=int,
+                        help='seed of the fate of files [default: 0]')
+    parser.add_argument('-timeout', metavar='<seconds>', default=5,
+                        type=float, help='timeout of a tool [default: 5]')
+    parser.add_argument('-out', metavar='<file>', default='_loadtest.json',
+                        help='result file [default: _loadtest.json]')
+
+    return parser.parse_args()
+
+
+def main():
+    """Main function."""
+    args = init_args()
+    workers_list = [int(num) for num in args.workers.split(',')]
+    tmp_dir = tempfile.mkdtemp(prefix='pinot-')
+    # the simulated tools are found first, and inherit the settings
+    bin_dir = faketool.make_tools(os.path.join(tmp_dir, 'bin'))
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+    os.environ.update(faketool.setting_env(
+        latency=args.latency, jitter=args.jitter, cpu=args.cpu,
+        output=args.size, fail=args.fail, hang=args.hang, seed=args.seed))
+    print('Load test {}: {} files, latency {} s, CPU {:.0%}, fail {:.1%}, '
+          'hang {:.1%}\n'.format(args.tool, args.files, args.latency,
+                                 args.cpu, args.fail, args.hang))
+    header = 'workers', 'files/s', 'p50 s', 'p99 s', 'failed', 'timeouts', \
+        'CPU s'
+    print('{: >7s} {: >9s} {: >8s} {: >8s} {: >7s} {: >8s} {: >8s}'.format(
+        *header))
+    results = []
+    try:
+        src_files = make_files(os.path.join(tmp_dir, 'src'), args.files,
+                               SCENARIOS[args.tool].ext)
+        for workers in workers_list:
+            out_dir = os.path.join(tmp_dir, 'out{}'.format(workers))
+            result = run_sweep(args.tool, src_files, workers, out_dir,
+                               args.timeout)
+            results.append(result)
+            print('{workers: 7d} {files_per_s: 9.1f} {p50: 8.3f} '
+                  '{p99: 8.3f} {failed: 7d} {timeouts: 8d} {cpu_s: 8.1f}'
+                  .format(**result))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if not results:
+        return 1
+    print('\nLeast workers within {:.0%} of the best throughput: {}'.format(
+        THRESHOLD, best_workers(results)))
+    report = {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'tool': args.tool,
+        'settings': {'files': args.files, 'latency': args.latency,
+                     'jitter': args.jitter, 'cpu': args.cpu,
+                     'size': args.size, 'fail': args.fail,
+                     'hang': args.hang, 'seed': args.seed,
+                     'timeout': args.timeout},
+        'results': results,
+    }
+    with open(args.out, 'w') as json_writer:
+        json.dump(report, json_writer, indent=2)
+    print('Results saved: {}'.format(args.out))
+
+    return 0
+
+
+if __name__ == '__main__':
+    main()
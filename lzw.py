@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Decompress Unix compress (LZW, .Z) files natively.
+
+The data are decoded in a stream, so only the needed part of a file is
+read, e.g. the header of a compressed RINEX file. The interface is like
+`gzip.open`.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+import builtins
+import io
+
+MAGIC = b'\x1f\x9d'
+INIT_BITS, CLEAR = 9, 256
+# decompressed bytes of every chunk yielded
+CHUNK_SIZE = 65536
+
+
+def decompress(reader):
+    """Decompress LZW data from binary reader, yield decompressed chunks.
+
+    Codes are packed in groups of 8 codes, the rest of a group is skipped
+    when the code width increases or the table is cleared, like compress.
+
+    Example:
+
+    >>> data = (b'\\x1f\\x9d\\x90T\\x9e\\x08)\\xf2D\\x8a\\x93\\'T\\x02'
+    ...         b'\\x0e,\\xa8\\x90\\xa0A\\x84\\n\\x00')
+    >>> b''.join(decompress(io.BytesIO(data)))
+    b'TOBEORNOTTOBEORTOBEORNOT\\n'
+    """
+    magic = reader.read(3)
+    if len(magic) < 3 or magic[0:2] != MAGIC:
+        raise ValueError('not in compress (.Z) format')
+    max_bits, block_mode = magic[2] & 0x1f, magic[2] & 0x80
+    if not INIT_BITS <= max_bits <= 16:
+        raise ValueError('unsupported code width: {}'.format(max_bits))
+    max_max_code = 1 << max_bits
+    table = [bytes([code]) for code in range(256)]
+    if block_mode:
+        table.append(b'')
+    n_bits, max_code, free_ent = INIT_BITS, (1 << INIT_BITS) - 1, len(table)
+    prev, output, size = None, [], 0
+    while True:
+        if free_ent > max_code:
+            n_bits += 1
+            max_code = (max_max_code if n_bits == max_bits
+                        else (1 << n_bits) - 1)
+        group = reader.read(n_bits)
+        if not group:
+            break
+        value, mask = int.from_bytes(group, 'little'), (1 << n_bits) - 1
+        for _ in range(len(group) * 8 // n_bits):
+            code, value = value & mask, value >> n_bits
+            if prev is None:
+                prev = table[code]
+                output.append(prev)
+                continue
+            if code == CLEAR and block_mode:
+                del table[CLEAR+1:]
+                n_bits, max_code = INIT_BITS, (1 << INIT_BITS) - 1
+                free_ent = CLEAR
+                break
+            if code < free_ent:
+                entry = table[code]
+            elif code == free_ent:
+                entry = prev + prev[0:1]
+            else:
+                raise ValueError('corrupt input: code {}'.format(code))
+            output.append(entry)
+            size += len(entry)
+            if free_ent < max_max_code:
+                if free_ent < len(table):
+                    table[free_ent] = prev + entry[0:1]
+                else:
+                    table.append(prev + entry[0:1])
+                free_ent += 1
+            prev = entry
+            # skip the rest of group, the code width will increase
+            if free_ent > max_code:
+                break
+        if size >= CHUNK_SIZE:
+            yield b''.join(output)
+            output, size = [], 0
+
+    if output:
+        yield b''.join(output)
+
+
+class LZWFile(io.RawIOBase):
+    """Readable raw stream of decompressed data of a .Z file."""
+
+    def __init__(self, reader):
+        self._reader = reader
+        self._chunks = decompress(reader)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b''
+                return 0
+        size = min(len(buffer), len(self._buffer))
+        buffer[0:size] = self._buffer[0:size]
+        self._buffer = self._buffer[size:]
+
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._chunks.close()
+            self._reader.close()
+        super().close()
+
+
+def open(filename, mode='rb', encoding=None, errors=None, newline=None):
+    """Open a .Z file in binary or text mode for reading, like gzip.open.
+
+    Example:
+
+    >>> import os, tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> src_file = os.path.join(tmp_dir, 'bjfs0420.17o.Z')
+    >>> with builtins.open(src_file, 'wb') as lzw_writer:
+    ...     _ = lzw_writer.write(b'\\x1f\\x9d\\x90l\\xd2\\xb8)\\x03"\\x86\\x82'
+    ...                          b'\\x80\\x03A\\xc8P\\x00')
+    >>> with open(src_file, 'rt') as lzw_reader:
+    ...     lzw_reader.readlines()
+    ['line 1\\n', 'line 2\\n']
+    >>> os.remove(src_file)
+    >>> os.rmdir(tmp_dir)
+    """
+    if mode not in ('r', 'rb', 'rt'):
+        raise ValueError('invalid mode: {}'.format(mode))
+    reader = io.BufferedReader(LZWFile(builtins.open(filename, 'rb')))
+    if 't' not in mode:
+        return reader
+
+    return io.TextIOWrapper(reader, encoding, errors, newline)
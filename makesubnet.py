@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Make a subnet configuration for subnet.py from positions of sites.
+
+Sites are split into geographically compact subnets of balanced size by
+a k-means clustering with capacity, and some tie sites spread over the
+network are shared by all the subnets. Positions are read from field of
+position in _sitesinfo.yml, or from APPROX POSITION XYZ in headers of
+RINEX files.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+import argparse
+import glob
+import itertools
+import math
+import os
+
+import numpy as np
+import yaml
+
+import profiler
+import rinex
+import rnxname
+
+# the max iterations of k-means clustering, and the tolerance of moving
+# of centers to stop iteration in meters
+MAX_ITERATION, TOLERANCE = 20, 1.0
+# size of a subnet could exceed the mean size by the ratio, so the sites
+# near borders can join the nearer subnet, subnets are more compact
+SLACK = 0.1
+
+
+@profiler.staged('parse')
+def config_positions(sitesinfo):
+    """Get positions of sites from sitesinfo, return a dict of site and
+    position (X, Y, Z), sites without position are omitted.
+
+    Example:
+
+    >>> sitesinfo = {'all': {'interval': 30},
+    ...              'bjfs': {'position': '-2148744.84 4426642.96 4044657.85'}}
+    >>> config_positions(sitesinfo)
+    {'bjfs': (-2148744.84, 4426642.96, 4044657.85)}
+    """
+    positions = {}
+    for site, info in sitesinfo.items():
+        if site == 'all' or not info or 'position' not in info:
+            continue
+        positions[site.lower()] = tuple(float(num)
+                                        for num in info['position'].split())
+
+    return positions
+
+
+@profiler.staged('parse')
+def header_positions(src_files):
+    """Get positions of sites from APPROX POSITION XYZ of RINEX headers,
+    return a dict of site and position (X, Y, Z).
+    """
+    positions = {}
+    for src_file in src_files:
+        try:
+            header = rinex.read_file_header(src_file)
+        except (OSError, EOFError, ValueError):
+            continue
+        for line in header:
+            if rinex.label(line) == 'APPROX POSITION XYZ':
+                xyz = tuple(float(num) for num in line[0:42].split())
+                # zero position means unknown
+                if len(xyz) == 3 and any(xyz):
+                    positions[rnxname.site_of(src_file)] = xyz
+                break
+
+    return positions
+
+
+def farthest_points(points, count):
+    """Choose count points spread over all points: start from the point
+    farthest from the center, then every time choose the point farthest
+    from the chosen ones. Return indexes of the chosen points.
+
+    Example:
+
+    >>> points = np.array([[0, 0, 0], [1, 0, 0], [10, 0, 0], [5, 0, 0]])
+    >>> farthest_points(points, 2)
+    [2, 0]
+    """
+    distance = np.linalg.norm(points - points.mean(axis=0), axis=1)
+    chosen = []
+    for _ in range(min(count, len(points))):
+        index = int(np.argmax(distance))
+        chosen.append(index)
+        distance = np.minimum(distance,
+                              np.linalg.norm(points - points[index], axis=1))
+
+    return chosen
+
+
+def assign(points, centers, capacity):
+    """Assign every point to the nearest center which has capacity left,
+    points which lose most if not assigned to the nearest center are
+    assigned first. Return labels of points.
+    """
+    # squared distances of every point to every center
+    distance = ((points ** 2).sum(axis=1)[:, None] - 2 * points @ centers.T
+                + (centers ** 2).sum(axis=1)[None, :])
+    order = np.argsort(distance, axis=1)
+    nearest = np.take_along_axis(distance, order[:, 0:2], axis=1)
+    regret = (nearest[:, -1] - nearest[:, 0] if centers.shape[0] > 1
+              else np.zeros(len(points)))
+    # python lists are much faster than numpy arrays in loops
+    labels, counts = [0] * len(points), [0] * len(centers)
+    order = order.tolist()
+    for index in np.argsort(-regret, kind='stable').tolist():
+        for center in order[index]:
+            if counts[center] < capacity:
+                labels[index] = center
+                counts[center] += 1
+                break
+
+    return np.array(labels)
+
+
+@profiler.staged('plan')
+def partition(points, nets, ties=0, capacity=None):
+    """Partition points into nets compact clusters of balanced size, at
+    most capacity points in a cluster, and choose ties points spread over
+    all points shared by every cluster. Return a list of sorted indexes
+    of points for every cluster.
+
+    Example:
+
+    >>> points = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0],
+    ...                    [100, 0, 0], [101, 0, 0], [100, 1, 0]])
+    >>> partition(points, 2)
+    [[0, 1, 2], [3, 4, 5]]
+    >>> partition(points, 2, ties=1)
+    [[0, 1, 2, 4], [3, 4, 5]]
+
+    An empty cluster is reseeded, and dropped if it is still empty, e.g.
+    of duplicate points, so there may be fewer clusters than nets:
+
+    >>> with np.errstate(invalid='raise'):
+    ...     partition([[0, 0, 0], [0, 0, 0], [10, 0, 0], [10, 0, 0]], 3)
+    [[0, 1], [2, 3]]
+    """
+    points = np.asarray(points, dtype=float)
+    mean_size = len(points) / nets
+    limit = math.ceil(mean_size * (1 + SLACK))
+    capacity = max(min(capacity or limit, limit), math.ceil(mean_size))
+    centers = points[farthest_points(points, nets)]
+    for _ in range(MAX_ITERATION):
+        labels = assign(points, centers, capacity)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, points)
+        counts = np.bincount(labels, minlength=nets)[:, None]
+        new_centers = np.where(counts > 0, sums / np.maximum(counts, 1),
+                               centers)
+        # reseed empty clusters by the points farthest from their centers
+        empty = np.flatnonzero(counts[:, 0] == 0)
+        if len(empty):
+            distance = np.linalg.norm(points - new_centers[labels], axis=1)
+            farthest = np.argsort(-distance, kind='stable')[:len(empty)]
+            new_centers[empty] = points[farthest]
+        moved = np.abs(new_centers - centers).max()
+        centers = new_centers
+        if moved < TOLERANCE:
+            break
+    tie_points = farthest_points(points, ties)
+    # a cluster still empty is dropped, subnet.py needs sites of a subnet
+    clusters = [set(np.flatnonzero(labels == net).tolist()) | set(tie_points)
+                for net in sorted(set(labels.tolist()))]
+    # order clusters by the first member, so the result is stable
+    return sorted(sorted(cluster) for cluster in clusters)
+
+
+@profiler.staged('report')
+def write_subnets(out_file, subnets):
+    """Write subnets into a YAML configuration file for subnet.py."""
+    with open(out_file, 'w') as cfg_writer:
+        cfg_writer.write('# this is a configuration file for subnet.py\n')
+        cfg_writer.write('# made by makesubnet.py\n')
+        for net, sites in subnets.items():
+            cfg_writer.write('\n{}:\n'.format(net))
+            for site in sites:
+                cfg_writer.write('    - {}\n'.format(site))
+
+
+def init_args():
+    """Initilize function, parse user input"""
+    # initilize a argument parser
+    parser = argparse.ArgumentParser(
+        description='Make subnet configuration from positions of sites.'
+    )
+    # add arguments
+    parser.add_argument('-v', '--version', action='version',
+                        version='%(prog)s 0.1.0')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='search file recursively')
+    parser.add_argument('-cfg', metavar='<config>', default='_sitesinfo.yml',
+                        help='site information file [default: _sitesinfo.yml]')
+    parser.add_argument('-size', metavar='<number>', default=50, type=int,
+                        help='max sites in a subnet [default: 50]')
+    parser.add_argument('-nets', metavar='<number>', default=0, type=int,
+                        help='count of subnets [default: decided by size]')
+    parser.add_argument('-ties', metavar='<number>', default=3, type=int,
+                        help='tie sites shared by all subnets [default: 3]')
+    parser.add_argument('-out', metavar='<config>', default='_subnet.yml',
+                        help='output subnet file [default: _subnet.yml]')
+    parser.add_argument('files', metavar='<file>', nargs='*',
+                        help='RINEX file whose header position will be used')
+
+    return parser.parse_args()
+
+
+def main():
+    """Main function."""
+    args = init_args()
+    positions = {}
+    if os.path.isfile(args.cfg):
+        with open(args.cfg) as cfg_reader:
+            sitesinfo = yaml.safe_load(cfg_reader) or {}
+        positions.update(config_positions(sitesinfo))
+    # positions in RINEX headers are preferred
+    globs = [glob.iglob(globstr, recursive=args.recursive)
+             for globstr in args.files]
+    positions.update(header_positions(itertools.chain(*globs)))
+    if not positions:
+        print('No position of sites found')
+        return 1
+    sites = sorted(positions)
+    ties = min(args.ties, len(sites))
+    if args.size <= ties:
+        print('Size of subnet must be larger than count of tie sites')
+        return 1
+    # leave room for slack of size when count of subnets is not given
+    nets = args.nets or math.ceil(len(sites) * (1 + SLACK)
+                                  / (args.size - ties))
+    nets = max(1, min(nets, len(sites)))
+    if math.ceil(len(sites) / nets) > args.size - ties:
+        message = 'Warning: {} subnets are too few, exceed size of {} sites'
+        print(message.format(nets, args.size))
+    points = np.array([positions[site] for site in sites])
+    clusters = partition(points, nets, ties, args.size - ties)
+    subnets = {'net{}'.format(idx + 1): [sites[num] for num in cluster]
+               for idx, cluster in enumerate(clusters)}
+    write_subnets(args.out, subnets)
+    # show size and radius of every subnet, tie sites are not counted
+    tie_points = set(farthest_points(points, ties))
+    for net, cluster in zip(subnets, clusters):
+        members = points[[num for num in cluster if num not in tie_points]]
+        # a subnet could have no sites but ties
+        radius = (np.linalg.norm(members - members.mean(axis=0), axis=1).max()
+                  if len(members) else 0.0)
+        message = '{: <8s} {:4d} sites, radius {:8.1f} km'
+        print(message.format(net, len(cluster), radius / 1000))
+    print('{} sites into {} subnets: {}'.format(len(sites), len(subnets),
+                                               args.out))
+
+    return 0
+
+
+if __name__ == '__main__':
+    profiler.run(main)
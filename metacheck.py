@@ -3,25 +3,44 @@
 """Check if some sites' observation files have meta infomation changed,
 reference infomation is inputed using a YAML configuration file.
 
+Meta-infomation of files is stored in a SQLite cache, keyed by path and
+checked by size, mtime and inode, only new or changed files are read.
+Headers are read in threads, only the first block of a file is read by a
+single pread, so it is fast on network storage. Files compressed by
+gzip, bzip2, xz or Unix compress (.Z), and Compact RINEX files are
+supported.
+
 :author: Jon Jiang
 :email: jiangyingming@live.com
 """
+from concurrent import futures
 from textwrap import shorten
 import argparse
 import glob
 import itertools
+import json
 import os
+import sqlite3
 
 import yaml
 
+import compressed
+import profiler
+import rinex
+import rnxname
+import taskpool
+
 SITEINFO = {
     'receiver': {'flag': 'REC # / TYPE / VERS', 'pos': slice(20, 40)},
     'antenna': {'flag': 'ANT # / TYPE', 'pos': slice(20, 40)},
     'delta': {'flag': 'ANTENNA: DELTA H/E/N', 'pos': slice(0, 42)},
     'position': {'flag': 'APPROX POSITION XYZ', 'pos': slice(0, 42)}
 }
+# reading headers is bound by I/O latency, so use many threads
+MAX_THREADING = 16
 
 
+@profiler.staged('parse')
 def get_meta(rnx_reader):
     """Get meta-infomation in source RINEX observation file header."""
     # get RINEX header lines
@@ -35,6 +54,101 @@ def get_meta(rnx_reader):
     return meta
 
 
+@profiler.staged('parse')
+def load_meta(src_file, key, meta):
+    """Get meta-infomation of source file in a thread, the file header is
+    read if meta is None. Return None if the file can not be read.
+    """
+    if meta is not None:
+        return meta
+    try:
+        return get_meta(rinex.read_file_header(src_file))
+    except compressed.ERRORS:
+        return None
+
+
+def open_cache(db_file):
+    """Open the SQLite cache of meta-infomation, create table if not
+    exists, return the connection.
+    """
+    cache = sqlite3.connect(db_file)
+    cache.execute('CREATE TABLE IF NOT EXISTS meta (path TEXT PRIMARY KEY, '
+                  'size INTEGER, mtime INTEGER, inode INTEGER, meta TEXT)')
+
+    return cache
+
+
+def lookup_cache(cache, src_file):
+    """Look up meta-infomation of source file in cache, return a tuple of
+    file status key and meta-infomation. Meta-infomation is None if the
+    file is not cached or changed, both are None if cache is None.
+
+    Example:
+
+    >>> import tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> src_file = os.path.join(tmp_dir, 'bjfs0420.17o')
+    >>> with open(src_file, 'w') as rnx_writer:
+    ...     _ = rnx_writer.write('1234'.ljust(20) + 'TRIMBLE NETR9'.ljust(40)
+    ...                          + 'REC # / TYPE / VERS')
+    >>> cache = open_cache(':memory:')
+    >>> key, meta = lookup_cache(cache, src_file)
+    >>> meta = load_meta(src_file, key, meta)
+    >>> meta
+    {'receiver': 'TRIMBLE NETR9'}
+    >>> update_cache(cache, src_file, key, meta)
+    >>> lookup_cache(cache, src_file)[1]
+    {'receiver': 'TRIMBLE NETR9'}
+    >>> os.remove(src_file)
+    >>> os.rmdir(tmp_dir)
+    >>> prune_cache(cache)
+    1
+    """
+    if cache is None:
+        return None, None
+    path, stat = os.path.abspath(src_file), os.stat(src_file)
+    key = stat.st_size, stat.st_mtime_ns, stat.st_ino
+    sql = 'SELECT size, mtime, inode, meta FROM meta WHERE path = ?'
+    row = cache.execute(sql, (path,)).fetchone()
+    if row and tuple(row[0:3]) == key:
+        return key, json.loads(row[3])
+
+    return key, None
+
+
+def update_cache(cache, src_file, key, meta):
+    """Store meta-infomation of source file with its status key."""
+    sql = 'INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?, ?)'
+    cache.execute(sql, (os.path.abspath(src_file), *key, json.dumps(meta)))
+
+
+@profiler.staged('plan')
+def select_files(src_files, sitesinfo, cache, missing):
+    """Yield arguments of load_meta for files whose site is in sitesinfo,
+    other sites are added into missing.
+    """
+    for src_file in src_files:
+        site = rnxname.site_of(src_file)
+        # if site not in sitesinfo, add this site info missing
+        if site not in sitesinfo:
+            missing.add(site)
+            continue
+        yield (src_file, *lookup_cache(cache, src_file))
+
+
+def prune_cache(cache):
+    """Remove records of deleted files from cache, return the count of
+    removed records.
+    """
+    paths = [row[0] for row in cache.execute('SELECT path FROM meta')]
+    deleted = [(path,) for path in paths if not os.path.isfile(path)]
+    cache.executemany('DELETE FROM meta WHERE path = ?', deleted)
+    cache.commit()
+
+    return len(deleted)
+
+
+@profiler.staged('execute')
 def compare_info(fileinfo, reference, threshold):
     """Compare meta-infomation in source file and reference dictionary,
     Return a dict contains different items.
@@ -73,6 +187,7 @@ def compare_info(fileinfo, reference, threshold):
     return difference
 
 
+@profiler.staged('report')
 def show_difference(src_file, difference, out_fmt):
     """Show difference, print it to stdout. The out_fmt indicate format
     of output message, it can be list or table.
@@ -97,7 +212,7 @@ def init_args():
     )
     # add arguments
     parser.add_argument('-v', '--version', action='version',
-                        version='%(prog)s 0.4.1')
+                        version='%(prog)s 0.7.0')
     parser.add_argument('-r', '--recursive', action='store_true',
                         help='search file recursively')
     parser.add_argument('-cfg', metavar='<config>', default='_sitesinfo.yml',
@@ -108,7 +223,16 @@ def init_args():
                         help='output format, list or table [default: list]')
     parser.add_argument('-thd', metavar='<threshold>', default=10, type=int,
                         help='threshold for position change [default: 10(m)]')
-    parser.add_argument('files', metavar='<file>', nargs='+',
+    parser.add_argument('-cache', metavar='<cache>', default='_metacache.db',
+                        help='meta cache file [default: _metacache.db]')
+    parser.add_argument('-nocache', action='store_true',
+                        help='read all the files without cache')
+    parser.add_argument('-prune', action='store_true',
+                        help='remove deleted files from cache')
+    parser.add_argument('-jobs', metavar='<number>', default=MAX_THREADING,
+                        type=int, help='files read concurrently [default: {}]'
+                        .format(MAX_THREADING))
+    parser.add_argument('files', metavar='<file>', nargs='*',
                         help='file will be processed')
 
     return parser.parse_args()
@@ -119,6 +243,9 @@ def main():
     args = init_args()
     globstrs, out_fmt, sitesinfo = args.files, args.out, yaml.load(args.cfg)
     threshold, recursive = args.thd, args.recursive
+    cache = None if args.nocache else open_cache(args.cache)
+    if cache is not None and args.prune:
+        print('Pruned {} deleted files from cache'.format(prune_cache(cache)))
     # collect input globstrs into a glob list
     globs = [glob.iglob(globstr, recursive=recursive) for globstr in globstrs]
     # start process
@@ -128,25 +255,33 @@ def main():
         header = 'file', 'type', 'in cfgfile', 'in obsfile'
         print('\n{: <20s} {: <10s} {: <44s} {: <44s}'.format(*header))
     # a set named missing collects site not found in reference file
-    missing = set()
-    for src_file in itertools.chain(*globs):
-        filename = os.path.basename(src_file)
-        site = filename[0:4].lower()
-        # if site not in sitesinfo, add this site info missing
-        if site not in sitesinfo:
-            missing.add(site)
-            continue
-        fileinfo = get_meta(open(src_file))
-        difference = compare_info(fileinfo, sitesinfo[site], threshold)
-        if difference:
-            show_difference(src_file, difference, out_fmt)
+    missing, failed = set(), []
+    argvs = select_files(itertools.chain(*globs), sitesinfo, cache, missing)
+    window = args.jobs * taskpool.WINDOW_PER_WORKER
+    with futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        tasks = taskpool.imap_unordered(executor, load_meta, argvs, window)
+        for (src_file, key, cached), fileinfo in tasks:
+            if fileinfo is None:
+                failed.append(src_file)
+                continue
+            if cache is not None and cached is None:
+                update_cache(cache, src_file, key, fileinfo)
+            site = rnxname.site_of(src_file)
+            difference = compare_info(fileinfo, sitesinfo[site], threshold)
+            if difference:
+                show_difference(src_file, difference, out_fmt)
 
+    if cache is not None:
+        cache.commit()
+        cache.close()
     if missing:
         message = '\nSites not found in configuration file: {}'
         print(message.format(', '.join(sorted(list(missing)))))
+    if failed:
+        print('\nRead header failed: {}'.format(', '.join(sorted(failed))))
 
     return 0
 
 
 if __name__ == '__main__':
-    main()
+    profiler.run(main)
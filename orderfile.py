@@ -25,20 +25,36 @@ An example, order files observed at 2017:
         ...
     ...
 
+Files are planned first: grouped by destination directory, and files
+which collide with others or existing files are skipped. Every directory
+is created once, files are moved by rename on the same file system, and
+copied in threads using reflink or copy_file_range when possible.
+
 :author: Jon Jiang
 :email: jiangyingming@live.com
 """
+from concurrent import futures
 from textwrap import shorten
 import argparse
 import glob
 import itertools
 import os
-import shutil
+
+import fastcopy
+import profiler
+import rnxname
+import taskpool
+import telemetry
+
+# copying files is bound by I/O, so use more threads than CPUs
+MAX_THREADING = max(6, os.cpu_count())
 
 
+@profiler.staged('parse')
 def which_kind(filename):
     """Return which kind a source file is, the kind is a 2-digit year
-    concat one of a kind char in: d, m, n, o.
+    concat one of a kind char in: d, m, n, o. Return None if it is not a
+    RINEX file.
 
     Example:
 
@@ -61,22 +77,21 @@ def which_kind(filename):
     '17o'
     >>> which_kind('SHAO00CHN_R_20170420000_01D_30S_MO.rnx')
     '17o'
+    >>> which_kind('bjfs0420.17d.Z')
+    '17d'
     """
-    if filename.endswith('.crx'):
-        year = filename[14:16]
-        kind = '{yr}d'.format(yr=year)
-    elif filename.endswith('.rnx'):
-        year, type_code = filename[14:16], filename[-5].lower()
-        kind = '{yr}{t}'.format(yr=year, t=type_code)
-    else:
-        kind = filename[-3:].lower()
+    record = rnxname.parse(filename)
+    if record is None:
+        return None
 
-    return kind
+    return '{:02d}{}'.format(record.year % 100, record.kind)
 
 
+@profiler.staged('parse')
 def which_dir(src_file):
     """Return which directory path a source file should belong, the
     path is concat by 4-digit year, 3-digit day of year and kind.
+    Return None if it is not a RINEX file.
 
     Example:
 
@@ -89,16 +104,151 @@ def which_dir(src_file):
     >>> which_dir('DAVS00ATA_R_20170420000_01D_30S_MM.RNX').replace('\\\\', '/')
     '2017/042/17m'
     """
-    filename = os.path.basename(src_file).lower()
-    kind = which_kind(filename)
-    year = kind[0:2]
-    year = '20' + year if year < '80' else '19' + year
-    if filename.endswith('.crx') or filename.endswith('.rnx'):
-        doy = filename[16:19]
-    else:
-        doy = filename[4:7]
+    record = rnxname.parse(os.path.basename(src_file))
+    if record is None:
+        return None
+    kind = '{:02d}{}'.format(record.year % 100, record.kind)
+
+    return os.path.join(str(record.year), '{:03d}'.format(record.doy), kind)
+
+
+@profiler.staged('plan')
+def make_plan(src_files, out_dir):
+    """Plan the placement of source files grouped by destination directory.
+    Return a tuple of plan, unknown and collisions: plan is a dict of
+    destination directory and list of source files, unknown are the files
+    which are not RINEX, and collisions are the files whose destination
+    is taken by an existing file or another source file.
+
+    Example:
+
+    >>> src_files = ['a/bjfs0420.17o', 'a/bjfs0430.17o', 'a/readme.txt',
+    ...              'b/bjfs0420.17o']
+    >>> plan, unknown, collisions = make_plan(src_files, 'daily')
+    >>> for dst_dir, files in plan.items():
+    ...     print(dst_dir.replace('\\\\', '/'), files)
+    daily/2017/042/17o ['a/bjfs0420.17o']
+    daily/2017/043/17o ['a/bjfs0430.17o']
+    >>> unknown, collisions
+    (['a/readme.txt'], ['b/bjfs0420.17o'])
+    """
+    plan, unknown, collisions = {}, [], []
+    # names of files in every destination directory, listed only once
+    names = {}
+    for src_file in src_files:
+        sub_dir = which_dir(src_file)
+        # skip files which are not RINEX files, and directories
+        if sub_dir is None:
+            if not os.path.isdir(src_file):
+                unknown.append(src_file)
+            continue
+        dst_dir = os.path.join(out_dir, sub_dir)
+        if dst_dir not in names:
+            exists = os.path.isdir(dst_dir)
+            names[dst_dir] = set(os.listdir(dst_dir)) if exists else set()
+        filename = os.path.basename(src_file)
+        if filename in names[dst_dir]:
+            collisions.append(src_file)
+            continue
+        names[dst_dir].add(filename)
+        plan.setdefault(dst_dir, []).append(src_file)
+
+    return plan, unknown, collisions
+
+
+@profiler.staged('report')
+def show_plan(plan):
+    """Print count and size of files will be placed in every directory."""
+    total_files, total_size = 0, 0
+    for dst_dir in sorted(plan):
+        src_files = plan[dst_dir]
+        size = sum(os.path.getsize(src_file) for src_file in src_files)
+        print('{: <40s} {:8d} files {:12.2f} MB'.format(dst_dir,
+                                                         len(src_files),
+                                                         size / 2**20))
+        total_files += len(src_files)
+        total_size += size
+    print('{: <40s} {:8d} files {:12.2f} MB'.format('total', total_files,
+                                                     total_size / 2**20))
+
 
-    return os.path.join(year, doy, kind)
+@profiler.staged('execute')
+def place_file(src_file, dst_file, keep_src):
+    """Copy source file to destination in a thread, remove source file if
+    keep_src is False. Return None if success, else return src_file, the
+    partial destination of a failed copy is removed.
+
+    Example:
+
+    >>> import shutil, tempfile
+    >>> from unittest import mock
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> src_file = os.path.join(tmp_dir, 'bjfs0420.17o')
+    >>> dst_file = os.path.join(tmp_dir, 'bjfs0420.17o.bak')
+    >>> with open(src_file, 'w') as src_writer:
+    ...     _ = src_writer.write('RINEX')
+    >>> with mock.patch('fastcopy.reflink', side_effect=OSError), \\
+    ...         mock.patch('fastcopy.copy_range', side_effect=OSError):
+    ...     place_file(src_file, dst_file, False) == src_file
+    True
+    >>> os.path.exists(dst_file), os.path.exists(src_file)
+    (False, True)
+    >>> shutil.rmtree(tmp_dir)
+    """
+    try:
+        fastcopy.copy_file(src_file, dst_file)
+    except OSError:
+        # remove the partial destination of a failed copy
+        if os.path.exists(dst_file):
+            os.remove(dst_file)
+        return src_file
+    if not keep_src:
+        try:
+            os.remove(src_file)
+        except OSError:
+            return src_file
+
+    return None
+
+
+def written_size(argv, res):
+    """Return bytes of the destination file written by a task."""
+    return telemetry.file_size(argv[1])
+
+
+def run_plan(plan, keep_src, recorder=None):
+    """Place files following the plan, return a list of failed files.
+    Every copy is measured if recorder of telemetry is given, renames are
+    not tasks so they are not measured.
+    """
+    copies, failed = [], []
+    for dst_dir, src_files in plan.items():
+        os.makedirs(dst_dir, exist_ok=True)
+        for src_file in src_files:
+            dst_file = os.path.join(dst_dir, os.path.basename(src_file))
+            if not keep_src:
+                # fast path: rename on the same file system
+                try:
+                    os.rename(src_file, dst_file)
+                    print('{} => {}'.format(src_file, dst_dir))
+                    continue
+                except OSError:
+                    pass
+            copies.append((src_file, dst_file, keep_src))
+    # copy files and moves across file systems in threads
+    window = MAX_THREADING * taskpool.WINDOW_PER_WORKER
+    function, copies = telemetry.measure(recorder, place_file, copies,
+                                        written_size)
+    with futures.ThreadPoolExecutor(max_workers=MAX_THREADING) as executor:
+        tasks = taskpool.imap_unordered(executor, function, copies, window)
+        tasks = telemetry.collect(recorder, tasks)
+        for (src_file, dst_file, _), result in tasks:
+            if result is not None:
+                failed.append(result)
+                continue
+            print('{} => {}'.format(src_file, os.path.dirname(dst_file)))
+
+    return failed
 
 
 def init_args():
@@ -109,13 +259,20 @@ def init_args():
     )
     # add arguments
     parser.add_argument('-v', '--version', action='version',
-                        version='%(prog)s 0.2.1')
+                        version='%(prog)s 0.4.0')
     parser.add_argument('-k', '--keep', action='store_true',
                         help='keep original file')
     parser.add_argument('-r', '--recursive', action='store_true',
                         help='search file recursively')
     parser.add_argument('-out', metavar='<directory>', default='daily',
                         help='output directory [default: daily in current]')
+    parser.add_argument('-dry', action='store_true',
+                        help='show the plan only, files are not placed')
+    parser.add_argument('-telemetry', metavar='<file>',
+                        help='append telemetry of files into JSON lines')
+    parser.add_argument('-prom', metavar='<file>',
+                        help='write metrics for Prometheus textfile '
+                             'collector')
     parser.add_argument('files', metavar='<file>', nargs='+',
                         help='file will be processed')
 
@@ -131,19 +288,31 @@ def main():
     globs = [glob.iglob(globstr, recursive=recursive) for globstr in globstrs]
     # start process
     print('Start processing: {}'.format(shorten(', '.join(globstrs), 62)))
-    if not keep_src:
-        print('Delete source files when complete')
-    for src_file in itertools.chain(*globs):
-        dst_dir = os.path.join(out_dir, which_dir(src_file))
-        os.makedirs(dst_dir, exist_ok=True)
-        print('{} => {}'.format(src_file, dst_dir))
-        if keep_src:
-            shutil.copy2(src_file, dst_dir)
-        else:
-            shutil.move(src_file, dst_dir)
+    plan, unknown, collisions = make_plan(itertools.chain(*globs), out_dir)
+    if args.dry:
+        show_plan(plan)
+    else:
+        if not keep_src:
+            print('Delete source files when complete')
+        recorder = telemetry.open_recorder('orderfile', args.telemetry,
+                                           args.prom)
+        try:
+            failed = run_plan(plan, keep_src, recorder)
+        finally:
+            if recorder is not None:
+                recorder.close()
+        if failed:
+            print('Place failed: {}'.format(shorten(', '.join(failed), 62)))
+
+    if unknown:
+        names = (os.path.basename(src_file) for src_file in unknown)
+        print('Not RINEX files: {}'.format(shorten(', '.join(names), 62)))
+    if collisions:
+        message = 'Skipped, destination already exists: {}'
+        print(message.format(shorten(', '.join(collisions), 62)))
 
     return 0
 
 
 if __name__ == '__main__':
-    main()
+    profiler.run(main)
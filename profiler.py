@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Profile a script with the --profile switch.
+
+Every script runs its main function by run, if --profile or
+--profile=<prefix> is in the arguments, it is removed and the script is
+run under cProfile in every thread, with a sampler of stacks and of
+allocations. When the script is finished, three files are written:
+
+- <prefix>.pstats: CPU time of functions, readable by pstats or snakeviz;
+- <prefix>.collapsed: stacks sampled, for flamegraph.pl or speedscope;
+- <prefix>.txt: CPU time and memory of stages, functions using the most
+  CPU time, and the lines allocating the most memory.
+
+Functions are attributed to named stages (scan, plan, execute, parse,
+report) by the staged decorator, which returns the function unchanged,
+so nothing is paid without --profile. Glob and directory listing are in
+the scan stage. Time of a stage includes the stages called inside it.
+Tracing every allocation slows a run by tens of times, so memory is
+traced by tracemalloc in a short window every second, and the memory
+allocated in the windows and still alive at the end of them is summed.
+Workers of process pools are not profiled. The output of the script is
+not changed, only a line of the saved files is printed into stderr.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+import collections
+import cProfile
+import fnmatch
+import glob
+import io
+import linecache
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+OPTION, PREFIX = '--profile', '_profile'
+STAGES = 'scan', 'plan', 'execute', 'parse', 'report'
+# sample stacks every INTERVAL seconds, trace memory for WINDOW seconds
+# every TRACE_EVERY seconds
+INTERVAL, WINDOW, TRACE_EVERY = 0.005, 0.1, 1.0
+# frames kept for a traced allocation, tracing costs more with more
+# frames, and lines in the report
+FRAMES, TOP = 10, 20
+# a thread whose innermost frame is in these files is waiting
+IDLE_FILES = ('threading.py', 'queue.py', 'selectors.py',
+              os.path.join('concurrent', 'futures', 'thread.py'),
+              os.path.join('concurrent', 'futures', '_base.py'),
+              os.path.join('asyncio', 'unix_events.py'))
+
+# stage and lines of functions by key of pstats, stage of modules by
+# filename and stage of built-in functions by name
+_CODES = {}
+_MODULES = {}
+_BUILTINS = {'<built-in method posix.scandir>': 'scan',
+             '<built-in method posix.listdir>': 'scan',
+             '<built-in method nt.scandir>': 'scan',
+             '<built-in method nt.listdir>': 'scan'}
+
+
+def staged(name):
+    """Decorator to attribute a function to stage of name, the function
+    is returned unchanged.
+
+    Example:
+
+    >>> @staged('parse')
+    ... def parse(line):
+    ...     return line.split()
+    >>> stage_of(code_key(parse.__code__))
+    'parse'
+    """
+    if name not in STAGES:
+        raise ValueError('unknown stage: {}'.format(name))
+
+    def register(function):
+        code = function.__code__
+        lines = [line for _, _, line in code.co_lines() if line]
+        _CODES[code_key(code)] = name, min(lines), max(lines)
+        return function
+
+    return register
+
+
+def staged_module(name, *modules):
+    """Attribute all the functions of modules to stage of name."""
+    for module in modules:
+        _MODULES[module.__file__] = name
+
+
+def code_key(code):
+    """Return the key of code used by pstats."""
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def stage_of(key):
+    """Return stage of a function by the key of pstats, None if the
+    function is not in any stage.
+    """
+    if key in _CODES:
+        return _CODES[key][0]
+    if key[0] in _MODULES:
+        return _MODULES[key[0]]
+
+    return _BUILTINS.get(key[2])
+
+
+def stage_of_line(filename, lineno):
+    """Return stage of a line of source code, None if it is not in any."""
+    for (code_file, _, _), (name, first, last) in _CODES.items():
+        if code_file == filename and first <= lineno <= last:
+            return name
+
+    return _MODULES.get(filename)
+
+
+def pop_option(argv):
+    """Remove --profile from argv, return prefix of profile files, None
+    if the option is not given.
+
+    Example:
+
+    >>> argv = ['qualitycheck.py', '--profile=_qc', '*.17o']
+    >>> pop_option(argv), argv
+    ('_qc', ['qualitycheck.py', '*.17o'])
+    >>> pop_option(['orderfile.py', '*.17o']) is None
+    True
+    """
+    for idx, arg in enumerate(argv[1:], 1):
+        if arg == OPTION or arg.startswith(OPTION + '='):
+            del argv[idx]
+            return arg[len(OPTION) + 1:] or PREFIX
+
+    return None
+
+
+def frame_name(code):
+    """Return name of a frame in collapsed stacks."""
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(
+        code.co_filename), code.co_firstlineno)
+
+
+class Sampler(threading.Thread):
+    """Thread to sample stacks of the other threads, and allocations in
+    windows of tracing memory.
+    """
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stopped = threading.Event()
+        self.stacks = collections.Counter()
+        # size and count of blocks by line, bytes by stage, windows
+        self.lines = collections.defaultdict(lambda: [0, 0])
+        self.memory = dict.fromkeys(STAGES, 0)
+        self.windows = 0
+
+    def sample(self):
+        """Count the stacks of the running threads."""
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            if frame.f_code.co_filename.endswith(IDLE_FILES):
+                continue
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def end_window(self):
+        """Add allocations traced in the window, and stop tracing."""
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)])
+        tracemalloc.stop()
+        for stat in snapshot.statistics('lineno'):
+            frame = stat.traceback[0]
+            line = self.lines[frame.filename, frame.lineno]
+            line[0] += stat.size
+            line[1] += stat.count
+        for name, size in stage_memory(snapshot).items():
+            self.memory[name] += size
+        self.windows += 1
+
+    def run(self):
+        tracemalloc.start(FRAMES)
+        start = time.perf_counter()
+        while not self.stopped.wait(INTERVAL):
+            self.sample()
+            elapsed = time.perf_counter() - start
+            if tracemalloc.is_tracing() and elapsed > WINDOW:
+                self.end_window()
+            elif not tracemalloc.is_tracing() and elapsed > TRACE_EVERY:
+                tracemalloc.start(FRAMES)
+                start = time.perf_counter()
+        if tracemalloc.is_tracing():
+            self.end_window()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Session(object):
+    """A session of profiling, cProfile is enabled in every thread."""
+    def __init__(self):
+        self.profiles, self.lock = [], threading.Lock()
+        self.sampler = Sampler()
+
+    def new_profile(self):
+        """Return a new profile counting CPU time of the thread."""
+        profile = cProfile.Profile(time.thread_time)
+        with self.lock:
+            self.profiles.append(profile)
+
+        return profile
+
+    def hook(self, frame, event, arg):
+        """Hook of new threads, replace itself by a profile."""
+        sys.setprofile(None)
+        self.new_profile().enable()
+
+    def run(self, function):
+        """Run function and profile it, return what function returns."""
+        self.sampler.start()
+        threading.setprofile(self.hook)
+        profile = self.new_profile()
+        self.start, self.cpu = time.perf_counter(), time.process_time()
+        profile.enable()
+        try:
+            return function()
+        finally:
+            profile.disable()
+            threading.setprofile(None)
+            self.seconds = time.perf_counter() - self.start
+            self.cpu = time.process_time() - self.cpu
+            self.sampler.stop()
+
+    def stats(self, stream=None):
+        """Return stats of all the threads."""
+        return pstats.Stats(*self.profiles, stream=stream)
+
+
+def stage_times(stats):
+    """Return dict of stage and a list of calls and CPU seconds, time of
+    a function called by another of the same stage is not counted twice.
+    """
+    times = {name: [0, 0.0] for name in STAGES}
+    for key, (_, calls, _, cumulative, callers) in stats.stats.items():
+        stage = stage_of(key)
+        if stage is None:
+            continue
+        nested = sum(edge[3] for caller, edge in callers.items()
+                     if caller != key and stage_of(caller) == stage)
+        times[stage][0] += calls
+        times[stage][1] += cumulative - nested
+
+    return times
+
+
+def stage_memory(snapshot):
+    """Return dict of stage and bytes allocated in it of a snapshot, the
+    most recent frame of a stage takes the allocation.
+    """
+    memory = dict.fromkeys(STAGES, 0)
+    for trace in snapshot.traces:
+        for frame in reversed(trace.traceback):
+            stage = stage_of_line(frame.filename, frame.lineno)
+            if stage is not None:
+                memory[stage] += trace.size
+                break
+
+    return memory
+
+
+def peak_rss():
+    """Return peak resident memory of the process in KB, None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak / 1024 if sys.platform == 'darwin' else peak
+
+
+def write_report(session, report_file):
+    """Write the report of stages, functions and allocations."""
+    stream = io.StringIO()
+    stats = session.stats(stream)
+    sampler = session.sampler
+    total = sum(tottime for _, _, tottime, _, _ in stats.stats.values())
+    # share of CPU time of the process, profiled threads use the most
+    cpu = max(session.cpu, total)
+    rss = peak_rss()
+    lines = [
+        'Profile of: {}'.format(' '.join(sys.argv)),
+        'Wall time: {:.3f} s, CPU time: {:.3f} s, profiled CPU time: {:.3f} '
+        's'.format(session.seconds, session.cpu, total),
+        'Peak resident memory: {}, memory traced in {} windows'.format(
+            'unknown' if rss is None else '{:.1f} MB'.format(rss / 1024),
+            sampler.windows),
+        '',
+        '{: <10s} {: >10s} {: >10s} {: >7s} {: >12s}'.format(
+            'stage', 'calls', 'CPU s', 'share', 'memory KB'),
+    ]
+    for name, (calls, seconds) in stage_times(stats).items():
+        lines.append('{: <10s} {:10d} {:10.3f} {:7.1%} {:12.1f}'.format(
+            name, calls, seconds, seconds / cpu if cpu else 0,
+            sampler.memory[name] / 1024))
+    lines += ['', 'Top {} lines allocating memory:'.format(TOP)]
+    top_lines = sorted(sampler.lines.items(), key=lambda item: -item[1][0])
+    for (filename, lineno), (size, count) in top_lines[:TOP]:
+        lines.append('{:12.1f} KB {:8d} blocks  {}:{}  {}'.format(
+            size / 1024, count, filename, lineno,
+            linecache.getline(filename, lineno).strip()))
+    lines += ['', 'Top {} functions by CPU time:'.format(TOP)]
+    stats.sort_stats('tottime').print_stats(TOP)
+    with open(report_file, 'w') as report_writer:
+        report_writer.writelines(line + '\n' for line in lines)
+        report_writer.write(stream.getvalue())
+
+
+def save(session, prefix):
+    """Save pstats, collapsed stacks and the report of a session."""
+    session.stats().dump_stats(prefix + '.pstats')
+    with open(prefix + '.collapsed', 'w') as stack_writer:
+        for stack, count in session.sampler.stacks.most_common():
+            stack_writer.write('{} {}\n'.format(stack, count))
+    write_report(session, prefix + '.txt')
+    print('Profile saved: {0}.pstats, {0}.collapsed, {0}.txt'.format(prefix),
+          file=sys.stderr)
+
+
+def run(main):
+    """Run main function of a script, profile it if --profile is given,
+    return what main returns.
+    """
+    prefix = pop_option(sys.argv)
+    if prefix is None:
+        return main()
+    session = Session()
+    try:
+        return session.run(main)
+    finally:
+        save(session, prefix)
+
+
+staged_module('scan', glob, fnmatch)
+staged('scan')(os.walk)
@@ -6,6 +6,30 @@ Will print primary marks of data quality. Using concurent.futures. The
 RINEX file quality check function rely on TEQC software, Check ifyou
 have installed TEQC by typing `teqc -help` in cmd.
 
+The native engine reads RINEX 2.11 observation files directly, runs in
+a process pool and does not need TEQC. TEQC runs are executed directly
+in an event loop, with a timeout for every file.
+
+Results are stored in a SQLite cache keyed by the content hash of the
+observation file, the navigation file and the engine, so only new or
+modified files are checked again. Cached results unused for long, or
+beyond the size of cache, are evicted.
+
+Quality marks can be streamed as csv or jsonl rows, or saved by columns
+into a NumPy .npz file. Result files of many runs can be aggregated by
+site or by day, e.g. median MP1/MP2, quantiles of SN1 and outliers of
+CSR of a whole network in a year.
+
+The summary engine reads marks from existing TEQC summary (.S) files in
+a single pass, so historical reports are indexed without running TEQC.
+
+Files compressed by compress, gzip, bzip2 or xz are decompressed in a
+stream by every engine, a pipe is fed into the stdin of TEQC. Compact
+RINEX files, compressed or not, are checked directly too: the native
+engine decompresses lines into the check, and for TEQC a pipe chain of
+decompressor, crx2rnx and TEQC is built, so nothing is written to disk
+and a file is read only once.
+
 :author: Jon Jiang
 :email: jiangyingming@live.com
 :modify: Nov 1, 2019
@@ -13,13 +37,45 @@ have installed TEQC by typing `teqc -help` in cmd.
 from concurrent import futures
 from textwrap import shorten
 import argparse
+import asyncio
+import contextlib
+import csv
 import datetime
+import functools
 import glob
+import hashlib
 import itertools
+import json
+import math
 import os
-import subprocess
+import sqlite3
+import sys
+import time
+import warnings
+import zipfile
 
-MAX_THREADING = max(6, os.cpu_count())
+import numpy as np
+
+import compressed
+import profiler
+import rinexqc
+import rnxname
+import taskpool
+import telemetry
+import toolrun
+
+MAX_SUBPROCESS = max(6, os.cpu_count())
+MAX_PROCESS = os.cpu_count()
+# bytes read every time when hashing a file
+HASH_BLOCK = 1 << 20
+# default max days and max count of results kept in cache
+MAX_AGE, MAX_SIZE = 90, 100000
+# names of quality marks, the same order as parse_report returns
+COLUMNS = ('file', 'date', 'start', 'end', 'hours', 'percent', 'SN1', 'SN2',
+           'MP1', 'MP2', 'CSR')
+TEXT_COLUMNS, NUMBER_COLUMNS = COLUMNS[0:4], COLUMNS[4:]
+# CSR beyond upper quartile by times of interquartile range is outlier
+OUTLIER_IQR = 1.5
 QUALITYINFO = (
     {'name': 'start', 'flag': 'Time of start of window :', 'pos': slice(25, 51)},
     {'name': 'end', 'flag': 'Time of  end  of window :', 'pos': slice(37, 51)},
@@ -29,27 +85,93 @@ QUALITYINFO = (
     {'name': 'SN1', 'flag': 'Mean S1                 :', 'pos': slice(26, 31)},
     {'name': 'SN2', 'flag': 'Mean S2                 :', 'pos': slice(26, 31)}
 )
+# all the flags are at the beginning of lines and have the same width
+FLAG_WIDTH = 25
+FLAGS = {item['flag']: item for item in QUALITYINFO}
+
+
+def is_mark_line(line):
+    """Check if a line of TEQC report contains quality marks.
 
+    Example:
+
+    >>> is_mark_line('Mean S1                 : 46.95 (sd=5.80 n=49483)')
+    True
+    >>> is_mark_line('Receiver type           : TRIMBLE NETR9')
+    False
+    """
+    return (line.startswith('SUM')
+            or any(item['flag'] in line for item in QUALITYINFO))
+
+
+def is_compact(src_file):
+    """Check if a file is Compact RINEX by its name, compressed or not.
+
+    Example:
+
+    >>> is_compact('bjfs2220.17d.Z'), is_compact('bjfs2220.17o.gz')
+    (True, False)
+    >>> is_compact('WARN00DEU_R_20170420000_01D_30S_MO.crx')
+    True
+    """
+    record = rnxname.parse(os.path.basename(src_file))
 
-def quality_check(src_file, nav_file):
-    """Run quality check for source file using TEQC software.
+    return record is not None and record.kind == 'd'
+
+
+def teqc_input(src_file):
+    """Return arguments of source file for TEQC and the opener of stdin
+    of TEQC. A compressed file is decompressed into a pipe, a Compact
+    RINEX file is converted by crx2rnx into a pipe.
+
+    Example:
+
+    >>> teqc_input('bjfs2220.17o')
+    (['bjfs2220.17o'], None)
+    >>> src_args, stdin = teqc_input('bjfs2220.17d.Z')
+    >>> src_args, stdin.func.__name__, stdin.args[0]
+    ([], 'piped', ('crx2rnx', '-'))
+    """
+    decompress = functools.partial(compressed.open_pipe, src_file)
+    if is_compact(src_file):
+        if compressed.suffix(src_file):
+            crx_args, crx_stdin = ('crx2rnx', '-'), decompress
+        else:
+            crx_args, crx_stdin = ('crx2rnx', '-', src_file), None
+        # exit status of crx2rnx: {0: success, 1: error, 2: warning}
+        return [], functools.partial(toolrun.piped, crx_args, crx_stdin,
+                                     ok=(0, 2))
+    if compressed.suffix(src_file):
+        return [], decompress
+
+    return [src_file], None
+
+
+@profiler.staged('execute')
+async def quality_check(src_file, nav_file, timeout=toolrun.TIMEOUT):
+    """Run quality check for source file using TEQC software, the report
+    is streamed and only the lines of quality marks are kept.
 
     1. If run TEQC successfully, return quality check report;
     2. If run TEQC failed, return None.
     """
+    args = ['teqc', '+qc', '-plot', '-rep']
     if nav_file:
-        args = 'teqc', '+qc', '-plot', '-rep', '-nav', nav_file, src_file
-    else:
-        args = 'teqc', '+qc', '-plot', '-rep', src_file
-    status, output = subprocess.getstatusoutput(' '.join(args))
+        args += ['-nav', nav_file]
+    src_args, stdin = teqc_input(src_file)
+    result = await toolrun.run(args + src_args, select=is_mark_line,
+                               timeout=timeout, stdin=stdin)
     # If exit status of TEQC software is not 0, means error
-    return None if status > 0 else output.split('\n')
+    return result.output if result.status == 0 else None
 
 
+@profiler.staged('parse')
 def parse_report(report):
-    """Parse TEQC quality check report.
+    """Parse TEQC quality check report, or lines of a TEQC summary (.S)
+    file, in a single pass.
 
-    Return a tuple: (date, start, end, length, SN1, SN2, MP1, MP2, CSR).
+    Return a tuple: (date, start, end, length, percent, SN1, SN2, MP1,
+    MP2, CSR).
 
     Example:
     >>> report = [
@@ -69,16 +191,19 @@ def parse_report(report):
     >>> result[0:3]
     ('2017-08-10', '00:00:00.000', '23:59:30.000')
     >>> [round(num, 2) for num in result[3:]]
-    [14.52, 46.95, 42.21, 0.43, 0.38, 0.25]
+    [14.52, 100.0, 46.95, 42.21, 0.43, 0.38, 0.25]
 
     """
-    # Search quality marks in the report
-    marks = {}
-    for item in QUALITYINFO:
-        for line in report:
-            if item['flag'] in line:
-                marks[item['name']] = line[item['pos']].strip()
-                break
+    # Search quality marks and the last SUM line in the report, the
+    # first one of every mark is used
+    marks, last_line = {}, None
+    for line in report:
+        if line.startswith('SUM'):
+            last_line = line
+            continue
+        item = FLAGS.get(line[0:FLAG_WIDTH])
+        if item is not None and item['name'] not in marks:
+            marks[item['name']] = line[item['pos']].strip()
     # Restruct the quality marks into a tuple
     # Get SN1, SN2, MP1 & MP2, they may not found in the report
     sn1, sn2 = float(marks.get('SN1', 'nan')), float(marks.get('SN2', 'nan'))
@@ -86,7 +211,8 @@ def parse_report(report):
     date = datetime.datetime.strptime(marks['start'][0:11], '%Y %b %d')
     start, end = marks['start'][11:].strip(), marks['end']
     # Get observation data length, TEQC may output a warn at the tail
-    last_line = next(l for l in reversed(report) if l.startswith('SUM'))
+    if last_line is None:
+        raise ValueError('SUM line not found in report')
     last_line_pieces = last_line.split()
     length = float(last_line_pieces[-8])
     # Get the percentage of data, maybe unknown
@@ -102,14 +228,77 @@ def parse_report(report):
     return result
 
 
+async def teqc_marks(src_file, nav_file, timeout=toolrun.TIMEOUT):
+    """Get quality marks of source file using TEQC software, return None
+    if run TEQC failed.
+    """
+    try:
+        report = await quality_check(src_file, nav_file, timeout)
+        return parse_report(report) if report else None
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+
+
+@profiler.staged('execute')
+def summary_marks(src_file, nav_file):
+    """Get quality marks from an existing TEQC summary (.S) file without
+    running TEQC, return None if the file could not be parsed. The
+    nav_file is not used.
+    """
+    try:
+        with compressed.open(src_file, 'rt', errors='replace') as sum_reader:
+            return parse_report(sum_reader)
+    except (KeyError, IndexError, *compressed.ERRORS):
+        return None
+
+
+@profiler.staged('execute')
+def native_marks(src_file, nav_file):
+    """Get quality marks of source file using the native engine, return
+    None if the file could not be checked. The nav_file is not used.
+    """
+    try:
+        return rinexqc.quality_check(src_file, is_compact(src_file))
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+
+
+# engines run in processes
+PROCESS_ENGINES = {'native': native_marks, 'summary': summary_marks}
+
+
+def json_record(record, names=COLUMNS):
+    """Convert a record of quality marks into a dict for JSON by names,
+    NaN is converted into None.
+
+    Example:
+
+    >>> json_record(('bjfs2220.17o', '2017-08-10', '00:00:00.000',
+    ...              '23:59:30.000', 23.99, 98.96, 44.96, 39.01, 0.34, 0.33,
+    ...              float('nan')))['CSR'] is None
+    True
+    """
+    return {name: None if isinstance(value, float) and math.isnan(value)
+            else value for name, value in zip(names, record)}
+
+
+@profiler.staged('report')
 def print_marks(marks, out_fmt):
-    """Print marks of quality check, the out_fmt is list or table."""
+    """Print marks of quality check, the out_fmt is list, table, csv or
+    jsonl. Rows of csv and jsonl are flushed at once, so they can be read
+    while the check is running.
+    """
     if out_fmt == 'list' or out_fmt == 'l':
         message = ('\n{0} quality marks:\n' 'date: {1}\n' 'start: {2}\n'
                    'end: {3}\n' 'hours: {4}\n' 'percent {5:.2f}\n'
                    'SN1: {6:.2f}\n' 'SN2: {7:.2f}\n' 'MP1: {8:.2f}\n'
                    'MP2: {9:.2f}\n' 'CSR: {10:.2f}')
         print(message.format(*marks))
+    elif out_fmt == 'csv':
+        csv.writer(sys.stdout).writerow(marks)
+        sys.stdout.flush()
+    elif out_fmt == 'jsonl':
+        print(json.dumps(json_record(marks)), flush=True)
     else:
         message = ('{0: ^14s} {1: ^12s} {2: ^14s} {3: ^14s} {4: 6.2f} '
                    '{5: 7.1f}  {6: 6.2f}  {7: 6.2f}  {8: 6.2f}  {9: 5.2f}  '
@@ -117,26 +306,443 @@ def print_marks(marks, out_fmt):
         print(message.format(os.path.basename(marks[0]), *marks[1:]))
 
 
-def parallel_teqc(src_files, nav_file, out_fmt):
-    """Parallel run function using argvs."""
-    with futures.ThreadPoolExecutor(max_workers=MAX_THREADING) as executor:
-        todo_map = {}
-        for src_file in src_files:
-            future = executor.submit(quality_check, src_file, nav_file)
-            todo_map[future] = src_file
-        task_iter = futures.as_completed(todo_map)
-        failed_files = []
-        for future in task_iter:
-            src_file = todo_map[future]
-            # return None means task is success
-            res = future.result()
-            if res:
-                record = (src_file, *parse_report(res))
-                print_marks(record, out_fmt)
+@profiler.staged('report')
+def save_columns(records, out_file):
+    """Save records of quality marks into a NumPy .npz file by columns,
+    text columns are saved as strings and the others as floats.
+    """
+    columns = list(zip(*records)) or [()] * len(COLUMNS)
+    arrays = {name: np.array(values, dtype=str if name in TEXT_COLUMNS
+                             else float)
+              for name, values in zip(COLUMNS, columns)}
+    # write arrays like np.savez_compressed, whose argument is also named
+    # file, so the column file can not be passed as a keyword
+    with zipfile.ZipFile(out_file, 'w', zipfile.ZIP_DEFLATED) as npz_writer:
+        for name, array in arrays.items():
+            with npz_writer.open(name + '.npy', 'w') as array_writer:
+                np.lib.format.write_array(array_writer, array)
+
+
+@profiler.staged('parse')
+def load_results(result_files):
+    """Load quality marks from result files in csv, jsonl or npz format,
+    return a dict of column name and NumPy array.
+
+    Example:
+
+    >>> import tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> records = [('bjfs2220.17o', '2017-08-10', '00:00:00.000',
+    ...             '23:59:30.000', 23.99, 98.96, 44.96, 39.01, 0.34, 0.33,
+    ...             float('nan'))]
+    >>> out_file = os.path.join(tmp_dir, 'marks.npz')
+    >>> save_columns(records, out_file)
+    >>> columns = load_results([out_file])
+    >>> columns['file'].tolist(), columns['MP1'].tolist()
+    (['bjfs2220.17o'], [0.34])
+    >>> os.remove(out_file)
+    >>> os.rmdir(tmp_dir)
+    """
+    columns = {name: [] for name in COLUMNS}
+    for result_file in result_files:
+        ext = os.path.splitext(result_file)[1].lower()
+        if ext == '.npz':
+            with np.load(result_file) as arrays:
+                for name in COLUMNS:
+                    columns[name].extend(arrays[name].tolist())
+            continue
+        with open(result_file, newline='') as result_reader:
+            if ext == '.csv':
+                rows = csv.DictReader(result_reader)
             else:
-                failed_files.append(os.path.basename(src_file))
+                rows = (json.loads(line) for line in result_reader
+                        if line.strip())
+            for row in rows:
+                for name in COLUMNS:
+                    columns[name].append(row[name])
+    arrays = {}
+    for name, values in columns.items():
+        if name in TEXT_COLUMNS:
+            arrays[name] = np.array(values, dtype=str)
+        else:
+            # missing marks are empty in csv and null in jsonl
+            arrays[name] = np.array([float('nan') if value in (None, '')
+                                     else float(value) for value in values])
+
+    return arrays
+
+
+def site_day_matrix(columns):
+    """Arrange quality marks into matrixes of site x day, NaN means no
+    result. Return sorted sites, days and a dict of column name and
+    matrix, the last result is used if a site has more in a day.
+
+    Example:
+
+    >>> columns = {'file': np.array(['bjfs2220.17o', 'urum2220.17o',
+    ...                              'bjfs2230.17o']),
+    ...            'date': np.array(['2017-08-10', '2017-08-10',
+    ...                              '2017-08-11'])}
+    >>> columns.update({name: np.array([1.0, 2.0, 3.0])
+    ...                 for name in NUMBER_COLUMNS})
+    >>> sites, days, matrixes = site_day_matrix(columns)
+    >>> sites.tolist(), days.astype(str).tolist()
+    (['bjfs', 'urum'], ['2017-08-10', '2017-08-11'])
+    >>> matrixes['MP1'].tolist()
+    [[1.0, 3.0], [2.0, nan]]
+    """
+    sites = np.array([rnxname.site_of(name) for name in columns['file']])
+    sites, site_index = np.unique(sites, return_inverse=True)
+    days = columns['date'].astype('datetime64[D]')
+    days, day_index = np.unique(days, return_inverse=True)
+    matrixes = {}
+    for name in NUMBER_COLUMNS:
+        matrix = np.full((len(sites), len(days)), np.nan)
+        matrix[site_index, day_index] = columns[name]
+        matrixes[name] = matrix
+
+    return sites, days, matrixes
+
+
+@profiler.staged('report')
+def summarize(matrixes, axis):
+    """Compute statistics of quality marks in matrixes of site x day, per
+    site if axis is 1, per day if axis is 0. Return a dict of name and
+    array of statistics. CSR larger than the upper fence of the whole
+    network is an outlier.
+
+    Example:
+
+    >>> matrixes = {name: np.array([[1.0, 3.0], [2.0, np.nan]])
+    ...             for name in NUMBER_COLUMNS}
+    >>> matrixes['CSR'] = np.array([[1.0, 1.0], [1.0, 20.0]])
+    >>> stats = summarize(matrixes, axis=1)
+    >>> stats['count'].tolist(), stats['MP1'].tolist()
+    ([2, 1], [2.0, 2.0])
+    >>> stats['outliers'].tolist()
+    [0, 1]
+    """
+    csr = matrixes['CSR']
+    with warnings.catch_warnings():
+        # statistics of a site or day without results are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        lower, upper = np.nanpercentile(csr, [25, 75])
+        sn1 = np.nanpercentile(matrixes['SN1'], [10, 50, 90], axis=axis)
+        stats = {
+            'count': np.count_nonzero(~np.isnan(matrixes['hours']),
+                                      axis=axis),
+            'percent': np.nanmean(matrixes['percent'], axis=axis),
+            'SN1_p10': sn1[0], 'SN1_p50': sn1[1], 'SN1_p90': sn1[2],
+            'SN2_p50': np.nanmedian(matrixes['SN2'], axis=axis),
+            'MP1': np.nanmedian(matrixes['MP1'], axis=axis),
+            'MP2': np.nanmedian(matrixes['MP2'], axis=axis),
+            'CSR': np.nanmedian(csr, axis=axis),
+            'outliers': np.count_nonzero(
+                csr > upper + OUTLIER_IQR * (upper - lower), axis=axis),
+        }
+
+    return stats
+
 
-    return failed_files
+@profiler.staged('report')
+def print_stats(key_name, keys, stats, out_fmt):
+    """Print statistics of every site or day as a table, csv or jsonl."""
+    names = [key_name, *stats]
+    rows = zip(keys.astype(str).tolist(),
+               *(values.tolist() for values in stats.values()))
+    if out_fmt == 'csv':
+        writer = csv.writer(sys.stdout)
+        writer.writerow(names)
+        writer.writerows(rows)
+        return
+    if out_fmt == 'jsonl':
+        for row in rows:
+            print(json.dumps(json_record(row, names)))
+        return
+    print(' '.join('{: >10s}'.format(name) for name in names))
+    for row in rows:
+        cells = ('{: >10s}'.format(value) if isinstance(value, str)
+                 else '{: 10d}'.format(value) if isinstance(value, int)
+                 else '{: 10.2f}'.format(value) for value in row)
+        print(' '.join(cells))
+
+
+def aggregate(result_files, by, out_fmt):
+    """Aggregate quality marks in result files by site or day."""
+    columns = load_results(result_files)
+    if not len(columns['file']):
+        print('No quality marks found in result files')
+        return 1
+    sites, days, matrixes = site_day_matrix(columns)
+    if by == 'site':
+        print_stats('site', sites, summarize(matrixes, 1), out_fmt)
+    else:
+        print_stats('date', days, summarize(matrixes, 0), out_fmt)
+
+    return 0
+
+
+def collect_results(task_iter, failed_files, cache=None, keys=None,
+                    make_key=None):
+    """Yield records of quality marks of finished tasks and store them
+    into cache, failed files are appended into failed_files. A task
+    returns the hash of the file if it is hashed in the worker, then the
+    key is made by make_key, else the key is found in keys.
+    """
+    for (src_file, *_), (hashed, res) in task_iter:
+        key = keys.pop(src_file, None) if keys is not None else None
+        if cache is not None and hashed is not None:
+            store_digest(cache, src_file, *hashed)
+            key = make_key(hashed[1])
+        # return None means task is failed
+        if res:
+            if cache is not None and key is not None:
+                update_cache(cache, key, res)
+            yield (src_file, *res)
+        else:
+            failed_files.append(os.path.basename(src_file))
+
+
+def file_digest(src_file):
+    """Return BLAKE2 hash of the content of a file in hex."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(src_file, 'rb') as src_reader:
+        for block in iter(lambda: src_reader.read(HASH_BLOCK), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def stat_key(src_file):
+    """Return size, mtime and inode of a file, which tell if it changed."""
+    stat = os.stat(src_file)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def hash_file(src_file):
+    """Return stat key and content hash of a file, the stat is taken
+    before hashing, so a file changed meanwhile is hashed again later.
+    """
+    return stat_key(src_file), file_digest(src_file)
+
+
+def open_cache(db_file):
+    """Open the SQLite cache of quality check, create tables if not
+    exists, return the connection.
+    """
+    cache = sqlite3.connect(db_file)
+    # hashes of files, keyed by path and checked by size, mtime and inode
+    cache.execute('CREATE TABLE IF NOT EXISTS digest (path TEXT PRIMARY KEY, '
+                  'size INTEGER, mtime INTEGER, inode INTEGER, digest TEXT, '
+                  'used REAL)')
+    cache.execute('CREATE TABLE IF NOT EXISTS marks (key TEXT PRIMARY KEY, '
+                  'marks TEXT, used REAL)')
+
+    return cache
+
+
+def cached_digest(cache, src_file):
+    """Return content hash of a file in cache, None if it is not in cache
+    or changed, the file is not read.
+    """
+    path = os.path.abspath(src_file)
+    sql = 'SELECT size, mtime, inode, digest FROM digest WHERE path = ?'
+    row = cache.execute(sql, (path,)).fetchone()
+    if row is None or tuple(row[0:3]) != stat_key(path):
+        return None
+    cache.execute('UPDATE digest SET used = ? WHERE path = ?',
+                  (time.time(), path))
+
+    return row[3]
+
+
+def store_digest(cache, src_file, key, digest):
+    """Store content hash of a file with its stat key in cache."""
+    sql = 'INSERT OR REPLACE INTO digest VALUES (?, ?, ?, ?, ?, ?)'
+    cache.execute(sql, (os.path.abspath(src_file), *key, digest,
+                        time.time()))
+
+
+def content_digest(cache, src_file):
+    """Return content hash of a file, the file is only hashed if it is
+    not in cache or changed.
+    """
+    digest = cached_digest(cache, src_file)
+    if digest is None:
+        key, digest = hash_file(src_file)
+        store_digest(cache, src_file, key, digest)
+
+    return digest
+
+
+def result_key(digest, engine, nav_digest=None):
+    """Return key of quality check result of source file, made of content
+    hashes of source file and navigation file, and the engine.
+
+    Example:
+
+    >>> result_key('a1b2', 'teqc', 'c3d4')
+    'a1b2-teqc-c3d4'
+    >>> result_key('a1b2', 'native')
+    'a1b2-native'
+    """
+    digests = [digest, engine]
+    if nav_digest:
+        digests.append(nav_digest)
+
+    return '-'.join(digests)
+
+
+def lookup_cache(cache, key):
+    """Look up quality marks by key in cache, return None if not found.
+
+    Example:
+
+    >>> cache = open_cache(':memory:')
+    >>> lookup_cache(cache, 'key') is None
+    True
+    >>> update_cache(cache, 'key', ('2017-08-10', 23.99, float('nan')))
+    >>> lookup_cache(cache, 'key')
+    ('2017-08-10', 23.99, nan)
+    >>> evict_cache(cache, max_age=90, max_size=0)
+    1
+    """
+    row = cache.execute('SELECT marks FROM marks WHERE key = ?',
+                        (key,)).fetchone()
+    if row is None:
+        return None
+    cache.execute('UPDATE marks SET used = ? WHERE key = ?',
+                  (time.time(), key))
+
+    return tuple(json.loads(row[0]))
+
+
+def update_cache(cache, key, marks):
+    """Store quality marks with key in cache."""
+    sql = 'INSERT OR REPLACE INTO marks VALUES (?, ?, ?)'
+    cache.execute(sql, (key, json.dumps(marks), time.time()))
+
+
+def evict_cache(cache, max_age=MAX_AGE, max_size=MAX_SIZE):
+    """Remove results unused for more than max_age days, and the least
+    recently used results beyond max_size, return the count of removed
+    results.
+    """
+    expire = time.time() - max_age * 86400
+    removed = cache.execute('DELETE FROM marks WHERE used < ?',
+                            (expire,)).rowcount
+    removed += cache.execute(
+        'DELETE FROM marks WHERE key NOT IN (SELECT key FROM marks '
+        'ORDER BY used DESC LIMIT ?)', (max_size,)).rowcount
+    cache.execute('DELETE FROM digest WHERE used < ?', (expire,))
+    cache.commit()
+
+    return removed
+
+
+@profiler.staged('plan')
+def select_files(src_files, cache, keys, hits, make_key):
+    """Yield source files to check lazily, with True if the file must be
+    hashed by the worker. A file whose hash is in cache is not read, its
+    key is stored into keys, and the record is appended into hits if the
+    quality marks are found in cache.
+    """
+    for src_file in src_files:
+        if cache is None:
+            yield src_file, False
+            continue
+        try:
+            digest = cached_digest(cache, src_file)
+        except OSError:
+            # let the quality check report the failure
+            yield src_file, False
+            continue
+        if digest is None:
+            yield src_file, True
+            continue
+        key = make_key(digest)
+        marks = lookup_cache(cache, key)
+        if marks is None:
+            keys[src_file] = key
+            yield src_file, False
+        else:
+            hits.append((src_file, *marks))
+
+
+def try_hash(src_file):
+    """Return stat key and content hash of a file, None if it can not be
+    read, then the quality check reports the failure.
+    """
+    try:
+        return hash_file(src_file)
+    except OSError:
+        return None
+
+
+def keyed_marks(src_file, nav_file, hashed, engine):
+    """Run a process engine for source file in a worker, the file is
+    hashed first if hashed is True. Return the hash and quality marks.
+    """
+    digest = try_hash(src_file) if hashed else None
+    return digest, PROCESS_ENGINES[engine](src_file, nav_file)
+
+
+async def keyed_teqc(src_file, nav_file, hashed, timeout):
+    """Run TEQC for source file, the file is hashed in a thread first if
+    hashed is True. Return the hash and quality marks.
+    """
+    digest = None
+    if hashed:
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, try_hash, src_file)
+    return digest, await teqc_marks(src_file, nav_file, timeout)
+
+
+def parallel_teqc(src_files, nav_file, failed_files, engine='teqc',
+                  timeout=toolrun.TIMEOUT, cache=None, recorder=None):
+    """Parallel run quality check using TEQC in an event loop, or using
+    the native engine or reading TEQC summary files in processes, yield
+    records of quality marks in the order of completion.
+
+    Files are pulled lazily by the pool, results in cache are yielded as
+    they are found, only the other files are checked, and are measured
+    if recorder of telemetry is given. A new or changed file is hashed
+    by the worker checking it, so the check starts without hashing the
+    whole tree first.
+    """
+    nav_digest = None
+    # only TEQC uses navigation file
+    if cache is not None and nav_file and engine == 'teqc':
+        nav_digest = content_digest(cache, nav_file)
+    make_key = functools.partial(result_key, engine=engine,
+                                 nav_digest=nav_digest)
+    keys, hits = {}, []
+    todo = select_files(src_files, cache, keys, hits, make_key)
+    if engine in PROCESS_ENGINES:
+        window = MAX_PROCESS * taskpool.WINDOW_PER_WORKER
+        function, argvs = telemetry.measure(
+            recorder, keyed_marks,
+            ((src_file, nav_file, hashed, engine)
+             for src_file, hashed in todo))
+        executor = futures.ProcessPoolExecutor(max_workers=MAX_PROCESS)
+        task_iter = taskpool.imap_unordered(executor, function, argvs,
+                                            window)
+    else:
+        function, argvs = telemetry.measure(
+            recorder, keyed_teqc,
+            ((src_file, nav_file, hashed, timeout)
+             for src_file, hashed in todo))
+        executor = contextlib.nullcontext()
+        task_iter = toolrun.imap_unordered(function, argvs, MAX_SUBPROCESS)
+    with executor:
+        task_iter = telemetry.collect(recorder, task_iter)
+        for record in collect_results(task_iter, failed_files, cache, keys,
+                                      make_key):
+            # results found in cache while files were pulled
+            yield from hits
+            hits.clear()
+            yield record
+        yield from hits
 
 
 def init_args():
@@ -147,16 +753,48 @@ def init_args():
     )
     # add arguments
     parser.add_argument('-v', '--version', action='version',
-                        version='%(prog)s 0.4.6')
+                        version='%(prog)s 0.12.0')
     parser.add_argument('-r', '--recursive', action='store_true',
                         help='search file recursively')
     parser.add_argument('-nav', metavar='<file>', default='',
                         help='navigation file, for complete mode')
     parser.add_argument('-out', metavar='<format>', default='table',
-                        choices=['list', 'l', 'table', 't'],
-                        help='output format, list or table [default: table]')
+                        choices=['list', 'l', 'table', 't', 'csv', 'jsonl',
+                                 'npz'],
+                        help='output format, list, table, csv, jsonl or '
+                             'npz [default: table]')
+    parser.add_argument('-save', metavar='<file>', default='_qcmarks.npz',
+                        help='columnar file of npz format '
+                             '[default: _qcmarks.npz]')
+    parser.add_argument('-agg', metavar='<by>', choices=['site', 'day'],
+                        help='aggregate result files by site or day')
+    parser.add_argument('-engine', metavar='<engine>', default='native',
+                        choices=['native', 'teqc', 'summary'],
+                        help='quality check engine, native, teqc, or '
+                             'summary to read existing TEQC summary (.S) '
+                             'files [default: native]')
+    parser.add_argument('-timeout', metavar='<seconds>', type=float,
+                        default=toolrun.TIMEOUT,
+                        help='timeout of TEQC for a file [default: {}]'
+                        .format(toolrun.TIMEOUT))
+    parser.add_argument('-cache', metavar='<cache>', default='_qccache.db',
+                        help='result cache file [default: _qccache.db]')
+    parser.add_argument('-nocache', action='store_true',
+                        help='check all the files without cache')
+    parser.add_argument('-maxage', metavar='<days>', default=MAX_AGE,
+                        type=float, help='evict results unused for days '
+                        '[default: {}]'.format(MAX_AGE))
+    parser.add_argument('-maxsize', metavar='<number>', default=MAX_SIZE,
+                        type=int, help='max results kept in cache '
+                        '[default: {}]'.format(MAX_SIZE))
+    parser.add_argument('-telemetry', metavar='<file>',
+                        help='append telemetry of files into JSON lines')
+    parser.add_argument('-prom', metavar='<file>',
+                        help='write metrics for Prometheus textfile '
+                             'collector')
     parser.add_argument('files', metavar='<file>', nargs='+',
-                        help='file will be processed')
+                        help='file will be processed, or result files '
+                             'if aggregate')
 
     return parser.parse_args()
 
@@ -167,23 +805,55 @@ def main():
     globstrs, out_fmt, recursive = args.files, args.out, args.recursive
     # collect input globstrs into a glob list
     globs = [glob.iglob(globstr, recursive=recursive) for globstr in globstrs]
-    src_files = [src for src in itertools.chain(*globs)]
+    src_files = itertools.chain(*globs)
+    if args.agg:
+        return aggregate(src_files, args.agg, out_fmt)
+    # the cache and the saved file may be matched by globs, skip them
+    own_files = {os.path.abspath(path) for path in (
+        args.cache, args.cache + '-journal', args.save)}
+    src_files = (src_file for src_file in src_files
+                 if os.path.abspath(src_file) not in own_files)
+    # messages go to stderr if rows are written into stdout for machines
+    log = sys.stderr if out_fmt in ('csv', 'jsonl') else sys.stdout
     # make input args for teqc function
-    print('Start processing: {}'.format(shorten(', '.join(globstrs), 62)))
-    # if output format is table, print a table header first
+    print('Start processing: {}'.format(shorten(', '.join(globstrs), 62)),
+          file=log)
+    # if output format is table or csv, print a table header first
     if out_fmt == 'table' or out_fmt == 't':
-        header = ('file', 'date', 'start', 'end', 'hours', 'percent',
-                  'SN1', 'SN2', 'MP1', 'MP2', 'CSR')
         style = ('\n{0: ^14s} {1: ^12s} {2: ^14s} {3: ^14s} {4: >6s}  {5: >7s}'
                  '{6: >6s}  {7: >6s}  {8: >6s}  {9: >5s}  {10: >5s}')
-        print(style.format(*header))
+        print(style.format(*COLUMNS))
+    elif out_fmt == 'csv':
+        csv.writer(sys.stdout).writerow(COLUMNS)
+    cache = None if args.nocache else open_cache(args.cache)
+    # return None means quality check is failed
+    recorder = telemetry.open_recorder('qualitycheck', args.telemetry,
+                                       args.prom, lambda res: not res[1])
     # start parallel processing
-    failed = parallel_teqc(src_files, args.nav, out_fmt)
+    failed, records = [], []
+    try:
+        for record in parallel_teqc(src_files, args.nav, failed, args.engine,
+                                    args.timeout, cache, recorder):
+            if out_fmt == 'npz':
+                records.append(record)
+            else:
+                print_marks(record, out_fmt)
+    finally:
+        # keep the finished results even if interrupted
+        if cache is not None:
+            evict_cache(cache, args.maxage, args.maxsize)
+            cache.close()
+        if recorder is not None:
+            recorder.close()
+    if out_fmt == 'npz':
+        save_columns(records, args.save)
+        print('Saved {} records: {}'.format(len(records), args.save))
     if failed:
-        print('\nQuality check failed files: {}'.format(', '.join(failed)))
+        print('\nQuality check failed files: {}'.format(', '.join(failed)),
+              file=log)
 
     return 0
 
 
 if __name__ == '__main__':
-    main()
+    profiler.run(main)
@@ -14,7 +14,11 @@ import shutil
 
 import yaml
 
+import profiler
+import rnxname
 
+
+@profiler.staged('execute')
 def rename_site(src_file, out_dir, sitemap, keep_src):
     """Rename src_file output to out_dir using a sitemap:
     1. If site isn't in sitemap, do nothing and return site name;
@@ -23,8 +27,7 @@ def rename_site(src_file, out_dir, sitemap, keep_src):
     4. If out_dir is not None and keep_src is false, rename using move.
     """
     src_dir, filename = os.path.split(src_file)
-    site = filename[0:4]
-    site_key = site.lower()
+    site, site_key = filename[0:4], rnxname.site_of(filename)
     # if site isn't in sitemap
     if site_key not in sitemap:
         return site_key
@@ -96,4 +99,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    profiler.run(main)
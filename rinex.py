@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Read RINEX observation files natively.
+
+All the functions work on iterators of text lines, so a plain file, a
+decompressor or a pipe can feed them alike, and only one epoch is hold
+in memory at a time.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+import collections
+import datetime
+import os
+
+import compressed
+
+# width of an observation field: F14.3, LLI and signal strength
+OBS_WIDTH = 16
+# observation fields per line in RINEX 2.11
+OBS_PER_LINE = 5
+Epoch = collections.namedtuple('Epoch', 'head flag sats clock records')
+# bytes of the first read of a header, grown until END OF HEADER is found
+HEAD_BLOCK = 8192
+# header records which could be edited: label, columns and format
+HEADER_ITEMS = {
+    'receiver': ('REC # / TYPE / VERS', slice(20, 40), '{:<20.20s}'),
+    'antenna': ('ANT # / TYPE', slice(20, 40), '{:<20.20s}'),
+    'position': ('APPROX POSITION XYZ', slice(0, 42), '{:14.4f}' * 3),
+    'delta': ('ANTENNA: DELTA H/E/N', slice(0, 42), '{:14.4f}' * 3),
+    'observer': ('OBSERVER / AGENCY', slice(0, 20), '{:<20.20s}'),
+    'agency': ('OBSERVER / AGENCY', slice(20, 60), '{:<40.40s}')
+}
+
+
+def label(line):
+    """Return header label of a RINEX header line.
+
+    Example:
+
+    >>> label('     2.11           OBSERVATION DATA    M (MIXED)           '
+    ...       'RINEX VERSION / TYPE')
+    'RINEX VERSION / TYPE'
+    """
+    return line[60:].strip()
+
+
+def read_header(reader):
+    """Read header lines from reader until END OF HEADER, return a list
+    of lines without line breaks.
+    """
+    header = []
+    for line in reader:
+        line = line.rstrip('\r\n')
+        header.append(line)
+        if label(line) == 'END OF HEADER':
+            break
+
+    return header
+
+
+def _pread(fd, size):
+    """Read size bytes from the beginning of file descriptor."""
+    if hasattr(os, 'pread'):
+        return os.pread(fd, size, 0)
+    os.lseek(fd, 0, os.SEEK_SET)
+
+    return os.read(fd, size)
+
+
+def read_file_header(src_file):
+    """Read header lines of a RINEX or Compact RINEX file. Plain files are
+    read by a single pread of the first block, which is grown if END OF
+    HEADER is not found, compressed files are decompressed as a stream
+    until the end of header.
+
+    Example:
+
+    >>> import gzip, tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> src_file = os.path.join(tmp_dir, 'bjfs0420.17o.gz')
+    >>> with gzip.open(src_file, 'wt') as rnx_writer:
+    ...     _ = rnx_writer.write(' ' * 60 + 'END OF HEADER\\nbody\\n')
+    >>> read_file_header(src_file)[0][60:]
+    'END OF HEADER'
+    >>> os.remove(src_file)
+    >>> os.rmdir(tmp_dir)
+    """
+    if compressed.suffix(src_file):
+        with compressed.open(src_file, 'rt',
+                             errors='replace') as rnx_reader:
+            return read_header(rnx_reader)
+    fd = os.open(src_file, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        size = HEAD_BLOCK
+        data = _pread(fd, size)
+        while b'END OF HEADER' not in data and len(data) == size:
+            size *= 4
+            data = _pread(fd, size)
+    finally:
+        os.close(fd)
+
+    return read_header(data.decode('ascii', 'replace').splitlines())
+
+
+def next_line(reader):
+    """Return next line of reader without line break, raise ValueError
+    if reader is exhausted, which means the file is truncated.
+    """
+    line = next(reader, None)
+    if line is None:
+        raise ValueError('unexpected end of file')
+
+    return line.rstrip('\r\n')
+
+
+def version(header):
+    """Get format version from the first line of a RINEX header.
+
+    Example:
+
+    >>> version(['     3.03           OBSERVATION DATA    M'])
+    3.03
+    """
+    return float(header[0][0:9])
+
+
+def obs_types(header):
+    """Get observation types from header of RINEX 2.11 file.
+
+    Example:
+
+    >>> header = ['     7    C1    P1    L1    P2    L2    S1    S2'
+    ...           '            # / TYPES OF OBSERV']
+    >>> obs_types(header)
+    ['C1', 'P1', 'L1', 'P2', 'L2', 'S1', 'S2']
+    """
+    types = []
+    for line in header:
+        if label(line) == '# / TYPES OF OBSERV':
+            pieces = (line[start:start+6] for start in range(6, 60, 6))
+            types.extend(piece.strip() for piece in pieces if piece.strip())
+
+    return types
+
+
+def sys_obs_types(header):
+    """Get observation types of every satellite system from header of
+    RINEX 3 file, return a dict.
+
+    Example:
+
+    >>> header = ['G    4 C1C L1C D1C S1C'.ljust(60) + 'SYS / # / OBS TYPES',
+    ...           'R    2 C1C L1C'.ljust(60) + 'SYS / # / OBS TYPES']
+    >>> sys_obs_types(header)
+    {'G': ['C1C', 'L1C', 'D1C', 'S1C'], 'R': ['C1C', 'L1C']}
+    """
+    types, system = {}, None
+    for line in header:
+        if label(line) == 'SYS / # / OBS TYPES':
+            # continuation lines have a blank satellite system
+            system = line[0] if line[0] != ' ' else system
+            pieces = (line[start:start+4] for start in range(6, 58, 4))
+            types.setdefault(system, []).extend(
+                piece.strip() for piece in pieces if piece.strip())
+
+    return types
+
+
+def obs_fields(record, ntypes):
+    """Split observation lines of a satellite into fields of observation
+    value, LLI and signal strength, blank fields are filled by spaces.
+
+    Example:
+
+    >>> obs_fields(['  21527025.445 7          .031  '], 3)
+    ['  21527025.445 7', '          .031  ', '                ']
+    """
+    text = ''.join(line.ljust(80) for line in record[:-1]) + record[-1]
+    width = OBS_WIDTH
+
+    return [text[idx:idx+width].ljust(width)
+            for idx in range(0, ntypes * width, width)]
+
+
+def edit_header(header, items):
+    """Edit header records using items, the key of items is in
+    HEADER_ITEMS. If a record not found, add it before END OF HEADER.
+
+    Example:
+
+    >>> header = ['TRIMBLE NETR9'.rjust(40).ljust(60) + 'REC # / TYPE / VERS',
+    ...           ' ' * 60 + 'END OF HEADER']
+    >>> items = {'receiver': 'TRIMBLE NETR8', 'delta': '0.0465 0 0'}
+    >>> for line in edit_header(header, items):
+    ...     print('{} | {}'.format(line[0:42].strip(), label(line)))
+    TRIMBLE NETR8 | REC # / TYPE / VERS
+    0.0465        0.0000        0.0000 | ANTENNA: DELTA H/E/N
+     | END OF HEADER
+    """
+    header = list(header)
+    for key, value in items.items():
+        flag, pos, style = HEADER_ITEMS[key]
+        if '{:14.4f}' in style:
+            value = style.format(*(float(num) for num in value.split()))
+        else:
+            value = style.format(str(value))
+        idx = next((idx for idx, line in enumerate(header)
+                    if label(line) == flag), None)
+        if idx is None:
+            idx = len(header) - 1
+            header.insert(idx, ' ' * 60 + flag)
+        line = header[idx].ljust(60)
+        header[idx] = line[:pos.start] + value + line[pos.stop:]
+
+    return header
+
+
+def types_header(types):
+    """Make header lines of # / TYPES OF OBSERV, 9 types per line.
+
+    Example:
+
+    >>> [line[0:36] for line in types_header(['C1', 'P1', 'L1', 'P2', 'L2'])]
+    ['     5    C1    P1    L1    P2    L2']
+    """
+    lines = []
+    for idx in range(0, max(len(types), 1), 9):
+        count = '{:6d}'.format(len(types)) if idx == 0 else ' ' * 6
+        pieces = ''.join('{:>6s}'.format(obs) for obs in types[idx:idx+9])
+        lines.append((count + pieces).ljust(60) + '# / TYPES OF OBSERV')
+
+    return lines
+
+
+def epoch_time(head):
+    """Convert the time of an epoch line into a datetime object.
+
+    Example:
+
+    >>> epoch_time(' 17  8 10  0  0 30.0000000  0 24')
+    datetime.datetime(2017, 8, 10, 0, 0, 30)
+    """
+    year, month, day, hour, minute = (int(num) for num in head[0:15].split())
+    year += 2000 if year < 80 else 1900
+    start = datetime.datetime(year, month, day, hour, minute)
+
+    return start + datetime.timedelta(seconds=float(head[15:26]))
+
+
+def iter_epochs(reader, ntypes):
+    """Iterate epochs in the body of a RINEX 2.11 observation file, the
+    header of reader must have been read. Yield Epoch records:
+
+    1. head is the first 32 columns of epoch line, flag is epoch flag;
+    2. for observation epochs, sats is satellite list, clock is receiver
+       clock offset text, records is a list of observation lines of
+       every satellite;
+    3. for event epochs (flag 2-5), sats is empty and records is a list
+       of special records.
+    """
+    nlines = (ntypes + OBS_PER_LINE - 1) // OBS_PER_LINE
+    for line in reader:
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        flag = int(line[28:29].strip() or 0)
+        count = int(line[29:32].strip() or 0)
+        if 2 <= flag <= 5:
+            records = [next_line(reader) for _ in range(count)]
+            yield Epoch(line[0:32], flag, [], '', records)
+            # observation types may be changed by header records
+            ntypes = len(obs_types(records)) or ntypes
+            nlines = (ntypes + OBS_PER_LINE - 1) // OBS_PER_LINE
+            continue
+        # satellite list may continue in the following lines
+        sats, clock = [line[32:68].ljust(36)], line[68:80]
+        for _ in range((count - 1) // 12):
+            sats.append(next_line(reader)[32:68].ljust(36))
+        sats = ''.join(sats)
+        sats = [sats[idx:idx+3] for idx in range(0, count * 3, 3)]
+        records = [[next_line(reader) for _ in range(nlines)] for _ in sats]
+        yield Epoch(line[0:32], flag, sats, clock, records)
+
+
+def epoch_lines(head, sats, clock=''):
+    """Make epoch lines of RINEX 2.11, 12 satellites per line and the
+    receiver clock offset at the end of the first line, trailing spaces
+    are removed.
+
+    Example:
+
+    >>> epoch_lines(' 17  8 10  0  0  0.0000000  0  2', ['G01', 'G02'])
+    [' 17  8 10  0  0  0.0000000  0  2G01G02']
+    """
+    lines = []
+    for idx in range(0, max(len(sats), 1), 12):
+        line = (head if idx == 0 else ' ' * 32) + ''.join(sats[idx:idx+12])
+        if idx == 0 and clock.strip():
+            line = line.ljust(68) + clock
+        lines.append(line.rstrip())
+
+    return lines
+
+
+def obs_lines(fields):
+    """Join observation fields of a satellite into RINEX 2.11 lines, 5
+    fields per line, trailing spaces are removed.
+    """
+    return [''.join(fields[idx:idx+OBS_PER_LINE]).rstrip()
+            for idx in range(0, len(fields), OBS_PER_LINE)]
+
+
+def on_grid(head, interval):
+    """Check if time of an epoch is on the grid of interval in seconds.
+
+    Example:
+
+    >>> on_grid(' 17  8 10  0  1  0.0000000', 30)
+    True
+    >>> on_grid(' 17  8 10  0  1 15.0000000', 30)
+    False
+    """
+    time = epoch_time(head)
+    seconds = (time.hour * 3600 + time.minute * 60 + time.second
+               + time.microsecond / 1e6)
+    remainder = seconds % interval
+
+    return min(remainder, interval - remainder) < 1e-3
+
+
+def filter_epochs(reader, interval=None, rm_sys=(), types=None):
+    """Filter RINEX 2.11 observation lines from reader, yield lines:
+
+    1. drop epochs not on the grid of interval, if interval is set;
+    2. remove satellites of systems in rm_sys, blank system means GPS;
+    3. project observations to types, if types is set, missing types
+       are left blank.
+
+    Header records of observation types and interval are fixed up, the
+    records of satellite numbers are removed because they are stale.
+    Only one epoch is hold in memory.
+    """
+    reader = iter(reader)
+    header = read_header(reader)
+    old_types = obs_types(header)
+    new_types = list(types) if types else old_types
+    index = [old_types.index(obs) if obs in old_types else -1
+             for obs in new_types]
+    project = index != list(range(len(old_types)))
+    removed = {sys.strip() or 'G' for sys in rm_sys}
+    # fix up header records
+    stale = ('PRN / # OF OBS', '# OF SATELLITES')
+    if interval:
+        stale += ('INTERVAL',)
+    new_header, types_done = [], False
+    for line in header:
+        name = label(line)
+        if name == 'END OF HEADER' and interval:
+            new_header.append('{:10.3f}'.format(interval).ljust(60)
+                              + 'INTERVAL')
+        if name == '# / TYPES OF OBSERV':
+            if not types_done:
+                new_header.extend(types_header(new_types))
+                types_done = True
+        elif name not in stale:
+            new_header.append(line)
+    yield from new_header
+
+    for epoch in iter_epochs(reader, len(old_types)):
+        if 2 <= epoch.flag <= 5:
+            yield epoch.head.rstrip()
+            yield from epoch.records
+            continue
+        if interval and not on_grid(epoch.head, interval):
+            continue
+        kept = [(sat, record)
+                for sat, record in zip(epoch.sats, epoch.records)
+                if (sat[0].strip() or 'G') not in removed]
+        if not kept:
+            continue
+        head = epoch.head[0:29] + '{:3d}'.format(len(kept))
+        yield from epoch_lines(head, [sat for sat, _ in kept], epoch.clock)
+        for _, record in kept:
+            if not project:
+                yield from record
+                continue
+            fields = obs_fields(record, len(old_types))
+            fields = [fields[idx] if idx >= 0 else ' ' * OBS_WIDTH
+                      for idx in index]
+            yield from obs_lines(fields)
+
+
+def iter_epochs3(reader):
+    """Iterate epochs in the body of a RINEX 3 observation file, like
+    iter_epochs. The head is the first 35 columns of epoch line, records
+    of a satellite is a list of one line without the satellite number.
+    """
+    for line in reader:
+        line = line.rstrip('\r\n')
+        if not line.startswith('>'):
+            continue
+        flag = int(line[31:32].strip() or 0)
+        count = int(line[32:35].strip() or 0)
+        records = [next_line(reader) for _ in range(count)]
+        if 2 <= flag <= 5:
+            yield Epoch(line[0:35], flag, [], '', records)
+            continue
+        sats = [record[0:3] for record in records]
+        records = [[record[3:]] for record in records]
+        yield Epoch(line[0:35], flag, sats, line[41:56], records)
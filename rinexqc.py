@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Quality check RINEX 2.11 observation files natively.
+
+Compute the primary marks which TEQC `+qc` reports: time window, data
+completeness, mean S1 & S2, moving average MP12 & MP21 and cycle slip
+ratio, without any external software.
+
+The marks are computed from GPS observations. Without a navigation
+file, completeness is the percentage of epochs found in the time window.
+Compact RINEX is decompressed line by line into the check, so it is read
+in a single pass without a temporary file.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+import math
+
+import numpy as np
+
+import compressed
+import hatanaka
+import rinex
+
+F1, F2 = 1575.42e6, 1227.60e6
+LIGHT_SPEED = 299792458.0
+ALPHA = (F1 / F2) ** 2
+WAVE_L1, WAVE_L2 = LIGHT_SPEED / F1, LIGHT_SPEED / F2
+# settings like TEQC: ionospheric slip rate in m/min, multipath slip in
+# m, data gap in seconds and points of multipath moving average window
+ION_SLIP, MP_SLIP, ARC_GAP, MP_WINDOW = 4.0, 5.0, 600.0, 50
+# multipath of arc which has too little points will be omitted
+MIN_ARC = 10
+
+
+def obs_index(types):
+    """Return indexes of L1, L2, P1, P2, S1 and S2 in observation types,
+    C1 and C2 are used when P1 and P2 not exist, -1 means not found.
+
+    Example:
+
+    >>> obs_index(['C1', 'L1', 'L2', 'P2', 'S1', 'S2'])
+    (1, 2, 0, 3, 4, 5)
+    >>> obs_index(['C1', 'L1'])
+    (1, -1, 0, -1, -1, -1)
+    """
+    def find(*names):
+        return next((types.index(n) for n in names if n in types), -1)
+
+    return (find('L1'), find('L2'), find('P1', 'C1'), find('P2', 'C2'),
+            find('S1'), find('S2'))
+
+
+def read_value(record, index):
+    """Read value and LLI of index-th observation in observation lines of
+    a satellite, return (None, 0) if observation is blank.
+
+    Example:
+
+    >>> record = ['  21527025.445 7  21527024.887   113127356.81117']
+    >>> read_value(record, 0), read_value(record, 2)
+    ((21527025.445, 0), (113127356.811, 1))
+    >>> read_value(record, 4)
+    (None, 0)
+    """
+    line = record[index // rinex.OBS_PER_LINE]
+    start = index % rinex.OBS_PER_LINE * rinex.OBS_WIDTH
+    text = line[start:start+14].strip()
+    if not text:
+        return None, 0
+    lli = line[start+14:start+15].strip()
+
+    return float(text), int(lli) if lli else 0
+
+
+def multipath(times, series):
+    """Compute the residuals of multipath series relative to the moving
+    average, for every arc which is split at data gaps and cycle slips.
+    Return residuals of MP1, residuals of MP2 and count of slips.
+    """
+    l1, l2, p1, p2, lli = (np.array(item, dtype=float) for item in series)
+    l1, l2 = l1 * WAVE_L1, l2 * WAVE_L2
+    coef1, coef2 = 2 / (ALPHA - 1), 2 * ALPHA / (ALPHA - 1)
+    mp1 = p1 - (1 + coef1) * l1 + coef1 * l2
+    mp2 = p2 - coef2 * l1 + (coef2 - 1) * l2
+    ion = (l1 - l2) / (ALPHA - 1)
+    # find data gaps and cycle slips between adjacent epochs
+    times = np.array(times)
+    dt = np.diff(times)
+    gaps = dt > ARC_GAP
+    minutes = np.maximum(dt, 1e-3) / 60
+    slips = ((np.abs(np.diff(ion)) / minutes > ION_SLIP)
+             | (np.abs(np.diff(mp1)) > MP_SLIP)
+             | (np.abs(np.diff(mp2)) > MP_SLIP)
+             | (lli[1:] > 0)) & ~gaps
+    breaks = np.flatnonzero(gaps | slips) + 1
+    # remove moving average in every arc
+    res1, res2 = [np.empty(0)], [np.empty(0)]
+    for arc in np.split(np.arange(len(times)), breaks):
+        if len(arc) < MIN_ARC:
+            continue
+        window = np.ones(min(MP_WINDOW, len(arc)))
+        counts = np.convolve(np.ones(len(arc)), window, 'same')
+        for values, residuals in ((mp1[arc], res1), (mp2[arc], res2)):
+            mean = np.convolve(values, window, 'same') / counts
+            residuals.append(values - mean)
+
+    return (np.concatenate(res1), np.concatenate(res2),
+            int(np.count_nonzero(slips)))
+
+
+def check_lines(reader):
+    """Quality check RINEX 2.11 observation lines from reader.
+
+    Return a tuple: (date, start, end, length, percentage, SN1, SN2, MP1,
+    MP2, CSR), the same as what `qualitycheck.parse_report` returns.
+    """
+    reader = iter(reader)
+    header = rinex.read_header(reader)
+    types = rinex.obs_types(header)
+    idx_l1, idx_l2, idx_p1, idx_p2, idx_s1, idx_s2 = obs_index(types)
+    interval = next((float(line[0:10]) for line in header
+                     if rinex.label(line) == 'INTERVAL'), 0)
+    snr = {idx_s1: [0.0, 0], idx_s2: [0.0, 0]}
+    arcs, slips, nobs = {}, 0, 0
+    first = last = None
+    epochs, min_step = 0, float('inf')
+    for epoch in rinex.iter_epochs(reader, len(types)):
+        if not epoch.sats:
+            continue
+        now = rinex.epoch_time(epoch.head)
+        if first is None:
+            first = now
+        else:
+            min_step = min(min_step, (now - last).total_seconds() or min_step)
+        last, epochs = now, epochs + 1
+        seconds = (now - first).total_seconds()
+        for sat, record in zip(epoch.sats, epoch.records):
+            for idx in (idx_s1, idx_s2):
+                value = read_value(record, idx)[0] if idx >= 0 else None
+                if value:
+                    snr[idx][0] += value
+                    snr[idx][1] += 1
+            # only GPS satellites are used for multipath and slips
+            if sat[0] not in ' G' or min(idx_l1, idx_l2, idx_p1, idx_p2) < 0:
+                continue
+            (l1, lli1), (l2, lli2) = (read_value(record, idx_l1),
+                                      read_value(record, idx_l2))
+            p1, p2 = (read_value(record, idx_p1)[0],
+                      read_value(record, idx_p2)[0])
+            if l1:
+                nobs += 1
+            if not (l1 and l2 and p1 and p2):
+                continue
+            times, series = arcs.setdefault(sat, ([], ([], [], [], [], [])))
+            times.append(seconds)
+            slip = (lli1 | lli2) & 1
+            for values, value in zip(series, (l1, l2, p1, p2, slip)):
+                values.append(value)
+
+    if first is None:
+        raise ValueError('no observation found')
+    res1, res2 = [np.empty(0)], [np.empty(0)]
+    for times, series in arcs.values():
+        mp1, mp2, count = multipath(times, series)
+        res1.append(mp1)
+        res2.append(mp2)
+        slips += count
+    mp1, mp2 = (_rms(np.concatenate(res)) for res in (res1, res2))
+
+    interval = interval or (min_step if epochs > 1 else 0)
+    window = (last - first).total_seconds()
+    expected = round(window / interval) + 1 if interval else epochs
+    percentage = 100 * epochs / expected
+    sn1, sn2 = (total / count if count else float('nan')
+                for total, count in (snr[idx_s1], snr[idx_s2]))
+    csr = 1000 * slips / nobs if nobs else float('nan')
+
+    return (first.strftime('%Y-%m-%d'), _clock(first), _clock(last),
+            round(window / 3600, 2), percentage, sn1, sn2, mp1, mp2, csr)
+
+
+def _rms(residuals):
+    """Root mean square of residuals, NaN for empty residuals."""
+    if not len(residuals):
+        return float('nan')
+    return math.sqrt(float(np.mean(residuals ** 2)))
+
+
+def _clock(time):
+    """Format time of day like TEQC: HH:MM:SS.sss."""
+    return time.strftime('%H:%M:%S.%f')[0:12]
+
+
+def quality_check(src_file, compact=False):
+    """Quality check a RINEX 2.11 observation file, or a Compact RINEX
+    file if compact is True, which may be compressed by compress, gzip,
+    bzip2 or xz.
+    """
+    with compressed.open_pipe(src_file, 'rt') as rnx_reader:
+        if compact:
+            return check_lines(hatanaka.decompress(rnx_reader))
+        return check_lines(rnx_reader)
@@ -4,7 +4,8 @@
 using concurent.futures.
 
 The convert function rely on RNXCMP software. Check if you have
-installed RNXCMP by typing `rnx2crx -h` in cmd.
+installed RNXCMP by typing `rnx2crx -h` in cmd. The native engine
+compresses files using all the CPU cores without RNXCMP.
 
 :author: Jon Jiang
 :email: jiangyingming@live.com
@@ -12,38 +13,78 @@ installed RNXCMP by typing `rnx2crx -h` in cmd.
 from concurrent import futures
 from textwrap import shorten
 import argparse
+import contextlib
 import glob
 import itertools
 import os
-import subprocess
 import sys
+import time
 
 import tqdm
 
-MAX_THREADING = min(4, os.cpu_count())
+import hatanaka
+import profiler
+import taskpool
+import telemetry
+import toolrun
 
+MAX_SUBPROCESS = min(4, os.cpu_count())
+MAX_PROCESS = os.cpu_count()
 
-def rnx2crx(src_file, out_dir, keep):
-    """Convert compact RINEX file to standard RINEX."""
+
+def dst_path(src_file, out_dir):
+    """Return destination path of compact RINEX for a standard RINEX
+    file, return None if source file is already compact RINEX.
+
+    Example:
+
+    >>> dst_path('aggo0420.17o', 'crinex').replace('\\\\', '/')
+    'crinex/aggo0420.17d'
+    >>> dst_path('WARN00DEU_R_20170420000_01D_30S_MO.rnx', '.')
+    ... # doctest: +ELLIPSIS
+    '...WARN00DEU_R_20170420000_01D_30S_MO.crx'
+    >>> dst_path('bjfs0420.17d', 'crinex') is None
+    True
+    """
     filename = os.path.basename(src_file)
     # check if source file is already compact rinex file
     if filename.lower().endswith('crx') or filename.lower().endswith('d'):
-        return
+        return None
     if filename.lower().endswith('rnx'):
-        dst_file = os.path.join(out_dir, filename[0:-3]+'crx')
-    else:
-        dst_file = os.path.join(out_dir, filename[0:-1]+'d')
+        return os.path.join(out_dir, filename[0:-3]+'crx')
+
+    return os.path.join(out_dir, filename[0:-1]+'d')
+
+
+@profiler.staged('execute')
+async def rnx2crx(src_file, out_dir, keep, timeout=toolrun.TIMEOUT):
+    """Convert standard RINEX file to compact RINEX, return filename with
+    exit status if failed.
+    """
+    filename = os.path.basename(src_file)
+    dst_file = dst_path(src_file, out_dir)
+    if dst_file is None:
+        return
     # run rnx2crx, redirect compact RINEX stdout into destination file
     # and ignore the stderr.
     args = 'rnx2crx', '-', src_file
-    with open(dst_file, 'w') as dst_writer:
-        status = subprocess.call(
-            args, stdout=dst_writer, stderr=subprocess.DEVNULL)
+    try:
+        dst_writer = open(dst_file, 'w')
+    except OSError as error:
+        return '{} ({})'.format(filename, error.strerror)
+    # the destination file is created, so remove it if failed
+    try:
+        with dst_writer:
+            result = await toolrun.run(args, stdout=dst_writer,
+                                       timeout=timeout)
+    except OSError as error:
+        os.remove(dst_file)
+        return '{} ({})'.format(filename, error.strerror)
     # check exit status of rnx2crx: {0: success, 1: error, 2: warning}
-    if status == 1:
+    if result.status not in (0, 2):
         # if run rnx2crx failed, remove dest file and return filename
         os.remove(dst_file)
-        return filename
+        return '{} ({})'.format(filename, toolrun.describe(result))
     # remove source file if keep is False when successful
     if not keep:
         os.remove(src_file)
@@ -51,19 +92,92 @@ def rnx2crx(src_file, out_dir, keep):
     return
 
 
-def parallel_run(function, argvs):
-    """Parallel run function using argvs, display a process bar."""
+def is_lossless(src_file, dst_file):
+    """Check if decompressed lines of dst_file are the same as lines of
+    src_file, trailing spaces are ignored.
+    """
+    with open(src_file) as src_reader, open(dst_file) as dst_reader:
+        src_lines = (line.rstrip() for line in src_reader)
+        dst_lines = hatanaka.decompress(dst_reader)
+        sentinel = object()
+        pairs = itertools.zip_longest(src_lines, dst_lines, fillvalue=sentinel)
+        return all(src == dst for src, dst in pairs)
+
+
+@profiler.staged('execute')
+def native_rnx2crx(src_file, out_dir, keep, verify=False):
+    """Convert standard RINEX file to compact RINEX using the native
+    Hatanaka compressor. Return filename if failed, else return a tuple
+    of filename, size of source file and seconds used.
+    """
+    filename = os.path.basename(src_file)
+    dst_file = dst_path(src_file, out_dir)
+    if dst_file is None:
+        return
+    start = time.perf_counter()
+    try:
+        hatanaka.compress_file(src_file, dst_file)
+        if verify and not is_lossless(src_file, dst_file):
+            raise ValueError('decompressed file is different')
+    except (OSError, ValueError, KeyError, IndexError):
+        # if compress failed, remove dest file and return filename
+        if os.path.exists(dst_file):
+            os.remove(dst_file)
+        return filename
+    seconds = time.perf_counter() - start
+    size = os.path.getsize(src_file)
+    # remove source file if keep is False when successful
+    if not keep:
+        os.remove(src_file)
+
+    return filename, size, seconds
+
+
+def written_size(argv, res):
+    """Return bytes of the destination file written by a task."""
+    return telemetry.file_size(dst_path(*argv[0:2]))
+
+
+def is_failed(res):
+    """Return True if result of task means failed, a failed task returns
+    filename and reason.
+    """
+    return isinstance(res, str)
+
+
+def parallel_run(function, argvs, executor=None,
+                 workers=MAX_SUBPROCESS, recorder=None):
+    """Parallel run function using argvs in executor, or run coroutine
+    function in an event loop if executor is None, display a process bar.
+    If the function returns a tuple of filename, size and seconds, print
+    the throughput of the file. Every file is measured if recorder of
+    telemetry is given.
+    """
     # check platform, use ASCII process bar in Windows
-    use_ascii = True if sys.getwindowsversion().major < 10 else False
-    with futures.ThreadPoolExecutor(max_workers=MAX_THREADING) as executor:
-        todo_list = [executor.submit(function, *argv) for argv in argvs]
-        task_iter = futures.as_completed(todo_list)
+    use_ascii = True if sys.platform == 'win32' else False
+    window = workers * taskpool.WINDOW_PER_WORKER
+    with contextlib.ExitStack() as stack:
+        progress = stack.enter_context(
+            tqdm.tqdm(total=0, ascii=use_ascii, unit='file'))
+        argvs = taskpool.counted(argvs, progress)
+        function, argvs = telemetry.measure(recorder, function, argvs,
+                                            written_size)
+        if executor is None:
+            task_iter = toolrun.imap_unordered(function, argvs, workers)
+        else:
+            executor = stack.enter_context(executor(max_workers=workers))
+            task_iter = taskpool.imap_unordered(executor, function, argvs,
+                                                window)
         failed_files = []
-        for future in tqdm.tqdm(
-                task_iter, total=len(todo_list), ascii=use_ascii, unit='file'):
-            # return None means task is success
-            res = future.result()
-            if res:
+        for _, res in telemetry.collect(recorder, task_iter):
+            progress.update()
+            # return None or a tuple means task is success
+            if isinstance(res, tuple):
+                filename, size, seconds = res
+                message = '{}: {:.2f} MB/s'
+                progress.write(message.format(
+                    filename, size / max(seconds, 1e-6) / 1e6))
+            elif res:
                 failed_files.append(res)
 
     return failed_files
@@ -77,13 +191,28 @@ def init_args():
     )
     # add arguments
     parser.add_argument('-v', '--version', action='version',
-                        version='%(prog)s 0.2.3')
+                        version='%(prog)s 0.5.0')
     parser.add_argument('-k', '--keep', action='store_true',
                         help='keep original file')
     parser.add_argument('-r', '--recursive', action='store_true',
                         help='search file recursively')
     parser.add_argument('-out', metavar='<directory>', default='crinex',
                         help='output directory [default: crinex in current]')
+    parser.add_argument('-engine', metavar='<engine>', default='native',
+                        choices=['native', 'rnxcmp'],
+                        help='convert engine, native or rnxcmp '
+                             '[default: native]')
+    parser.add_argument('-timeout', metavar='<seconds>', type=float,
+                        default=toolrun.TIMEOUT,
+                        help='kill rnxcmp if it runs longer '
+                             '[default: {}]'.format(toolrun.TIMEOUT))
+    parser.add_argument('-verify', action='store_true',
+                        help='verify native compression is lossless')
+    parser.add_argument('-telemetry', metavar='<file>',
+                        help='append telemetry of files into JSON lines')
+    parser.add_argument('-prom', metavar='<file>',
+                        help='write metrics for Prometheus textfile '
+                             'collector')
     parser.add_argument('files', metavar='<file>', nargs='+',
                         help='file will be processed')
 
@@ -100,12 +229,27 @@ def main():
     # collect input globstrs into a glob list
     globs = [glob.iglob(globstr, recursive=recursive) for globstr in globstrs]
     # make input args for rnx2crx function
-    conv_args = ((src, out_dir, keep_src) for src in itertools.chain(*globs))
+    srcs = itertools.chain(*globs)
     print('Start processing: {}'.format(shorten(', '.join(globstrs), 62)))
     if not keep_src:
         print('Delete source files when complete')
+    recorder = telemetry.open_recorder('rnx2crnx', args.telemetry,
+                                       args.prom, is_failed)
     # start parallel task, get a file name list of convert failed.
-    failed = parallel_run(rnx2crx, conv_args)
+    try:
+        if args.engine == 'native':
+            conv_args = ((src, out_dir, keep_src, args.verify)
+                         for src in srcs)
+            failed = parallel_run(native_rnx2crx, conv_args,
+                                  futures.ProcessPoolExecutor, MAX_PROCESS,
+                                  recorder)
+        else:
+            conv_args = ((src, out_dir, keep_src, args.timeout)
+                         for src in srcs)
+            failed = parallel_run(rnx2crx, conv_args, recorder=recorder)
+    finally:
+        if recorder is not None:
+            recorder.close()
     if failed:
         print('\nConvert failed filename: {}'.format(', '.join(failed)))
     else:
@@ -113,4 +257,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    profiler.run(main)
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Generate a synthetic corpus of RINEX files for benchmarks.
+
+Observation files of RINEX 2.11 and RINEX 3.03, navigation files and
+TEQC summary (.S) files are generated for many sites and days, with the
+sampling rate and constellations chosen. Observations follow a simple
+model of range, ionosphere, multipath, noise and cycle slips, so the
+quality check gives realistic marks. Files are laid out in a flat
+directory, the IGS tree of orderfile.py, or a deep archive tree of
+site/year/doy. A _sitesinfo.yml of the sites is written as well.
+
+The corpus is reproducible: the same seed gives the same files.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+from textwrap import shorten
+import argparse
+import datetime
+import math
+import os
+import random
+
+import rinex
+import rinexqc
+
+SYSTEMS = {'G': 'GPS', 'R': 'GLONASS', 'E': 'GALILEO', 'C': 'BEIDOU'}
+# satellites of every constellation, about 1/3 of them are visible
+SATELLITES = {'G': 32, 'R': 24, 'E': 30, 'C': 35}
+# observation types of RINEX 2.11, and of RINEX 3 for every system, in
+# the order of code, phase and SNR of two frequencies
+TYPES2 = 'C1', 'P1', 'L1', 'P2', 'L2', 'S1', 'S2'
+TYPES3 = {
+    'G': ('C1C', 'L1C', 'S1C', 'C2W', 'L2W', 'S2W'),
+    'R': ('C1C', 'L1C', 'S1C', 'C2P', 'L2P', 'S2P'),
+    'E': ('C1C', 'L1C', 'S1C', 'C5Q', 'L5Q', 'S5Q'),
+    'C': ('C2I', 'L2I', 'S2I', 'C7I', 'L7I', 'S7I')
+}
+FREQUENCIES = {
+    'G': (rinexqc.F1, rinexqc.F2), 'R': (1602.0e6, 1246.0e6),
+    'E': (rinexqc.F1, 1176.45e6), 'C': (1561.098e6, 1207.14e6)
+}
+RECEIVERS = 'TRIMBLE NETR9', 'LEICA GR50', 'SEPT POLARX5', 'JAVAD TRE_3'
+ANTENNAS = ('TRM59800.00     SCIS', 'LEIAR25.R4      LEIT',
+            'SEPCHOKE_B3E6   SPKE', 'JAVRINGANT_DM   NONE')
+TREES = 'flat', 'igs', 'deep'
+# hours of a pass of satellite, and hours of a whole orbit
+PASS_HOURS, ORBIT_HOURS = 4, 12
+# probability of cycle slip of a satellite in an epoch
+SLIP_RATE = 1e-4
+EARTH_RADIUS = 6371000.0
+
+
+def header_line(text, label):
+    """Make a header line with text in the first 60 columns.
+
+    Example:
+
+    >>> header_line('bjfs', 'MARKER NAME')[56:]
+    '    MARKER NAME'
+    """
+    return text.ljust(60)[0:60] + label
+
+
+def site_names(count, rng):
+    """Make count unique names of 4 lowercase letters, sorted.
+
+    Example:
+
+    >>> names = site_names(3, random.Random(1))
+    >>> len(names), all(len(name) == 4 for name in names)
+    (3, True)
+    """
+    letters = 'abcdefghijklmnopqrstuvwxyz0123456789'
+    names = set()
+    while len(names) < count:
+        names.add(rng.choice(letters[0:26]) + ''.join(
+            rng.choice(letters) for _ in range(3)))
+
+    return sorted(names)
+
+
+def site_info(site, seed):
+    """Make meta-infomation of a site: receiver, antenna, position and
+    delta, the same site always gets the same infomation.
+    """
+    rng = random.Random('{}-{}'.format(seed, site))
+    lat, lon = math.asin(rng.uniform(-1, 1)), rng.uniform(-math.pi, math.pi)
+    radius = EARTH_RADIUS + rng.uniform(0, 3000)
+    xyz = (radius * math.cos(lat) * math.cos(lon),
+           radius * math.cos(lat) * math.sin(lon), radius * math.sin(lat))
+
+    return {
+        'receiver': rng.choice(RECEIVERS),
+        'antenna': rng.choice(ANTENNAS),
+        'position': '{:.4f}  {:.4f}  {:.4f}'.format(*xyz),
+        'delta': '{:.4f}        0.0000        0.0000'.format(
+            rng.choice((0, 0.0465, 0.1))),
+    }
+
+
+def common_header(site, info, date, interval, obs_header):
+    """Make header lines shared by RINEX 2 and RINEX 3 observation files,
+    obs_header is the lines of observation types.
+    """
+    xyz = (float(num) for num in info['position'].split())
+    delta = (float(num) for num in info['delta'].split())
+    first = datetime.datetime.combine(date, datetime.time())
+
+    return [
+        header_line('{:<20s}{:<20s}{:<20s}'.format(
+            'rnxgen.py', 'pinot', first.strftime('%Y%m%d %H%M%S UTC')),
+            'PGM / RUN BY / DATE'),
+        header_line(site.upper(), 'MARKER NAME'),
+        header_line(site.upper(), 'MARKER NUMBER'),
+        header_line('{:<20s}{:<40s}'.format('pinot', 'pinot'),
+                    'OBSERVER / AGENCY'),
+        header_line('{:<20s}{:<20s}{:<20s}'.format(
+            '5000001', info['receiver'], '5.45'), 'REC # / TYPE / VERS'),
+        header_line('{:<20s}{:<20s}'.format('1234', info['antenna']),
+                    'ANT # / TYPE'),
+        header_line('{:14.4f}{:14.4f}{:14.4f}'.format(*xyz),
+                    'APPROX POSITION XYZ'),
+        header_line('{:14.4f}{:14.4f}{:14.4f}'.format(*delta),
+                    'ANTENNA: DELTA H/E/N'),
+        *obs_header,
+        header_line('{:10.3f}'.format(interval), 'INTERVAL'),
+        header_line(first.strftime('  %Y    %m    %d    %H    %M   ') +
+                    ' 0.0000000     GPS', 'TIME OF FIRST OBS'),
+        header_line('', 'END OF HEADER'),
+    ]
+
+
+def satellites(systems):
+    """Return all the satellites of systems, with the offset of passes
+    in hours of every satellite.
+
+    Example:
+
+    >>> sats = satellites('GE')
+    >>> len(sats), sats[0][0], sats[-1][0]
+    (62, 'G01', 'E30')
+    """
+    sats = []
+    for system in systems:
+        for prn in range(1, SATELLITES[system] + 1):
+            offset = (prn * 7.3 + 'GREC'.index(system) * 1.9) % ORBIT_HOURS
+            sats.append(('{}{:02d}'.format(system, prn), offset))
+
+    return sats
+
+
+def observe(sats, seconds, state, rng, multipath=0.4):
+    """Observe visible satellites at seconds of day, return a list of
+    satellite and observations: code, phase, LLI, SNR of two frequencies.
+    State keeps ambiguities of satellites between epochs, multipath is
+    the amplitude of multipath in meters.
+    """
+    hours = seconds / 3600
+    visible = []
+    for sat, offset in sats:
+        progress = ((hours + offset) % ORBIT_HOURS) / PASS_HOURS
+        if progress >= 1:
+            # a new pass starts with new ambiguities
+            state.pop(sat, None)
+            continue
+        elevation = math.sin(math.pi * progress)
+        if sat not in state:
+            state[sat] = [rng.randint(-10**6, 10**6) for _ in range(2)]
+        prn = int(sat[1:])
+        distance = 2.55e7 - 5.4e6 * elevation
+        iono = (3 + 2 * math.sin(seconds / 20000 + prn)) * (2 - elevation)
+        mpath = multipath * math.sin(seconds / 300 + prn) * (1.1 - elevation)
+        lli = 0
+        if rng.random() < SLIP_RATE:
+            state[sat][0] += rng.randint(1, 50)
+            lli = 1
+        values = []
+        f1 = FREQUENCIES[sat[0]][0]
+        for band, freq in enumerate(FREQUENCIES[sat[0]]):
+            wave, ratio = rinexqc.LIGHT_SPEED / freq, (f1 / freq) ** 2
+            code = (distance + iono * ratio + mpath * (1 - 0.2 * band)
+                    + rng.gauss(0, 0.3))
+            phase = ((distance - iono * ratio + rng.gauss(0, 0.002)) / wave
+                     + state[sat][band])
+            snr = 30 + 20 * elevation - 4 * band + rng.gauss(0, 1)
+            values.append((code, phase, lli if band == 0 else 0, snr))
+        visible.append((sat, values))
+
+    return visible
+
+
+def time_text(now, fmt):
+    """Format time like strftime, but pad numbers with spaces instead of
+    zeros, as RINEX 2 does.
+
+    Example:
+
+    >>> time_text(datetime.datetime(2017, 8, 10), ' %y %m %d %H %M')
+    ' 17  8 10  0  0'
+    """
+    return now.strftime(fmt).replace(' 0', '  ')
+
+
+def field(value, lli=0, ssi=0):
+    """Format an observation field: F14.3, LLI and signal strength."""
+    if value is None:
+        return ' ' * rinex.OBS_WIDTH
+
+    return '{:14.3f}{}{}'.format(value, lli or ' ', ssi or ' ')
+
+
+def signal_strength(snr):
+    """Convert SNR in dBHz into signal strength indicator 1-9."""
+    return max(1, min(9, int(snr / 6)))
+
+
+def obs_lines2(date, interval, hours, sats, rng, multipath):
+    """Yield body lines of RINEX 2.11 observation file."""
+    state = {}
+    for seconds in range(0, int(hours * 3600), interval):
+        visible = observe(sats, seconds, state, rng, multipath)
+        now = datetime.datetime.combine(date, datetime.time()) + \
+            datetime.timedelta(seconds=seconds)
+        head = time_text(now, ' %y %m %d %H %M') + \
+            ' {:10.7f}  0{:3d}'.format(now.second, len(visible))
+        yield from rinex.epoch_lines(head, [sat for sat, _ in visible])
+        for sat, values in visible:
+            (code1, phase1, lli, snr1), (code2, phase2, _, snr2) = values
+            ssi1, ssi2 = signal_strength(snr1), signal_strength(snr2)
+            fields = (field(code1), field(code1 + 0.1), field(phase1, lli,
+                      ssi1), field(code2), field(phase2, 0, ssi2),
+                      field(snr1), field(snr2))
+            yield from rinex.obs_lines(fields)
+
+
+def obs_lines3(date, interval, hours, sats, rng, multipath):
+    """Yield body lines of RINEX 3 observation file."""
+    state = {}
+    for seconds in range(0, int(hours * 3600), interval):
+        visible = observe(sats, seconds, state, rng, multipath)
+        now = datetime.datetime.combine(date, datetime.time()) + \
+            datetime.timedelta(seconds=seconds)
+        yield now.strftime('> %Y %m %d %H %M') + ' {:10.7f}  0{:3d}'.format(
+            now.second, len(visible))
+        for sat, values in visible:
+            fields = []
+            for code, phase, lli, snr in values:
+                ssi = signal_strength(snr)
+                fields.extend((field(code, 0, ssi), field(phase, lli, ssi),
+                               field(snr)))
+            yield (sat + ''.join(fields)).rstrip()
+
+
+def write_obs(obs_file, site, info, date, interval, hours, systems,
+              version, rng):
+    """Write an observation file of RINEX 2.11 or RINEX 3.03."""
+    sats = satellites(systems)
+    # the environment of sites differs
+    multipath = rng.uniform(0.2, 0.8)
+    mixed = 'M (MIXED)' if len(systems) > 1 else '{} ({})'.format(
+        systems, SYSTEMS[systems])
+    if version == 2:
+        title = '{:>9s}{:11s}{:<20s}{:<20s}'.format(
+            '2.11', '', 'OBSERVATION DATA', mixed)
+        obs_header = [header_line('     1     1', 'WAVELENGTH FACT L1/2'),
+                      *rinex.types_header(TYPES2)]
+        body = obs_lines2(date, interval, hours, sats, rng, multipath)
+    else:
+        title = '{:>9s}{:11s}{:<20s}{:<20s}'.format(
+            '3.03', '', 'OBSERVATION DATA', mixed)
+        obs_header = [header_line('{}  {:3d} {}'.format(
+            system, len(TYPES3[system]), ' '.join(TYPES3[system])),
+            'SYS / # / OBS TYPES') for system in systems]
+        body = obs_lines3(date, interval, hours, sats, rng, multipath)
+    header = [header_line(title, 'RINEX VERSION / TYPE'),
+              *common_header(site, info, date, interval, obs_header)]
+    with open(obs_file, 'w') as obs_writer:
+        obs_writer.writelines(line + '\n' for line in header)
+        obs_writer.writelines(line + '\n' for line in body)
+
+
+def nav_value(value):
+    """Format a value of navigation message in D19.12.
+
+    Example:
+
+    >>> nav_value(-1.5e-05)
+    '-0.150000000000D-04'
+    """
+    if value == 0:
+        return ' 0.000000000000D+00'
+    exponent = math.floor(math.log10(abs(value))) + 1
+    mantissa = value / 10 ** exponent
+    # rounding may carry the mantissa to 1
+    if round(abs(mantissa), 12) >= 1:
+        mantissa, exponent = mantissa / 10, exponent + 1
+    sign = '-' if mantissa < 0 else ' '
+
+    return '{}{:.12f}D{:+03d}'.format(sign, abs(mantissa), exponent)
+
+
+def write_nav(nav_file, date, systems, version, rng):
+    """Write a navigation file of GPS in RINEX 2.11, or of all systems in
+    RINEX 3.03, an ephemeris every 2 hours for every satellite.
+    """
+    if version == 2:
+        header = [header_line('{:>9s}{:11s}{:<20s}'.format(
+            '2.11', '', 'N: GPS NAV DATA'), 'RINEX VERSION / TYPE')]
+        systems = 'G'
+    else:
+        header = [header_line('{:>9s}{:11s}{:<20s}{:<20s}'.format(
+            '3.03', '', 'N: GNSS NAV DATA', 'M: MIXED'),
+            'RINEX VERSION / TYPE')]
+    header.append(header_line('', 'END OF HEADER'))
+    lines = []
+    for sat, _ in satellites(systems):
+        for hour in range(0, 24, 2):
+            now = datetime.datetime.combine(date, datetime.time(hour))
+            values = [rng.uniform(-1e-4, 1e-4), rng.uniform(-1e-11, 1e-11),
+                      0.0] + [rng.uniform(-1, 1) * 10 ** rng.randint(-9, 3)
+                              for _ in range(26)]
+            if version == 2:
+                epoch = '{:2d}{}  0.0'.format(
+                    int(sat[1:]), time_text(now, ' %y %m %d %H %M'))
+                indent = '   '
+            else:
+                epoch = sat + now.strftime(' %Y %m %d %H %M %S')
+                indent = '    '
+            lines.append(epoch + ''.join(nav_value(num)
+                                         for num in values[0:3]))
+            for idx in range(3, len(values), 4):
+                lines.append(indent + ''.join(nav_value(num)
+                                              for num in values[idx:idx+4]))
+    with open(nav_file, 'w') as nav_writer:
+        nav_writer.writelines(line + '\n' for line in header + lines)
+
+
+def summary_lines(date, hours, rng):
+    """Make lines of a TEQC summary (.S) with random quality marks.
+
+    Example:
+
+    >>> lines = summary_lines(datetime.date(2017, 8, 10), 24,
+    ...                       random.Random(1))
+    >>> lines[1]
+    'Time of start of window : 2017 Aug 10  00:00:00.000'
+    """
+    start = datetime.datetime.combine(date, datetime.time())
+    end = start + datetime.timedelta(hours=hours, seconds=-30)
+    expect = int(hours * 120)
+    have = int(expect * rng.uniform(0.9, 1))
+    mp1, mp2 = rng.uniform(0.2, 0.6), rng.uniform(0.2, 0.6)
+    slips = rng.randint(0, 20)
+
+    return [
+        'SUMMARY FROM TEQC QC OF RINEX',
+        'Time of start of window : ' + start.strftime('%Y %b %d  %H:%M:%S')
+        + '.000',
+        'Time of  end  of window : ' + end.strftime('%Y %b %d  %H:%M:%S')
+        + '.000',
+        'Time line window length : {:.2f} hour(s), ticked every 3.0 hour(s)'
+        .format(hours),
+        'Moving average MP12     : {:.6f} m'.format(mp1),
+        'Moving average MP21     : {:.6f} m'.format(mp2),
+        'Mean S1                 : {:.2f} (sd=5.80 n={})'.format(
+            rng.uniform(40, 48), have * 9),
+        'Mean S2                 : {:.2f} (sd=8.18 n={})'.format(
+            rng.uniform(35, 44), have * 9),
+        '      first epoch    last epoch    hrs   dt  #expt  #have   %'
+        '   mp1   mp2 o/slps',
+        'SUM {} {} {:5.2f}  30 {:6d} {:6d} {:3d}  {:5.2f} {:5.2f} {:6d}'
+        .format(time_text(start, '%y %m %d') + start.strftime(' %H:%M'),
+                time_text(end, '%y %m %d') + end.strftime(' %H:%M'), hours,
+                expect, have, round(have * 100 / expect), mp1, mp2,
+                have * 9 // (slips + 1)),
+    ]
+
+
+def layout(tree, site, date, kind):
+    """Return the directory of a file in the tree: flat, igs (year/doy/
+    yyk, like orderfile.py) or deep (site/year/doy/yyk).
+
+    Example:
+
+    >>> date = datetime.date(2017, 2, 11)
+    >>> layout('igs', 'bjfs', date, 'o').replace('\\\\', '/')
+    '2017/042/17o'
+    >>> layout('deep', 'bjfs', date, 'o').replace('\\\\', '/')
+    'bjfs/2017/042/17o'
+    """
+    if tree == 'flat':
+        return ''
+    kind_dir = '{:02d}{}'.format(date.year % 100, kind)
+    path = os.path.join(str(date.year), date.strftime('%j'), kind_dir)
+
+    return path if tree == 'igs' else os.path.join(site, path)
+
+
+def file_names(site, date, version, interval):
+    """Return names of observation, navigation and summary files, there
+    is no summary file for RINEX 3, which TEQC does not support.
+
+    Example:
+
+    >>> file_names('bjfs', datetime.date(2017, 2, 11), 2, 30)
+    ('bjfs0420.17o', 'bjfs0420.17n', 'bjfs0420.17S')
+    >>> file_names('bjfs', datetime.date(2017, 2, 11), 3, 30)
+    ... # doctest: +NORMALIZE_WHITESPACE
+    ('BJFS00CHN_R_20170420000_01D_30S_MO.rnx',
+     'BJFS00CHN_R_20170420000_01D_MN.rnx', None)
+    """
+    if version == 2:
+        prefix = '{}{}0.{:02d}'.format(site, date.strftime('%j'),
+                                       date.year % 100)
+        return prefix + 'o', prefix + 'n', prefix + 'S'
+    prefix = '{}00CHN_R_{}0000_01D'.format(site.upper(),
+                                           date.strftime('%Y%j'))
+    sampling = '{:02d}S'.format(interval) if interval < 100 else '{:02d}M'\
+        .format(interval // 60)
+
+    return prefix + '_{}_MO.rnx'.format(sampling), prefix + '_MN.rnx', None
+
+
+def make_corpus(out_dir, sites, start, days, interval=30, hours=24,
+                systems='G', versions=(2,), tree='flat', seed=0):
+    """Generate observation, navigation and summary files of sites for
+    days from start date into out_dir, return a list of generated files.
+    """
+    files = []
+    for day in range(days):
+        date = start + datetime.timedelta(days=day)
+        for site in sites:
+            info = site_info(site, seed)
+            rng = random.Random('{}-{}-{}'.format(seed, site, date))
+            for version in versions:
+                obs_name, nav_name, sum_name = file_names(site, date,
+                                                          version, interval)
+                dst_dirs = {kind: os.path.join(out_dir, layout(
+                    tree, site, date, kind)) for kind in 'onS'}
+                for dst_dir in dst_dirs.values():
+                    os.makedirs(dst_dir, exist_ok=True)
+                obs_file = os.path.join(dst_dirs['o'], obs_name)
+                nav_file = os.path.join(dst_dirs['n'], nav_name)
+                write_obs(obs_file, site, info, date, interval, hours,
+                          systems, version, rng)
+                write_nav(nav_file, date, systems, version, rng)
+                files.extend((obs_file, nav_file))
+                if sum_name is None:
+                    continue
+                sum_file = os.path.join(dst_dirs['S'], sum_name)
+                with open(sum_file, 'w') as sum_writer:
+                    sum_writer.writelines(
+                        line + '\n' for line in summary_lines(date, hours,
+                                                              rng))
+                files.append(sum_file)
+
+    return files
+
+
+def write_sitesinfo(cfg_file, sites, seed):
+    """Write meta-infomation of sites into a YAML configuration file."""
+    with open(cfg_file, 'w') as cfg_writer:
+        cfg_writer.write('# this is a configuration file for unificate.py\n')
+        cfg_writer.write('# made by rnxgen.py\n\n')
+        cfg_writer.write('all:\n    observer: pinot\n    agency: pinot\n'
+                         '    interval: 30\n')
+        for site in sites:
+            cfg_writer.write('\n{}:\n'.format(site))
+            for key, value in site_info(site, seed).items():
+                cfg_writer.write('    {}: "{}"\n'.format(key, value))
+
+
+def parse_date(text):
+    """Parse date in format of year-doy, like 2017-001."""
+    try:
+        return datetime.datetime.strptime(text, '%Y-%j').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid date: {}'.format(text))
+
+
+def init_args():
+    """Initilize function, parse user input"""
+    # initilize a argument parser
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic corpus of RINEX files.'
+    )
+    # add arguments
+    parser.add_argument('-v', '--version', action='version',
+                        version='%(prog)s 0.1.0')
+    parser.add_argument('-out', metavar='<directory>', default='corpus',
+                        help='output directory [default: corpus in current]')
+    parser.add_argument('-sites', metavar='<number>', default=10, type=int,
+                        help='count of sites [default: 10]')
+    parser.add_argument('-days', metavar='<number>', default=1, type=int,
+                        help='count of days [default: 1]')
+    parser.add_argument('-from', metavar='<yyyy-ddd>', dest='start',
+                        default='2017-222', type=parse_date,
+                        help='first day, like 2017-001 [default: 2017-222]')
+    parser.add_argument('-interval', metavar='<seconds>', default=30,
+                        type=int, help='sampling rate [default: 30]')
+    parser.add_argument('-hours', metavar='<hours>', default=24, type=float,
+                        help='hours observed every day [default: 24]')
+    parser.add_argument('-sys', metavar='<systems>', default='G',
+                        help='constellations of G, R, E and C [default: G]')
+    parser.add_argument('-ver', metavar='<version>', default='2',
+                        choices=['2', '3', 'both'],
+                        help='RINEX version, 2, 3 or both [default: 2]')
+    parser.add_argument('-tree', metavar='<tree>', default='flat',
+                        choices=TREES,
+                        help='layout, flat, igs or deep [default: flat]')
+    parser.add_argument('-seed', metavar='<number>', default=0, type=int,
+                        help='seed of random numbers [default: 0]')
+
+    return parser.parse_args()
+
+
+def main():
+    """Main function."""
+    args = init_args()
+    systems = ''.join(sorted(set(args.sys.upper()), key='GREC'.index))
+    if not systems or set(systems) - set(SYSTEMS):
+        print('Unknown systems: {}'.format(args.sys))
+        return 1
+    versions = (2, 3) if args.ver == 'both' else (int(args.ver),)
+    sites = site_names(args.sites, random.Random(args.seed))
+    print('Generate sites: {}'.format(shorten(', '.join(sites), 62)))
+    files = make_corpus(args.out, sites, args.start, args.days,
+                        args.interval, args.hours, systems, versions,
+                        args.tree, args.seed)
+    write_sitesinfo(os.path.join(args.out, '_sitesinfo.yml'), sites,
+                    args.seed)
+    size = sum(os.path.getsize(name) for name in files)
+    print('Generated {} files, {:.1f} MB: {}'.format(len(files), size / 2**20,
+                                                   args.out))
+
+    return 0
+
+
+if __name__ == '__main__':
+    main()
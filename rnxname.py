@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Parse names of RINEX files, both RINEX 2 short names and RINEX 3 long
+names, into records.
+
+Short name: ssssdddf.yyt[.Z], e.g. bjfs0420.17o, bjfs042a15.17d.Z;
+Long name: XXXXMRCCC_S_YYYYDDDHHMM_PPU_FFU_DT.FMT[.gz], e.g.
+WARN00DEU_R_20170420000_01D_30S_MO.crx.
+
+The patterns are compiled once, and the results are memoized, so names
+met repeatedly when scanning archives are parsed only once.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+from collections import namedtuple
+import functools
+import os
+import re
+
+# kind is the RINEX 2 file type: o, d(Compact RINEX), n, g, m, etc.
+RnxName = namedtuple('RnxName', ['site', 'monument', 'country', 'year', 'doy',
+                                 'session', 'kind', 'source', 'period',
+                                 'sampling', 'compression'])
+
+COMPRESSION = r'(?:\.(Z|gz|bz2|xz))?$'
+SHORT_NAME = re.compile(r'^([0-9a-z]{4})([0-9]{3})([0-9a-z]{1,3})\.'
+                        r'([0-9]{2})([a-z])' + COMPRESSION, re.IGNORECASE)
+LONG_NAME = re.compile(r'^([0-9a-z]{4})([0-9]{2})([a-z]{3})_([rsu])_'
+                       r'([0-9]{4})([0-9]{3})([0-9]{4})_([0-9]{2}[mhdyu])_'
+                       r'(?:([0-9]{2}[czsmhdu])_)?[a-z]([onm])\.(rnx|crx)'
+                       + COMPRESSION, re.IGNORECASE)
+# size of the memoized names
+CACHE_SIZE = 65536
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def parse(filename):
+    """Parse the name of a RINEX file, return a RnxName record, or None if
+    it is not a RINEX file name.
+
+    Example:
+
+    >>> parse('bjfs0420.17o')
+    ... # doctest: +NORMALIZE_WHITESPACE
+    RnxName(site='bjfs', monument='', country='', year=2017, doy=42,
+            session='0', kind='o', source='', period='', sampling='',
+            compression='')
+    >>> parse('WARN00DEU_R_20170420000_01D_30S_MO.crx.gz')
+    ... # doctest: +NORMALIZE_WHITESPACE
+    RnxName(site='warn', monument='00', country='DEU', year=2017, doy=42,
+            session='0000', kind='d', source='R', period='01D',
+            sampling='30S', compression='gz')
+    >>> parse('BRDC00IGS_R_20170420000_01D_MN.rnx').kind
+    'n'
+    >>> parse('ALGO.T02') is None
+    True
+    """
+    # the 10th char of a long name is a underline
+    if filename[9:10] == '_':
+        match = LONG_NAME.match(filename)
+        if not match:
+            return None
+        (site, monument, country, source, year, doy, session, period,
+         sampling, kind, fmt, compression) = match.groups()
+        kind = 'd' if fmt.lower() == 'crx' else kind.lower()
+        return RnxName(site.lower(), monument, country.upper(), int(year),
+                       int(doy), session, kind, source.upper(),
+                       period.upper(), (sampling or '').upper(),
+                       compression or '')
+    match = SHORT_NAME.match(filename)
+    if not match:
+        return None
+    site, doy, session, year, kind, compression = match.groups()
+    # two digits year, 80-99 means 1980-1999
+    year = int(year) + (1900 if int(year) >= 80 else 2000)
+
+    return RnxName(site.lower(), '', '', year, int(doy), session.lower(),
+                   kind.lower(), '', '', '', compression or '')
+
+
+def classify(filenames):
+    """Parse a batch of file names, e.g. a directory listing, return a
+    dict of name and record of the RINEX files.
+
+    Example:
+
+    >>> names = ['bjfs0420.17o', 'readme.txt', 'bjfs0420.17n']
+    >>> {name: rec.kind for name, rec in classify(names).items()}
+    {'bjfs0420.17o': 'o', 'bjfs0420.17n': 'n'}
+    """
+    records = {}
+    for filename in filenames:
+        record = parse(os.path.basename(filename))
+        if record is not None:
+            records[filename] = record
+
+    return records
+
+
+def site_of(filename):
+    """Return lowercase site name of a file, the first 4 chars are used if
+    it is not a RINEX file name.
+
+    Example:
+
+    >>> site_of('/data/WARN00DEU_R_20170420000_01D_30S_MO.crx')
+    'warn'
+    >>> site_of('ALGO0420.T02')
+    'algo'
+    """
+    filename = os.path.basename(filename)
+    record = parse(filename)
+
+    return record.site if record else filename[0:4].lower()
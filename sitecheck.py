@@ -3,17 +3,53 @@
 """Check if some RINEX observation files exist in source folder,
 the site list is input using a YAML configuration file.
 
+A range of days can be checked by walking the directories only once, the
+result is a site x day matrix, which can be exported as a CSV file. Files
+compressed by compress, gzip, bzip2 or xz are found by their names too.
+
 :author: Jon Jiang
 :email: jiangyingming@live.com
 """
 from textwrap import shorten
 import argparse
+import csv
+import datetime
 import os
-import re
 
+import numpy as np
 import yaml
 
+import profiler
+import rnxname
+
+# kinds of observation files: RINEX and Compact RINEX
+OBS_KINDS = 'o', 'd'
+
+
+@profiler.staged('parse')
+def obs_date(src_file):
+    """Parse the name of a RINEX observation file, return a tuple of site,
+    year and doy(day of year), or None if it is not an observation file.
+
+    Example:
+
+    >>> obs_date('aggo0420.17o')
+    ('aggo', 2017, 42)
+    >>> obs_date('WARN00DEU_R_20170420000_01D_30S_MO.crx')
+    ('warn', 2017, 42)
+    >>> obs_date('aggo0420.17d.xz'), obs_date('aggo0420.17o.bz2')
+    (('aggo', 2017, 42), ('aggo', 2017, 42))
+    >>> obs_date('bjfs0420.17n') is None
+    True
+    """
+    record = rnxname.parse(src_file)
+    if record is None or record.kind not in OBS_KINDS:
+        return None
+
+    return record.site, record.year, record.doy
+
 
+@profiler.staged('parse')
 def is_correct_rinex(src_file, year, doy):
     """Check if a source file is RINEX observation file observed at
     given year and doy(day of year), return True or False.
@@ -35,12 +71,9 @@ def is_correct_rinex(src_file, year, doy):
     >>> is_correct_rinex('DAVS00ATA_R_20170420000_01D_30S_MM.RNX', 2017, 42)
     False
     """
-    year, doy = str(year), '{:03d}'.format(doy)
-    rnxregs = ('^[0-9a-z]{4}' + doy + '[0-9a-z]{1,3}\\.' + year[2:] + '[do]$',
-               '^[0-9a-z]{4}[0-9]{2}[a-z]{3}_[rs]_' + year + doy + '[0-9]{4}'
-               '_[0-9]{2}[dhm]_[0-9]{2}[sz]_[mgcreij]o.(crx|rnx)$')
+    date = obs_date(src_file)
 
-    return any(re.match(reg, src_file, re.IGNORECASE) for reg in rnxregs)
+    return date is not None and date[1:] == (year, doy)
 
 
 def check_dir(src_dir, year, doy, missing, recursive):
@@ -48,20 +81,103 @@ def check_dir(src_dir, year, doy, missing, recursive):
     observed at given year and doy(day of year), if a site observation
     file exists, remove this site in missing set.
     """
+    # check files in source directory listing by listing
+    for files in walk_dir(src_dir, recursive):
+        for record in rnxname.classify(files).values():
+            if (record.kind in OBS_KINDS
+                    and (record.year, record.doy) == (year, doy)):
+                missing.discard(record.site)
+
+
+@profiler.staged('scan')
+def walk_dir(src_dir, recursive):
+    """Yield lists of file names in source directory."""
     if not os.path.isdir(src_dir):
         raise ValueError('{} is not a directory!'.format(src_dir))
-    # check files in source directory one by one
     for _, _, files in os.walk(src_dir):
-        for name in files:
-            correctobs = is_correct_rinex(name, year, doy)
-            if correctobs:
-                site = name[0:4].lower()
-                missing.discard(site)
+        yield files
         # if not recursive, only check the first level files
         if not recursive:
             break
 
 
+@profiler.staged('plan')
+def check_range(src_dirs, sites, start, end, recursive):
+    """Check RINEX observation files of sites observed from start date to
+    end date, directories are walked only once. Return a boolean matrix,
+    every row is a site and every column is a day.
+    """
+    rows = {site: row for row, site in enumerate(sites)}
+    matrix = np.zeros((len(sites), (end - start).days + 1), dtype=bool)
+    for src_dir in src_dirs:
+        for files in walk_dir(src_dir, recursive):
+            for record in rnxname.classify(files).values():
+                if record.kind not in OBS_KINDS or record.site not in rows:
+                    continue
+                day = ((datetime.date(record.year, 1, 1) - start).days
+                       + record.doy - 1)
+                if 0 <= day < matrix.shape[1]:
+                    matrix[rows[record.site], day] = True
+
+    return matrix
+
+
+def missing_runs(row, start):
+    """Find runs of missing days in a row of the matrix, return a list of
+    tuple of the first and the last date of every run.
+
+    Example:
+
+    >>> row = np.array([True, False, False, True, False])
+    >>> start = datetime.date(2017, 1, 1)
+    >>> [(fst.isoformat(), lst.isoformat())
+    ...  for fst, lst in missing_runs(row, start)]
+    [('2017-01-02', '2017-01-03'), ('2017-01-05', '2017-01-05')]
+    """
+    # edges of runs are where the difference of padded row is not zero
+    padded = np.concatenate(([0], ~row, [0])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    one_day = datetime.timedelta(days=1)
+
+    return [(start + int(fst) * one_day, start + (int(lst) - 1) * one_day)
+            for fst, lst in zip(edges[0::2], edges[1::2])]
+
+
+@profiler.staged('report')
+def show_matrix(sites, matrix, start):
+    """Print completeness percentage and missing days of every site."""
+    def doy(date):
+        return date.strftime('%Y-%j')
+
+    for site, row in zip(sites, matrix):
+        percentage = 100 * np.count_nonzero(row) / len(row)
+        runs = missing_runs(row, start)
+        days = ', '.join(doy(fst) if fst == lst else
+                         '{}~{}'.format(doy(fst), doy(lst))
+                         for fst, lst in runs)
+        print('{: <9s} {:7.2f}%  {}'.format(site, percentage, days))
+
+
+@profiler.staged('report')
+def export_matrix(out_file, sites, matrix, start):
+    """Export the matrix into a CSV file, 1 means file exists."""
+    dates = (start + datetime.timedelta(days=day)
+             for day in range(matrix.shape[1]))
+    with open(out_file, 'w', newline='') as csv_writer:
+        writer = csv.writer(csv_writer)
+        writer.writerow(['site'] + [date.strftime('%Y-%j') for date in dates])
+        for site, row in zip(sites, matrix):
+            writer.writerow([site] + row.astype(int).tolist())
+
+
+def parse_date(text):
+    """Parse date in format of year-doy, like 2017-001."""
+    try:
+        return datetime.datetime.strptime(text, '%Y-%j').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid date: {}'.format(text))
+
+
 def init_args():
     """Initilize function, parse user input"""
     # initilize a argument parser
@@ -70,22 +186,35 @@ def init_args():
     )
     # add arguments
     parser.add_argument('-v', '--version', action='version',
-                        version='%(prog)s 0.2.1')
+                        version='%(prog)s 0.3.0')
     parser.add_argument('-r', '--recursive', action='store_true',
                         help='search file recursively')
     parser.add_argument('-cfg', metavar='<config>', default='_sites.yml',
                         type=argparse.FileType('r'),
                         help='YAML site list file [default: _sites.yml]')
-    parser.add_argument('-yr', metavar='<year>', dest='year', required=True,
+    parser.add_argument('-yr', metavar='<year>', dest='year',
                         type=int, choices=range(1980, 2050),
-                        help='year for observation file [required]')
-    parser.add_argument('-doy', metavar='<doy>', dest='doy', required=True,
+                        help='year for observation file')
+    parser.add_argument('-doy', metavar='<doy>', dest='doy',
                         type=int, choices=range(1, 367),
-                        help='doy for observation file [required]')
+                        help='doy for observation file')
+    parser.add_argument('-from', metavar='<date>', dest='start',
+                        type=parse_date, help='first date, like 2017-001')
+    parser.add_argument('-to', metavar='<date>', dest='end',
+                        type=parse_date, help='last date, like 2017-365')
+    parser.add_argument('-csv', metavar='<file>', default='',
+                        help='export range check matrix to CSV file')
     parser.add_argument('dirs', metavar='<directory>', nargs='+',
                         help='directory will be searched')
+    args = parser.parse_args()
+    # either a day or a range of days is required
+    if args.start or args.end:
+        if not (args.start and args.end) or args.start > args.end:
+            parser.error('both -from and -to are required, from <= to')
+    elif args.year is None or args.doy is None:
+        parser.error('-yr and -doy, or -from and -to are required')
 
-    return parser.parse_args()
+    return args
 
 
 def main():
@@ -93,10 +222,17 @@ def main():
     args = init_args()
     dirs, year, doy = args.dirs, args.year, args.doy
     sites, recursive = yaml.load(args.cfg), args.recursive
-    # create a set of missing sites, initialize it using all sites
-    missing = set(sites)
     # start process
     print('Start processing: {}'.format(shorten(', '.join(dirs), 62)))
+    if args.start:
+        sites = sorted(set(sites))
+        matrix = check_range(dirs, sites, args.start, args.end, recursive)
+        show_matrix(sites, matrix, args.start)
+        if args.csv:
+            export_matrix(args.csv, sites, matrix, args.start)
+        return 0
+    # create a set of missing sites, initialize it using all sites
+    missing = set(sites)
     for directory in dirs:
         check_dir(directory, year, doy, missing, recursive)
     # if still some sites in missing, print them
@@ -109,4 +245,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    profiler.run(main)
@@ -3,21 +3,33 @@
 """Order RINEX observation files using a subnet configuration.
 
 This script will create directories using subnet name then copy or move
-RINEX observation files into the subnet folders.
+RINEX observation files into the subnet folders. The data of a file is
+written at most once, and can be linked into the other subnets which the
+site belongs to.
 
 :author: Jon Jiang
 :email: jiangyingming@live.com
 """
+from concurrent import futures
 from textwrap import shorten
 import argparse
 import glob
 import itertools
 import os
-import shutil
 
 import yaml
 
+import fastcopy
+import profiler
+import rnxname
+import taskpool
+import telemetry
 
+# placing files is bound by I/O, so use more threads than CPUs
+MAX_THREADING = max(6, os.cpu_count())
+
+
+@profiler.staged('plan')
 def which_nets(src_file, subnets):
     """Locate which nets a source file belong, return a list.
 
@@ -31,22 +43,94 @@ def which_nets(src_file, subnets):
     >>> sorted(which_nets('algo0420.17o', nets))
     ['net1', 'net2']
     """
-    filename = os.path.basename(src_file)
-    site = filename[0:4].lower()
+    site = rnxname.site_of(src_file)
     return [net for net, sites in subnets.items() if site in sites]
 
 
-def order_file(src_file, dst_dirs, keep_src):
-    """Copy source file into destination directories:
-    If keep_src is False, remove source file when complete.
-    """
-    for dst_dir in dst_dirs:
-        print('{} => {}'.format(src_file, dst_dir))
-        shutil.copy2(src_file, dst_dir)
+@profiler.staged('execute')
+def order_file(src_file, dst_dirs, keep_src, mode='copy'):
+    """Place source file into destination directories: the data is written
+    into the first directory, and placed into the others by mode: copy,
+    hardlink, symlink or reflink. If keep_src is False, move source file.
+    Return a tuple of bytes placed and bytes not written compared with
+    copying into every directory.
 
+    Example:
+
+    >>> import shutil, tempfile
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> src_file = os.path.join(tmp_dir, 'bjfs0420.17o')
+    >>> with open(src_file, 'w') as src_writer:
+    ...     _ = src_writer.write('RINEX')
+    >>> dst_dirs = [os.path.join(tmp_dir, net) for net in ('net1', 'net2')]
+    >>> for dst_dir in dst_dirs:
+    ...     os.mkdir(dst_dir)
+    >>> order_file(src_file, dst_dirs, False, 'hardlink')
+    (10, 10)
+    >>> sorted(os.listdir(dst_dirs[1])), os.path.exists(src_file)
+    (['bjfs0420.17o'], False)
+
+    If the source file could not be moved, e.g. across file systems, and
+    it is removed, the first directory holds a copy, not a symlink:
+
+    >>> from unittest import mock
+    >>> with open(src_file, 'w') as src_writer:
+    ...     _ = src_writer.write('RINEX')
+    >>> with mock.patch('os.replace', side_effect=OSError):
+    ...     _ = order_file(src_file, dst_dirs, False, 'symlink')
+    >>> first_file = os.path.join(dst_dirs[0], 'bjfs0420.17o')
+    >>> os.path.islink(first_file), os.path.exists(src_file)
+    (False, False)
+    >>> [open(os.path.join(dst_dir, 'bjfs0420.17o')).read()
+    ...  for dst_dir in dst_dirs]
+    ['RINEX', 'RINEX']
+    >>> shutil.rmtree(tmp_dir)
+    """
+    size, filename = os.path.getsize(src_file), os.path.basename(src_file)
+    first_file = os.path.join(dst_dirs[0], filename)
+    moved = False
     if not keep_src:
+        # fast path: rename on the same file system
+        try:
+            os.replace(src_file, first_file)
+            moved = True
+        except OSError:
+            pass
+    saved = size if moved else 0
+    # never symlink to the source file which will be removed
+    first_mode = 'reflink' if not keep_src and mode == 'symlink' else mode
+    if not moved and fastcopy.link_file(src_file, first_file, first_mode):
+        saved += size
+    for dst_dir in dst_dirs[1:]:
+        dst_file = os.path.join(dst_dir, filename)
+        if fastcopy.link_file(first_file, dst_file, mode):
+            saved += size
+
+    if not keep_src and not moved:
         os.remove(src_file)
 
+    return size * len(dst_dirs), saved
+
+
+def written_size(argv, res):
+    """Return bytes written by a task, files linked are not written."""
+    return res[0] - res[1]
+
+
+def order_args(src_files, nets, net_dirs, missing, keep_src, mode):
+    """Yield arguments of order_file for source files, sites which are not
+    in any subnet are added into missing.
+    """
+    for src_file in src_files:
+        belong = which_nets(src_file, nets)
+        # if couldn't found a site in any subnets, log it
+        if not belong:
+            missing.add(rnxname.site_of(src_file))
+            continue
+        # get all destination directories and copy/move in
+        dst_dirs = [net_dirs[net] for net in belong]
+        yield src_file, dst_dirs, keep_src, mode
+
 
 def init_args():
     """Initilize function, parse user input"""
@@ -56,7 +140,7 @@ def init_args():
     )
     # add arguments
     parser.add_argument('-v', '--version', action='version',
-                        version='%(prog)s 0.4.1')
+                        version='%(prog)s 0.6.0')
     parser.add_argument('-r', '--recursive', action='store_true',
                         help='search file recursively')
     parser.add_argument('-k', '--keep', action='store_true',
@@ -66,6 +150,15 @@ def init_args():
                         help='configuration file [default: ./subnet.yml]')
     parser.add_argument('-out', metavar='<directory>', default='subnets',
                         help='output directory [default: subnets in current]')
+    parser.add_argument('-mode', metavar='<mode>', default='copy',
+                        choices=fastcopy.LINK_MODES,
+                        help='place files into subnets by {} [default: copy]'
+                        .format(', '.join(fastcopy.LINK_MODES)))
+    parser.add_argument('-telemetry', metavar='<file>',
+                        help='append telemetry of files into JSON lines')
+    parser.add_argument('-prom', metavar='<file>',
+                        help='write metrics for Prometheus textfile '
+                             'collector')
     parser.add_argument('files', metavar='<file>', nargs='+',
                         help='file will be processed')
 
@@ -89,17 +182,29 @@ def main():
     print('Start processing: {}'.format(shorten(', '.join(globstrs), 62)))
     if not keep_src:
         print('Delete source files when complete')
-    missing = set()
-    for src_file in itertools.chain(*globs):
-        belong = which_nets(src_file, nets)
-        # if couldn't found a site in any subnets, log it
-        if not belong:
-            missing.add(os.path.basename(src_file)[0:4].lower())
-            continue
-        # get all destination directories and copy/move in
-        dst_dirs = [net_dirs[net] for net in belong]
-        order_file(src_file, dst_dirs, keep_src)
-
+    missing, total, saved = set(), 0, 0
+    argvs = order_args(itertools.chain(*globs), nets, net_dirs, missing,
+                       keep_src, args.mode)
+    # errors of a task stop the script, so no task is failed
+    recorder = telemetry.open_recorder('subnet', args.telemetry, args.prom,
+                                       failed=lambda result: False)
+    function, argvs = telemetry.measure(recorder, order_file, argvs,
+                                        written_size)
+    window = MAX_THREADING * taskpool.WINDOW_PER_WORKER
+    with futures.ThreadPoolExecutor(max_workers=MAX_THREADING) as executor:
+        tasks = taskpool.imap_unordered(executor, function, argvs, window)
+        try:
+            for (src_file, dst_dirs, _, _), result in telemetry.collect(
+                    recorder, tasks):
+                for dst_dir in dst_dirs:
+                    print('{} => {}'.format(src_file, dst_dir))
+                total, saved = total + result[0], saved + result[1]
+        finally:
+            if recorder is not None:
+                recorder.close()
+
+    message = 'Placed {:.2f} MB by {}, {:.2f} MB not written'
+    print(message.format(total / 2**20, args.mode, saved / 2**20))
     if missing:
         message = 'Sites not belong to any networks: {}'
         print(message.format(', '.join(missing)))
@@ -108,4 +213,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    profiler.run(main)
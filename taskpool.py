@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Run tasks in a concurrent.futures executor with bounded submission.
+
+Arguments are pulled lazily from an iterable and at most a window of
+tasks are in flight, so memory stays flat no matter how many files are
+processed, and work starts before all the files are found.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+from concurrent import futures
+import itertools
+
+# tasks in flight for every worker
+WINDOW_PER_WORKER = 2
+
+
+def imap_unordered(executor, function, argvs, window):
+    """Run function with every argv of argvs in executor, keep at most
+    window tasks in flight, yield tuples of argv and result in the order
+    of completion.
+
+    Example:
+
+    >>> with futures.ThreadPoolExecutor(max_workers=2) as executor:
+    ...     argvs = ((num, 2) for num in range(5))
+    ...     results = imap_unordered(executor, pow, argvs, 2)
+    ...     sorted(result for _, result in results)
+    [0, 1, 4, 9, 16]
+    """
+    argvs = iter(argvs)
+    todo_map = {}
+    for argv in itertools.islice(argvs, window):
+        todo_map[executor.submit(function, *argv)] = argv
+    while todo_map:
+        done, _ = futures.wait(todo_map, return_when=futures.FIRST_COMPLETED)
+        for future in done:
+            argv = todo_map.pop(future)
+            # submit a new task for every finished one
+            for new_argv in itertools.islice(argvs, 1):
+                todo_map[executor.submit(function, *new_argv)] = new_argv
+            yield argv, future.result()
+
+
+def counted(argvs, progress):
+    """Yield argvs and increase the total of a tqdm progress bar, so the
+    total is updated lazily as the arguments are pulled.
+    """
+    for argv in argvs:
+        progress.total += 1
+        progress.refresh()
+        yield argv
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Record telemetry of the files processed by the batch scripts.
+
+A Recorder measures every task run in a pool: queue wait from submission
+to start, wall time, CPU time of the worker, bytes read and written,
+the status of the task, and exit status and attempts of the tools it
+runs. Records of files are appended into a JSON lines file, aggregates of
+the run are appended too, and written into a file for the textfile
+collector of Prometheus node exporter. The CPU time of tools can not be
+told per file, it is summed in the run as CPU time of children.
+
+If telemetry is disabled the recorder is None, then measure and collect
+return the function, arguments and results as they are, nothing is
+wrapped or timed.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+import asyncio
+import json
+import os
+import time
+
+import toolrun
+
+# quantiles of wall time exported as summary
+QUANTILES = 0.5, 0.9, 0.99
+
+
+def file_size(path):
+    """Return size of file, 0 if the file does not exist."""
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+
+def percentile(values, percent):
+    """Return percentile of sorted values by linear interpolation, 0 if
+    values is empty.
+
+    Example:
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2.5
+    >>> percentile([1, 2, 3, 4], 99)
+    3.97
+    """
+    if not values:
+        return 0
+    index = (len(values) - 1) * percent / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+
+def children_cpu():
+    """Return CPU seconds used by the waited child processes, the tools
+    and the workers of process pools.
+    """
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def make_record(submitted, start, wall, cpu, argv, res, read, written,
+                tools):
+    """Make a record of a finished task in worker."""
+    statuses = [result.status for result in tools]
+    return {
+        'file': str(argv[0]) if argv else '',
+        'queue': max(start - submitted, 0), 'wall': wall, 'cpu': cpu,
+        'read': read,
+        'written': written(argv, res) if written else 0,
+        'tool_status': statuses[-1] if statuses else None,
+        'attempts': sum(result.attempts for result in tools),
+        'timeouts': statuses.count(None),
+    }
+
+
+class Measured(object):
+    """Task function wrapper to measure a run in a thread or process, it
+    can be pickled if function and written can be.
+    """
+    def __init__(self, function, written=None):
+        self.function, self.written = function, written
+
+    def __call__(self, submitted, *argv):
+        # source file may be moved or removed by the task
+        read = file_size(argv[0]) if argv else 0
+        start, cpu_start = time.time(), time.thread_time()
+        tools = []
+        token = toolrun.RESULTS.set(tools)
+        try:
+            res = self.function(*argv)
+        finally:
+            toolrun.RESULTS.reset(token)
+        wall, cpu = time.time() - start, time.thread_time() - cpu_start
+
+        return res, make_record(submitted, start, wall, cpu, argv, res,
+                                read, self.written, tools)
+
+
+class MeasuredAsync(Measured):
+    """Coroutine function wrapper to measure a run in an event loop, the
+    CPU time is unknown because the tasks share the thread.
+    """
+    async def __call__(self, submitted, *argv):
+        read = file_size(argv[0]) if argv else 0
+        start, tools = time.time(), []
+        toolrun.RESULTS.set(tools)
+        res = await self.function(*argv)
+        wall = time.time() - start
+
+        return res, make_record(submitted, start, wall, None, argv, res,
+                                read, self.written, tools)
+
+
+class Recorder(object):
+    """Recorder of the telemetry of a run of script.
+
+    The failed is a function to tell a result of task is failed, every
+    script has its own convention.
+    """
+    def __init__(self, script, jsonl_file=None, prom_file=None,
+                 failed=bool):
+        self.script, self.prom_file, self.failed = script, prom_file, failed
+        self.writer = open(jsonl_file, 'a') if jsonl_file else None
+        self.start, self.children = time.time(), children_cpu()
+        self.walls, self.queues, self.cpus = [], [], []
+        self.counts = {'ok': 0, 'failed': 0}
+        self.totals = {'read': 0, 'written': 0, 'attempts': 0,
+                       'timeouts': 0}
+
+    def measure(self, function, argvs, written=None):
+        """Wrap function and argvs to measure every task, the written is
+        a function of argv and result returning bytes written.
+        """
+        if asyncio.iscoroutinefunction(function):
+            function = MeasuredAsync(function, written)
+        else:
+            function = Measured(function, written)
+        # time of submission is taken when the argv is pulled by the pool
+        argvs = ((time.time(), *argv) for argv in argvs)
+
+        return function, argvs
+
+    def collect(self, task_iter):
+        """Record results of task_iter, yield argv and result as the task
+        iterator without telemetry.
+        """
+        for (_, *argv), (res, record) in task_iter:
+            self.add(res, record)
+            yield tuple(argv), res
+
+    def add(self, res, record):
+        """Add a record of task with result."""
+        record['status'] = 'failed' if self.failed(res) else 'ok'
+        self.counts[record['status']] += 1
+        self.walls.append(record['wall'])
+        self.queues.append(record['queue'])
+        if record['cpu'] is not None:
+            self.cpus.append(record['cpu'])
+        for key in self.totals:
+            self.totals[key] += record[key]
+        if self.writer is not None:
+            record.update(type='file', script=self.script)
+            self.writer.write(json.dumps(record) + '\n')
+
+    def summary(self):
+        """Return a dict of aggregates of the run."""
+        walls = sorted(self.walls)
+        summary = {
+            'type': 'run', 'script': self.script, 'start': self.start,
+            'seconds': time.time() - self.start,
+            'files': sum(self.counts.values()), **self.counts,
+            'wall_sum': sum(walls),
+            'queue_sum': sum(self.queues), 'cpu_sum': sum(self.cpus),
+            'children_cpu': children_cpu() - self.children,
+            **self.totals,
+        }
+        for quantile in QUANTILES:
+            summary['wall_p{:g}'.format(quantile * 100)] = percentile(
+                walls, quantile * 100)
+
+        return summary
+
+    def close(self):
+        """Write aggregates of the run and close the files."""
+        summary = self.summary()
+        if self.writer is not None:
+            self.writer.write(json.dumps(summary) + '\n')
+            self.writer.close()
+        if self.prom_file:
+            # write then rename, the collector never reads a partial file
+            tmp_file = self.prom_file + '.tmp'
+            with open(tmp_file, 'w') as prom_writer:
+                prom_writer.writelines(line + '\n'
+                                       for line in prom_lines(summary))
+            os.replace(tmp_file, self.prom_file)
+
+        return summary
+
+
+def prom_lines(summary):
+    """Make lines of Prometheus text format from summary of a run.
+
+    Example:
+
+    >>> summary = {'script': 'orderfile', 'start': 1500000000, 'seconds': 2,
+    ...            'files': 3, 'ok': 2, 'failed': 1, 'wall_sum': 1.5,
+    ...            'queue_sum': 0.5, 'cpu_sum': 0.25, 'children_cpu': 0,
+    ...            'read': 300, 'written': 200, 'attempts': 0,
+    ...            'timeouts': 0, 'wall_p50': 0.5, 'wall_p90': 0.5,
+    ...            'wall_p99': 0.5}
+    >>> lines = prom_lines(summary)
+    >>> lines[2]
+    'pinot_files_total{script="orderfile",status="ok"} 2'
+    >>> lines[6]
+    'pinot_file_seconds{script="orderfile",quantile="0.5"} 0.5'
+    """
+    label = 'script="{}"'.format(summary['script'])
+    metrics = [
+        ('files_total', 'counter', 'Files processed by status.',
+         [('status="ok"', summary['ok']),
+          ('status="failed"', summary['failed'])]),
+        ('file_seconds', 'summary', 'Wall time of processing a file.',
+         [('quantile="{:g}"'.format(quantile),
+           summary['wall_p{:g}'.format(quantile * 100)])
+          for quantile in QUANTILES]),
+        ('queue_seconds_total', 'counter', 'Time files waited in queue.',
+         [(None, summary['queue_sum'])]),
+        ('cpu_seconds_total', 'counter', 'CPU time of tasks and children.',
+         [('side="tasks"', summary['cpu_sum']),
+          ('side="children"', summary['children_cpu'])]),
+        ('read_bytes_total', 'counter', 'Bytes of files read.',
+         [(None, summary['read'])]),
+        ('written_bytes_total', 'counter', 'Bytes of files written.',
+         [(None, summary['written'])]),
+        ('tool_attempts_total', 'counter', 'Runs of external tools.',
+         [(None, summary['attempts'])]),
+        ('tool_timeouts_total', 'counter', 'Runs of tools timed out.',
+         [(None, summary['timeouts'])]),
+        ('run_seconds', 'gauge', 'Wall time of the last run.',
+         [(None, summary['seconds'])]),
+        ('last_run_timestamp_seconds', 'gauge', 'Start time of the last run.',
+         [(None, summary['start'])]),
+    ]
+    lines = []
+    for name, kind, doc, samples in metrics:
+        name = 'pinot_' + name
+        lines.append('# HELP {} {}'.format(name, doc))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for extra, value in samples:
+            labels = label + ',' + extra if extra else label
+            lines.append('{}{{{}}} {}'.format(name, labels,
+                                              round(value, 6)))
+        if kind == 'summary':
+            lines.append('{}_sum{{{}}} {}'.format(
+                name, label, round(summary['wall_sum'], 6)))
+            lines.append('{}_count{{{}}} {}'.format(name, label,
+                                                    summary['files']))
+
+    return lines
+
+
+def open_recorder(script, jsonl_file=None, prom_file=None, failed=bool):
+    """Return a Recorder of script, None if both output files are not
+    given, that means telemetry is disabled.
+    """
+    if not jsonl_file and not prom_file:
+        return None
+
+    return Recorder(script, jsonl_file, prom_file, failed)
+
+
+def measure(recorder, function, argvs, written=None):
+    """Wrap function and argvs to measure tasks by recorder, return them
+    unchanged if recorder is None.
+    """
+    if recorder is None:
+        return function, argvs
+
+    return recorder.measure(function, argvs, written)
+
+
+def collect(recorder, task_iter):
+    """Record results of task_iter by recorder, return task_iter unchanged
+    if recorder is None.
+    """
+    if recorder is None:
+        return task_iter
+
+    return recorder.collect(task_iter)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Run external tools (TEQC, RNXCMP, runpkr00) in an asyncio event loop.
+
+Tools are executed directly without a shell. Every run has a wall-clock
+timeout, a tool which runs out of time is killed with its whole process
+group, and is retried with backoff. The stdout of a tool is redirected
+into a file, or streamed line by line so only the needed lines are kept.
+The stdin of a tool may be opened for every attempt, like a pipe of a
+file being decompressed, or the stdout of another tool, so tools can be
+chained without intermediate files.
+
+:author: Jon Jiang
+:email: jiangyingming@live.com
+"""
+from collections import namedtuple
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import os
+import signal
+import subprocess
+import time
+
+# default timeout of a tool in seconds, retries after a timeout or a
+# kill by signal, and the first delay before a retry in seconds
+TIMEOUT, RETRIES, BACKOFF = 600, 1, 1.0
+# seconds to wait a piped tool after the next tool is finished
+PIPE_GRACE = 10
+# status is the exit code of tool, None means timed out
+Result = namedtuple('Result', 'status output seconds attempts')
+# results of the runs in a task are appended into the list if it is set,
+# so telemetry knows the exit status of tools
+RESULTS = contextvars.ContextVar('RESULTS', default=None)
+if os.name == 'posix':
+    # start tool as the leader of a new process group
+    SESSION = {'start_new_session': True}
+else:
+    SESSION = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+
+
+def _kill(process):
+    """Kill a tool process and its children."""
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def _attempt(args, stdin, stdout, select, timeout):
+    """Run tool once, return exit status (None if timed out) and lines
+    selected from stdout.
+    """
+    if stdout is None:
+        stdout = subprocess.PIPE if select else subprocess.DEVNULL
+    process = await asyncio.create_subprocess_exec(
+        *args, stdin=stdin, stdout=stdout,
+        stderr=subprocess.DEVNULL, **SESSION)
+    output = []
+
+    async def communicate():
+        if select is not None:
+            async for line in process.stdout:
+                line = line.decode('ascii', 'replace').rstrip('\r\n')
+                if select(line):
+                    output.append(line)
+        return await process.wait()
+
+    try:
+        status = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        _kill(process)
+        await process.wait()
+        status = None
+    except asyncio.CancelledError:
+        _kill(process)
+        raise
+
+    return status, output
+
+
+async def _open_stdin(stack, stdin):
+    """Open stdin of a tool by the function stdin in an exit stack, it
+    may return a context manager or an async one. Return DEVNULL if
+    stdin is None.
+    """
+    if stdin is None:
+        return subprocess.DEVNULL
+    context = stdin()
+    if hasattr(context, '__aenter__'):
+        return await stack.enter_async_context(context)
+
+    return stack.enter_context(context)
+
+
+async def run(args, stdout=None, select=None, timeout=TIMEOUT,
+              retries=RETRIES, backoff=BACKOFF, stdin=None):
+    """Run a tool with args, return a Result of exit status, selected
+    output lines, seconds used and count of attempts.
+
+    1. If stdout is a file, the stdout of tool is written into it;
+    2. If select is a function, lines of stdout are streamed and the lines
+       select returns True are kept in output;
+    3. If the tool runs out of timeout or is killed by a signal, it is run
+       again after backoff seconds, doubled every retry;
+    4. If stdin is a function, it is called for every attempt and returns
+       a context manager of the file to be read by the tool, or stdin of
+       the tool is empty.
+
+    Example:
+
+    >>> import sys
+    >>> args = sys.executable, '-c', 'print("a"); print("b")'
+    >>> result = asyncio.run(run(args, select=lambda line: line == 'b'))
+    >>> result.status, result.output, result.attempts
+    (0, ['b'], 1)
+    >>> args = sys.executable, '-c', 'import time; time.sleep(10)'
+    >>> result = asyncio.run(run(args, timeout=0.5, retries=1, backoff=0))
+    >>> result.status, result.attempts
+    (None, 2)
+    >>> args = sys.executable, '-c', 'import sys; print(sys.stdin.read())'
+    >>> stdin = lambda: open(__file__, 'rb')
+    >>> asyncio.run(run(args, select=bool, stdin=stdin)).output[0]
+    '#!/usr/bin/env python3'
+    """
+    start = time.perf_counter()
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(backoff * 2 ** (attempt - 1))
+        if stdout is not None and stdout.seekable():
+            # drop the output of the failed attempt
+            stdout.seek(0)
+            stdout.truncate()
+        try:
+            async with contextlib.AsyncExitStack() as stack:
+                stdin_reader = await _open_stdin(stack, stdin)
+                status, output = await _attempt(args, stdin_reader, stdout,
+                                                select, timeout)
+                if status is None:
+                    # kill the tools piped into the timed out one
+                    raise asyncio.TimeoutError
+        except asyncio.TimeoutError:
+            pass
+        if status is not None and status >= 0:
+            break
+
+    result = Result(status, output, time.perf_counter() - start, attempt + 1)
+    results = RESULTS.get()
+    if results is not None:
+        results.append(result)
+
+    return result
+
+
+@contextlib.asynccontextmanager
+async def piped(args, stdin=None, ok=(0,)):
+    """Start a tool whose stdout is the stdin of the next tool, yield
+    the read end of the pipe, stdin of the tool is opened as run does.
+    When the next tool is finished, the tool is waited in the event loop,
+    or killed if it does not finish in PIPE_GRACE seconds, it is killed
+    at once if the next tool is timed out or cancelled. Raise
+    ChildProcessError if its exit status is not in ok, so a truncated
+    stream is not taken as a whole one.
+
+    Example:
+
+    >>> import sys
+    >>> upstream = sys.executable, '-c', 'print("a"); print("b")'
+    >>> args = sys.executable, '-c', 'import sys; print(sys.stdin.read())'
+    >>> call(args, select=bool, stdin=lambda: piped(upstream)).output
+    ['a', 'b']
+    >>> upstream = sys.executable, '-c', 'import sys; sys.exit(1)'
+    >>> call(args, select=bool, stdin=lambda: piped(upstream))
+    ... # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ChildProcessError: python... failed: exit 1
+    >>> upstream = sys.executable, '-c', 'import time; time.sleep(60)'
+    >>> result = call(args, timeout=0.5, retries=0,
+    ...               stdin=lambda: piped(upstream))
+    >>> result.status, result.seconds < 5
+    (None, True)
+    """
+    async with contextlib.AsyncExitStack() as stack:
+        stdin_reader = await _open_stdin(stack, stdin)
+        read_fd, write_fd = os.pipe()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args, stdin=stdin_reader, stdout=write_fd,
+                stderr=subprocess.DEVNULL, **SESSION)
+        except OSError:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        try:
+            with open(read_fd, 'rb') as pipe_reader:
+                yield pipe_reader
+        except BaseException:
+            # the next tool is timed out, cancelled or failed to start
+            _kill(process)
+            await process.wait()
+            raise
+        try:
+            status = await asyncio.wait_for(process.wait(), PIPE_GRACE)
+        except asyncio.TimeoutError:
+            _kill(process)
+            status = await process.wait()
+    # killed by SIGPIPE means the next tool did not need the rest
+    if status not in ok and status != -getattr(signal, 'SIGPIPE', 0):
+        raise ChildProcessError('{} failed: exit {}'.format(
+            os.path.basename(args[0]), status))
+
+
+def call(args, stdout=None, select=None, timeout=TIMEOUT, retries=RETRIES,
+         stdin=None):
+    """Run a tool in a new event loop and wait it, return a Result."""
+    return asyncio.run(run(args, stdout, select, timeout, retries,
+                           stdin=stdin))
+
+
+def describe(result):
+    """Describe exit status and time of a Result.
+
+    Example:
+
+    >>> describe(Result(1, [], 2.345, 1))
+    'exit 1, 2.3 s'
+    >>> describe(Result(None, [], 1200, 2))
+    'timeout, 1200.0 s, 2 attempts'
+    """
+    status = 'timeout' if result.status is None else 'exit {}'.format(
+        result.status)
+    message = '{}, {:.1f} s'.format(status, result.seconds)
+    if result.attempts > 1:
+        message += ', {} attempts'.format(result.attempts)
+
+    return message
+
+
+def imap_unordered(function, argvs, workers):
+    """Run coroutine function with every argv of argvs in an event loop,
+    keep at most workers tasks in flight, yield tuples of argv and result
+    in the order of completion.
+
+    Example:
+
+    >>> async def square(num):
+    ...     await asyncio.sleep(0.01 * (3 - num))
+    ...     return num * num
+    >>> argvs = ((num,) for num in range(3))
+    >>> [res for _, res in imap_unordered(square, argvs, 3)]
+    [4, 1, 0]
+    """
+    loop = asyncio.new_event_loop()
+    argvs, todo_map = iter(argvs), {}
+    try:
+        for argv in itertools.islice(argvs, workers):
+            todo_map[loop.create_task(function(*argv))] = argv
+        while todo_map:
+            done, _ = loop.run_until_complete(asyncio.wait(
+                todo_map, return_when=asyncio.FIRST_COMPLETED))
+            for task in done:
+                argv = todo_map.pop(task)
+                # start a new task for every finished one
+                for new_argv in itertools.islice(argvs, 1):
+                    todo_map[loop.create_task(function(*new_argv))] = new_argv
+                yield argv, task.result()
+    finally:
+        # kill tools still running if the consumer stops early
+        for task in todo_map:
+            task.cancel()
+        if todo_map:
+            loop.run_until_complete(asyncio.wait(todo_map))
+        loop.close()
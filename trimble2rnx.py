@@ -3,13 +3,26 @@
 #creater: Zhou Maosheng
 #Python version: 3.4
 
-"""Convert trimble t00 file to RINEX"""
+"""Convert trimble t00 file to RINEX
 
+Files are grouped by site and doy in one pass, every group is converted
+by runpkr00 and teqc in a process pool, in its own scratch directory
+which is removed when the group is finished. Failed files are reported.
+"""
+
+from concurrent import futures
 import os
 import sys
 import glob
-import shutil
+import fnmatch
 import argparse
+import tempfile
+
+import profiler
+import taskpool
+import toolrun
+
+MAX_PROCESS = os.cpu_count()
 
 
 # dir_path: directory path
@@ -21,52 +34,81 @@ def createdir(dir_path):
         os.makedirs(dir_path)
 
 
-# src_dir: source directory, out_dir: output directory,
-# glob_str: glob string, year: year of data observation,
+# src_dirs: source directories, glob_str: glob string,
 # recursive: search file recursively
-def trimble2dat(src_dir, out_dir, year, glob_str, recursive):
-    """Convert trimble t00 file to dat"""
-
-    for file in glob.glob(os.path.join(src_dir, glob_str)):
-        # run runpkr00
-        print('translate file: %s' %file)
-        os.system('runpkr00 -d ' + file + ' '+ out_dir)
-
-    # process subfolders if --recursive is setted
-    if recursive:
-        for child in os.listdir(src_dir):
-            child_path = os.path.join(src_dir, child)
-            if os.path.isdir(child_path):
-                trimble2dat(child_path, out_dir, year, glob_str, recursive)
-
-
-# src_dir: source directory, outputdir: output directory,
-# year: year of dara observation
-def dat2rnx(src_dir, out_dir, year):
-    """Convert trimble dat file to RINEX"""
-
-    file_list = []
-    for file in os.listdir(src_dir):
-        # get site and doy in filename
-        filename = os.path.basename(file)[0:7]
-        datfile = os.path.join(src_dir, filename + '??.' +  'DAT')
-        if datfile not in file_list:
-            file_list.append(datfile)
-
-    for datfile in file_list:
-        # name of output file
-        rinexfile = os.path.basename(datfile)[0:7] + '0.' + year + 'o'
-        gfile = os.path.basename(datfile)[0:7] + '0.' + year + 'g'
-        nfile = os.path.basename(datfile)[0:7] + '0.' + year + 'n'
-        # path of output file
-        rnxfilepath = os.path.join(out_dir, rinexfile.lower())
-        gfilepath = os.path.join(out_dir, gfile.lower())
-        nfilepath = os.path.join(out_dir, nfile.lower())
+@profiler.staged('scan')
+def group_files(src_dirs, glob_str, recursive):
+    """Find trimble files in one pass, group them by site and doy"""
+
+    groups = {}
+    for src_dir in src_dirs:
+        for dir_path, _, filenames in os.walk(src_dir):
+            for filename in sorted(fnmatch.filter(filenames, glob_str)):
+                # the first 7 chars of filename are site and doy
+                name = filename[0:7].lower()
+                groups.setdefault(name, []).append(
+                    os.path.join(dir_path, filename))
+            # only the top directory if --recursive is not setted
+            if not recursive:
+                break
+
+    return groups
+
+
+# name: site and doy, files: trimble files of the group,
+# out_dir: output directory, year: year of data observation
+@profiler.staged('execute')
+def convert_group(name, files, out_dir, year):
+    """Convert trimble files of a site and doy to RINEX in a process,
+    return a list of failed files with the reason"""
+
+    failed, dat_files, converted = [], [], []
+    # path of output files
+    rnxfilepath = os.path.join(out_dir, name + '0.' + year + 'o')
+    gfilepath = os.path.join(out_dir, name + '0.' + year + 'g')
+    nfilepath = os.path.join(out_dir, name + '0.' + year + 'n')
+    # every job has its own scratch directory, removed when it finishes
+    with tempfile.TemporaryDirectory(prefix=name + '-',
+                                     dir=out_dir) as scratch:
+        for file in files:
+            # run runpkr00, the new DAT file is the output of the file
+            before = set(os.listdir(scratch))
+            try:
+                result = toolrun.call(['runpkr00', '-d', file, scratch])
+            except OSError as error:
+                # runpkr00 is missing or could not be started
+                failed.append('%s (runpkr00 %s)' %(
+                    os.path.basename(file), error.strerror or error))
+                continue
+            new_dats = [dat for dat in set(os.listdir(scratch)) - before
+                        if dat.upper().endswith('.DAT')]
+            if result.status != 0 or not new_dats:
+                failed.append('%s (runpkr00 %s)' %(
+                    os.path.basename(file), toolrun.describe(result)))
+                continue
+            dat_files += [os.path.join(scratch, dat) for dat in new_dats]
+            converted.append(file)
+        if not dat_files:
+            return failed
         # run teqc
-        print('generate file: %s %s %s ......' %(rinexfile, nfile, gfile))
-        command = ('teqc +nav ' + nfilepath + ',' + gfilepath + 
-                    ' ' + datfile + ' > ' + rnxfilepath)
-        os.system(command)
+        args = ['teqc', '+nav', nfilepath + ',' + gfilepath,
+                *sorted(dat_files)]
+        try:
+            with open(rnxfilepath, 'w') as rnx_writer:
+                result = toolrun.call(args, stdout=rnx_writer)
+            reason = None if result.status == 0 else toolrun.describe(result)
+        except OSError as error:
+            # teqc is missing or the output could not be written
+            reason = error.strerror or str(error)
+    if reason is not None:
+        # remove the broken output, files passed to teqc are failed
+        for filepath in (rnxfilepath, gfilepath, nfilepath):
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        failed += ['%s (teqc %s)' %(os.path.basename(file), reason)
+                   for file in converted]
+
+    return failed
 
 
 # args: user input arguments
@@ -80,9 +122,7 @@ def main(args):
         return 1
     year = str(year)[-2:]
 
-    tempdir = os.path.join(out_dir, 'temp')
     createdir(out_dir)
-    createdir(tempdir)
 
     print('---------------------- input params ----------------------')
     print('source dirs: %s' %src_dir)
@@ -90,13 +130,23 @@ def main(args):
     print('file mode: %s' %glob_str)
     print('year of data: %s' %year)
     print('----------------------------------------------------------\n')
-    
-    # Convert t00 file to dat and output to tempdir
-    for inputdir in glob.glob(src_dir):
-        trimble2dat(inputdir, tempdir, year, glob_str, args.recursive)
-    # Convert dat file to RINEX
-    dat2rnx(tempdir, out_dir, year)
-    shutil.rmtree(tempdir)
+
+    # group files of every site and doy, and convert groups in processes
+    groups = group_files(glob.glob(src_dir), glob_str, args.recursive)
+    conv_args = ((name, files, out_dir, year)
+                 for name, files in groups.items())
+    window = MAX_PROCESS * taskpool.WINDOW_PER_WORKER
+    failed = []
+    with futures.ProcessPoolExecutor(max_workers=MAX_PROCESS) as executor:
+        task_iter = taskpool.imap_unordered(executor, convert_group,
+                                            conv_args, window)
+        for (name, files, _, _), res in task_iter:
+            if len(res) < len(files):
+                print('generate file: %s0.%so (%d files)' %(
+                    name, year, len(files) - len(res)))
+            failed += res
+    if failed:
+        print('\nConvert failed files: %s' %', '.join(failed))
 
     return 0
 
@@ -110,7 +160,7 @@ def init_args():
 
     # add arguments
     parser.add_argument('-v', '--version', action='version',
-                        version='trimble2rnx.py 0.1.4')
+                        version='trimble2rnx.py 0.2.0')
     parser.add_argument('-r', '--recursive', action='store_true',
                         help='search file in subfolders')
     parser.add_argument('-yr', metavar='<year>', required=True,
@@ -126,4 +176,4 @@ def init_args():
 
 
 if __name__ == '__main__':
-    init_args()
+    profiler.run(init_args)
@@ -4,7 +4,12 @@
 using concurent.futures.
 
 The RINEX file edit function rely on TEQC software, Check if you have
-installed TEQC by typing `teqc -help` in cmd.
+installed TEQC by typing `teqc -help` in cmd. If only header records
+need to be changed, the header is rewritten natively and the body is
+copied using zero-copy system calls. Decimation, system removal and
+observation types are applied by a native streaming filter, unless the
+TEQC engine is chosen. Files compressed by compress, gzip, bzip2 or xz
+are decompressed in a stream, the output files are not compressed.
 
 :author: Jon Jiang
 :email: jiangyingming@live.com
@@ -12,16 +17,25 @@ installed TEQC by typing `teqc -help` in cmd.
 from concurrent import futures
 from textwrap import shorten
 import argparse
+import functools
 import glob
 import itertools
 import os
 import re
-import subprocess
+import shutil
 import sys
 
 import tqdm
 import yaml
 
+import compressed
+import profiler
+import rinex
+import rnxname
+import taskpool
+import telemetry
+import toolrun
+
 MAX_THREADING = max(6, os.cpu_count())
 ALPHAREG = re.compile(r'[a-z]+\s*', re.I)
 TEQCITEM = {
@@ -31,6 +45,7 @@ TEQCITEM = {
 }
 
 
+@profiler.staged('plan')
 def get_info(site, sitesinfo):
     """Get site information from sitesinfo. Use 'all' as default if a
     site or a item not found in sitesinfo.
@@ -56,40 +71,42 @@ def get_info(site, sitesinfo):
 
 
 def arg_wraper(key, value):
-    """Make argument for TEQC software by key, value, return a tuple.
+    """Make arguments for TEQC software by key, value, return a tuple
+    of arguments passed to TEQC directly without a shell.
 
     Example:
 
     >>> arg_wraper('rm_sys', ['R', 'E'])
-    ('', '-R -E')
+    ('-R', '-E')
 
     >>> arg_wraper('obs_type', ['C1', 'P1', 'L1'])
     ('-O.obs', 'C1,P1,L1')
 
     >>> arg_wraper('antenna', 'TRM59900.00     SCIS')
-    ('-O.at', '"TRM59900.00     SCIS"')
+    ('-O.at', 'TRM59900.00     SCIS')
+
+    >>> arg_wraper('position', '-2148744.84 4426642.96 4044657.85')
+    ('-O.px', '-2148744.84', '4426642.96', '4044657.85')
 
     >>> arg_wraper('interval', 30)
     ('-O.dec', '30')
     """
     if key == 'rm_sys':
-        argument = '-' + ' -'.join(value)
-    elif key == 'obs_type':
-        argument = ','.join(value)
+        return tuple('-' + system for system in value)
+    if key == 'obs_type':
+        arguments = ','.join(value),
     elif ALPHAREG.match(str(value)):
-        argument = '"{}"'.format(value)
+        # text with spaces is one argument
+        arguments = str(value),
     else:
-        argument = str(value)
+        # numbers, e.g. position, are separate arguments
+        arguments = tuple(str(value).split())
 
-    return TEQCITEM[key], argument
+    return (TEQCITEM[key], *arguments)
 
 
-def make_args(src_file, sitesinfo):
-    """Get arguments for teqc function."""
-    site = os.path.basename(src_file)[0:4]
-    # get configuration for site
-    siteinfo = get_info(site, sitesinfo)
-    # make an arguments list by site configuration
+def teqc_args(siteinfo):
+    """Make an arguments list for TEQC software by site configuration."""
     arguments = []
     for key, value in siteinfo.items():
         arguments.extend(arg_wraper(key, value))
@@ -97,19 +114,201 @@ def make_args(src_file, sitesinfo):
     return arguments
 
 
-def teqc(src_file, args, out_dir, keep):
+@profiler.staged('parse')
+def needs_epochs(header, siteinfo):
+    """Check if epochs of a RINEX file must be edited for interval,
+    rm_sys or obs_type in siteinfo, return True or False.
+
+    Example:
+
+    >>> header = ['     2.11           OBSERVATION DATA    G (GPS)'.ljust(60)
+    ...           + 'RINEX VERSION / TYPE',
+    ...           '     2    L1    C1'.ljust(60) + '# / TYPES OF OBSERV',
+    ...           '    30.000'.ljust(60) + 'INTERVAL']
+    >>> needs_epochs(header, {'interval': 30, 'rm_sys': ['R', 'E']})
+    False
+    >>> needs_epochs(header, {'interval': 30, 'obs_type': ['L1', 'L2']})
+    True
+    >>> needs_epochs(header, {'interval': 15})
+    True
+    """
+    if 'interval' in siteinfo:
+        interval = next((float(line[0:10]) for line in header
+                         if rinex.label(line) == 'INTERVAL'), None)
+        if interval != float(siteinfo['interval']):
+            return True
+    if 'rm_sys' in siteinfo:
+        # blank satellite system means GPS, M means mixed systems
+        system = header[0][40:41].strip() or 'G'
+        if system == 'M' or system in siteinfo['rm_sys']:
+            return True
+    if 'obs_type' in siteinfo:
+        if rinex.obs_types(header) != list(siteinfo['obs_type']):
+            return True
+
+    return False
+
+
+@profiler.staged('parse')
+def read_header(src_reader):
+    """Read header lines from a binary reader, return header lines, size
+    of header in bytes and the line break.
+    """
+    header, size, newline = [], 0, b'\n'
+    for line in src_reader:
+        size += len(line)
+        newline = b'\r\n' if line.endswith(b'\r\n') else b'\n'
+        header.append(line.decode('ascii', 'replace').rstrip('\r\n'))
+        if rinex.label(header[-1]) == 'END OF HEADER':
+            break
+
+    return header, size, newline
+
+
+def dst_path(src_file, out_dir):
+    """Return destination path of a RINEX Obs file, which is not
+    compressed.
+
+    Example:
+
+    >>> dst_path('bjfs0420.17o.Z', 'unificated').replace('\\\\', '/')
+    'unificated/bjfs0420.17o'
+    """
+    return os.path.join(out_dir, compressed.strip(os.path.basename(src_file)))
+
+
+def copy_body(src_reader, dst_writer, offset):
+    """Copy bytes of src_reader from offset to the end into dst_writer,
+    using copy_file_range or sendfile if the system supports.
+    """
+    dst_writer.flush()
+    src_fd, dst_fd = src_reader.fileno(), dst_writer.fileno()
+    count = os.fstat(src_fd).st_size - offset
+    for syscall in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, syscall):
+            continue
+        try:
+            while count > 0:
+                if syscall == 'copy_file_range':
+                    sent = os.copy_file_range(src_fd, dst_fd, count, offset)
+                else:
+                    sent = os.sendfile(dst_fd, src_fd, offset, count)
+                if sent == 0:
+                    break
+                offset, count = offset + sent, count - sent
+            return
+        except OSError:
+            # not supported by the file system, try the next way
+            continue
+    src_reader.seek(offset)
+    dst_writer.seek(0, os.SEEK_END)
+    shutil.copyfileobj(src_reader, dst_writer)
+
+
+def rewrite_header(src_file, header, size, newline, siteinfo, out_dir, keep):
+    """Rewrite header records of a RINEX Obs file natively, and copy the
+    observation body without change.
+    """
+    dst_file = dst_path(src_file, out_dir)
+    items = {key: value for key, value in siteinfo.items()
+             if key in rinex.HEADER_ITEMS}
+    header = rinex.edit_header(header, items)
+    try:
+        with compressed.open_pipe(src_file) as src_reader, \
+                open(dst_file, 'wb') as dst_writer:
+            for line in header:
+                dst_writer.write(line.encode('ascii', 'replace') + newline)
+            if compressed.suffix(src_file):
+                # a stream is copied after the old header is skipped
+                src_reader.read(size)
+                shutil.copyfileobj(src_reader, dst_writer)
+            else:
+                copy_body(src_reader, dst_writer, size)
+    except compressed.ERRORS:
+        # if rewrite failed, remove the truncated dest file
+        if os.path.exists(dst_file):
+            os.remove(dst_file)
+        return os.path.basename(src_file)
+    # remove source file if keep is False when successful
+    if not keep:
+        os.remove(src_file)
+
+    return
+
+
+def filter_file(src_file, siteinfo, out_dir, keep):
+    """Edit epochs of a RINEX Obs file using the native streaming filter
+    for interval, rm_sys and obs_type, and edit header records.
+    """
+    filename = os.path.basename(src_file)
+    dst_file = dst_path(src_file, out_dir)
+    items = {key: value for key, value in siteinfo.items()
+             if key in rinex.HEADER_ITEMS}
+    interval = float(siteinfo['interval']) if 'interval' in siteinfo else None
+    try:
+        with compressed.open_pipe(src_file, 'rt') as src_reader, \
+                open(dst_file, 'w') as dst_writer:
+            lines = rinex.filter_epochs(src_reader, interval,
+                                        siteinfo.get('rm_sys', ()),
+                                        siteinfo.get('obs_type'))
+            header = rinex.edit_header(rinex.read_header(lines), items)
+            dst_writer.writelines(line + '\n' for line in header)
+            dst_writer.writelines(line + '\n' for line in lines)
+    except (OSError, ValueError, IndexError):
+        # if filter failed, remove dest file and return filename
+        if os.path.exists(dst_file):
+            os.remove(dst_file)
+        return filename
+    # remove source file if keep is False when successful
+    if not keep:
+        os.remove(src_file)
+
+    return
+
+
+@profiler.staged('execute')
+def unificate(src_file, siteinfo, out_dir, keep, engine='native',
+              timeout=toolrun.TIMEOUT):
+    """Unificate a RINEX Obs file using site configuration, the epochs
+    are only edited if interval, rm_sys or obs_type require.
+    """
+    try:
+        with compressed.open(src_file, 'rb') as src_reader:
+            header, size, newline = read_header(src_reader)
+        if not needs_epochs(header, siteinfo):
+            return rewrite_header(src_file, header, size, newline,
+                                  siteinfo, out_dir, keep)
+        elif engine == 'teqc':
+            return teqc(src_file, teqc_args(siteinfo), out_dir, keep,
+                        timeout)
+        else:
+            return filter_file(src_file, siteinfo, out_dir, keep)
+    except (IndexError, *compressed.ERRORS):
+        return os.path.basename(src_file)
+
+
+def teqc(src_file, args, out_dir, keep, timeout=toolrun.TIMEOUT):
     """Run TEQC software to unificate a RINEX Obs file."""
     filename = os.path.basename(src_file)
-    dst_file = os.path.join(out_dir, filename)
-    # run TEQC, redirect stdout into dst_file, and ignore stderr
-    args = ' '.join(['teqc', *args, src_file])
-    with open(dst_file, 'w') as dst_writer:
-        status = subprocess.call(
-            args, stdout=dst_writer, stderr=subprocess.DEVNULL, shell=True)
-    # check exit status of teqc: {0: success, >0: error}
-    if status > 0:
+    dst_file = dst_path(src_file, out_dir)
+    # run TEQC, redirect stdout into dst_file, and ignore stderr, a
+    # compressed file is piped into stdin
+    if compressed.suffix(src_file):
+        args, stdin = ['teqc', *args], functools.partial(
+            compressed.open_pipe, src_file)
+    else:
+        args, stdin = ['teqc', *args, src_file], None
+    try:
+        with open(dst_file, 'w') as dst_writer:
+            status = toolrun.call(args, stdout=dst_writer, timeout=timeout,
+                                  stdin=stdin).status
+    except (OSError, ValueError):
+        status = None
+    # check exit status of teqc: {0: success, >0: error, None: timeout}
+    if status != 0:
         # if run teqc failed, remove dest file and return filename
-        os.remove(dst_file)
+        if os.path.exists(dst_file):
+            os.remove(dst_file)
         return filename
     # remove source file if keep is False when successful
     if not keep:
@@ -118,18 +317,28 @@ def teqc(src_file, args, out_dir, keep):
     return
 
 
-def parallel_run(function, argvs):
-    """Parallel run function using argvs, display a process bar."""
+def written_size(argv, res):
+    """Return bytes of the destination file written by a task."""
+    return telemetry.file_size(dst_path(argv[0], argv[2]))
+
+
+def parallel_run(function, argvs, recorder=None):
+    """Parallel run function using argvs, display a process bar. Every
+    file is measured if recorder of telemetry is given.
+    """
     # check platform, use ASCII process bar in Windows
     use_ascii = True if sys.platform == 'win32' else False
-    with futures.ThreadPoolExecutor(max_workers=MAX_THREADING) as executor:
-        todo_list = [executor.submit(function, *argv) for argv in argvs]
-        task_iter = futures.as_completed(todo_list)
+    window = MAX_THREADING * taskpool.WINDOW_PER_WORKER
+    with futures.ThreadPoolExecutor(max_workers=MAX_THREADING) as executor, \
+            tqdm.tqdm(total=0, ascii=use_ascii, unit='file') as progress:
+        argvs = taskpool.counted(argvs, progress)
+        function, argvs = telemetry.measure(recorder, function, argvs,
+                                            written_size)
+        task_iter = taskpool.imap_unordered(executor, function, argvs, window)
         failed_files = []
-        for future in tqdm.tqdm(
-                task_iter, total=len(todo_list), ascii=use_ascii, unit='file'):
+        for _, res in telemetry.collect(recorder, task_iter):
+            progress.update()
             # return None means task is success
-            res = future.result()
             if res:
                 failed_files.append(res)
 
@@ -144,7 +353,7 @@ def init_args():
     )
     # add arguments
     parser.add_argument('-v', '--version', action='version',
-                        version='%(prog)s 0.5.1')
+                        version='%(prog)s 0.10.0')
     parser.add_argument('-k', '--keep', action='store_true',
                         help='keep original file')
     parser.add_argument('-r', '--recursive', action='store_true',
@@ -154,6 +363,19 @@ def init_args():
                         help='configuration YAML file [default: _sitesinfo.yml]')
     parser.add_argument('-out', metavar='<directory>', default='unificated',
                         help='output directory [default: unificated in current]')
+    parser.add_argument('-engine', metavar='<engine>', default='native',
+                        choices=['native', 'teqc'],
+                        help='epoch edit engine, native or teqc '
+                             '[default: native]')
+    parser.add_argument('-timeout', metavar='<seconds>', type=float,
+                        default=toolrun.TIMEOUT,
+                        help='kill TEQC if it runs longer '
+                             '[default: {}]'.format(toolrun.TIMEOUT))
+    parser.add_argument('-telemetry', metavar='<file>',
+                        help='append telemetry of files into JSON lines')
+    parser.add_argument('-prom', metavar='<file>',
+                        help='write metrics for Prometheus textfile '
+                             'collector')
     parser.add_argument(dest='files', metavar='<file>', nargs='+',
                         help='file will be processed')
 
@@ -170,13 +392,20 @@ def main():
     # collect input globstrs into a glob list
     globs = [glob.iglob(globstr, recursive=recursive) for globstr in globstrs]
     files = itertools.chain(*globs)
-    # make input args for teqc function
-    teqc_args = ((src, make_args(src, infos), out_dir, keep_src) for src in files)
+    # make input args for unificate function
+    uni_args = ((src, get_info(rnxname.site_of(src), infos), out_dir,
+                 keep_src, args.engine, args.timeout) for src in files)
     print('Start processing: {}'.format(shorten(', '.join(globstrs), 62)))
     if not keep_src:
         print('Delete source files when complete')
+    recorder = telemetry.open_recorder('unificate', args.telemetry,
+                                       args.prom)
     # start parallel task, get a filename list of unificate failed.
-    failed = parallel_run(teqc, teqc_args)
+    try:
+        failed = parallel_run(unificate, uni_args, recorder)
+    finally:
+        if recorder is not None:
+            recorder.close()
     if failed:
         print('\nUnificate failed filename: {}'.format(', '.join(failed)))
     else:
@@ -186,4 +415,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    profiler.run(main)
@@ -13,7 +13,10 @@ import os
 import shutil
 import sys
 
+import profiler
 
+
+@profiler.staged('execute')
 def up2lower(src_file, out_dir, keep_src):
     """Rename filename, upper to lower:
     1. If out_dir is None, rename original file;
@@ -80,4 +83,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    profiler.run(main)